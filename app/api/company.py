@@ -1,10 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from typing import List, Optional
 from app.models.company import Company, CompanyCreate, CompanyUpdate
+from app.models.coupon import Coupon
 from app.models.user import User
 from app.core.auth import get_current_admin
-from app.db import get_db
+from app.core.companies import invalidate_company
+from app.core.write_behind import coupon_counters
+from app.db import get_db, get_reporting_db
+from app.schemas.company import iter_companies_by_admin
+from app.schemas.coupon import get_coupons_by_company
+from app.schemas.documents import with_id
+from app.utils.streaming import wants_ndjson, ndjson_response
+from app.utils.pagination import encode_cursor, decode_cursor
+from app.utils.barcode import encode_barcode, MAX_SEQUENCE
+from app.utils.responses import dumps, model_response
+from app.utils.raw_bson import raw_list_response, read_batches, response_projection
+from app.config import settings
+import bson
 from bson import ObjectId
+from pymongo import ReturnDocument
 from datetime import datetime
 
 router = APIRouter()
@@ -20,22 +34,56 @@ async def create_company(
     company_data["created_at"] = datetime.utcnow()
     
     result = await db.companies.insert_one(company_data)
-    created_company = await db.companies.find_one({"_id": result.inserted_id})
     
-    return {**created_company, "id": str(created_company["_id"])}
+    created = {**company_data, "id": str(result.inserted_id)}
+    if settings.FAST_RESPONSES:
+        return model_response(Company, created, status_code=status.HTTP_201_CREATED)
+    return created
 
 @router.get("/", response_model=List[Company])
 async def list_companies(
+    request: Request,
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from a previous X-Next-Cursor header"),
     current_user: User = Depends(get_current_admin),
-    db = Depends(get_db)
+    db = Depends(get_reporting_db)
 ):
-    companies = await db.companies.find(
-        {"admin_id": str(current_user.id)}
-    ).skip(skip).limit(limit).to_list(length=limit)
+    if wants_ndjson(request):
+        # Streaming export of every company; pagination parameters don't apply
+        return ndjson_response(iter_companies_by_admin(db, str(current_user.id)), Company)
+    
+    query = {"admin_id": str(current_user.id)}
+    if cursor is not None:
+        # Keyset pagination: seek on the (admin_id, _id) index instead of skipping
+        try:
+            query["_id"] = {"$gt": decode_cursor(cursor)}
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        skip = 0
+    
+    if settings.RAW_BSON_LISTS:
+        companies = bson.decode_all(await read_batches(
+            db.companies.find_raw_batches(query, projection=response_projection(Company))
+            .sort("_id", 1).skip(skip).limit(limit)
+        ))
+        if len(companies) == limit:
+            response.headers["X-Next-Cursor"] = encode_cursor(companies[-1]["id"])
+        return Response(dumps(companies), media_type="application/json", headers=dict(response.headers))
     
-    return [{**company, "id": str(company["_id"])} for company in companies]
+    companies = await db.companies.find(query).sort("_id", 1).skip(skip).limit(limit).to_list(length=limit)
+    
+    if len(companies) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(companies[-1]["_id"])
+    result = [with_id(company) for company in companies]
+    if settings.FAST_RESPONSES:
+        # A returned Response does not pick up headers set on the injected one
+        return model_response(Company, result, headers=dict(response.headers))
+    return result
 
 @router.get("/{company_id}", response_model=Company)
 async def get_company(
@@ -54,7 +102,8 @@ async def get_company(
             detail="Company not found"
         )
     
-    return {**company, "id": str(company["_id"])}
+    result = with_id(company)
+    return model_response(Company, result) if settings.FAST_RESPONSES else result
 
 @router.put("/{company_id}", response_model=Company)
 async def update_company(
@@ -63,26 +112,80 @@ async def update_company(
     current_user: User = Depends(get_current_admin),
     db = Depends(get_db)
 ):
-    company = await db.companies.find_one({
+    owned_company = {
         "_id": ObjectId(company_id),
         "admin_id": str(current_user.id)
-    })
+    }
+    update_data = company_update.dict(exclude_unset=True)
     
-    if not company:
+    # Ownership check, update and read-back in a single round trip
+    if update_data:
+        updated_company = await db.companies.find_one_and_update(
+            owned_company,
+            {"$set": update_data},
+            return_document=ReturnDocument.AFTER
+        )
+    else:
+        updated_company = await db.companies.find_one(owned_company)
+    
+    if not updated_company:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Company not found"
         )
     
-    update_data = company_update.dict(exclude_unset=True)
-    
-    await db.companies.update_one(
-        {"_id": ObjectId(company_id)},
-        {"$set": update_data}
+    result = with_id(updated_company)
+    return model_response(Company, result) if settings.FAST_RESPONSES else result
+
+@router.post("/{company_id}/barcodes", response_model=List[str], status_code=status.HTTP_201_CREATED)
+async def issue_barcodes(
+    company_id: str,
+    count: int = Query(1, ge=1, le=10000),
+    current_user: User = Depends(get_current_admin),
+    db = Depends(get_db)
+):
+    # Reserve a block of sequence numbers in one round trip; the codes themselves are computed
+    company = await db.companies.find_one_and_update(
+        {
+            "_id": ObjectId(company_id),
+            "admin_id": str(current_user.id),
+            "barcode_seq": {"$not": {"$gt": MAX_SEQUENCE - count}}
+        },
+        {"$inc": {"barcode_seq": count}},
+        projection={"barcode_seq": 1},
+        return_document=ReturnDocument.AFTER
     )
     
-    updated_company = await db.companies.find_one({"_id": ObjectId(company_id)})
-    return {**updated_company, "id": str(updated_company["_id"])}
+    if not company:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Company not found or out of barcodes"
+        )
+    
+    last = company["barcode_seq"]
+    return [encode_barcode(company_id, sequence) for sequence in range(last - count + 1, last + 1)]
+
+@router.get("/{company_id}/coupons", response_model=List[Coupon])
+async def list_company_coupons(
+    company_id: str,
+    current_user: User = Depends(get_current_admin),
+    db = Depends(get_reporting_db)
+):
+    company = await db.companies.find_one(
+        {"_id": ObjectId(company_id), "admin_id": str(current_user.id)},
+        projection={"_id": 1}
+    )
+    if not company:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Company not found or you don't have permission"
+        )
+    # Buffered write-behind increments only exist in Python, so counts need the decoded path then
+    if settings.RAW_BSON_LISTS and not coupon_counters.enabled:
+        return raw_list_response(
+            db.coupons.find_raw_batches({"company_id": company_id}, projection=response_projection(Coupon))
+        )
+    return await get_coupons_by_company(db, company_id)
 
 @router.delete("/{company_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_company(
@@ -90,16 +193,19 @@ async def delete_company(
     current_user: User = Depends(get_current_admin),
     db = Depends(get_db)
 ):
-    company = await db.companies.find_one({
-        "_id": ObjectId(company_id),
-        "admin_id": str(current_user.id)
-    })
+    deleted_company = await db.companies.find_one_and_delete(
+        {
+            "_id": ObjectId(company_id),
+            "admin_id": str(current_user.id)
+        },
+        projection={"_id": 1}
+    )
     
-    if not company:
+    if not deleted_company:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Company not found"
         )
     
-    await db.companies.delete_one({"_id": ObjectId(company_id)})
+    invalidate_company(company_id)
     return None
\ No newline at end of file
@@ -0,0 +1,271 @@
+import asyncio
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from pymongo.errors import DuplicateKeyError
+from app.models.coupon import (
+    StampRequest, StampResponse, RedeemRequest, RedeemResponse, StampBatchRequest, StampBatchResponse
+)
+from app.models.coupon_event import CouponEvent
+from app.models.user import User, UserRole
+from app.core.auth import get_current_admin, get_current_user
+from app.core.barcode_images import MEDIA_TYPES, render_barcode_image
+from app.core.companies import get_company_owner, get_company_rules
+from app.core.idempotency import IdempotencyKeyReused, get_idempotency_key, idempotent_request
+from app.core.wallets import invalidate_wallet
+from app.config import settings
+from app.db import get_db
+from app.utils.barcode import barcode_company, validate_barcodes
+from app.utils.pagination import encode_cursor, decode_cursor
+from bson import ObjectId
+from app.schemas.coupon import stamp_coupon, stamp_coupons_batch, redeem_coupon, get_coupon_by_barcode_and_client
+from app.schemas.documents import with_id
+
+router = APIRouter()
+
+async def _check_company_owner(db, company_id: str, current_user: User) -> None:
+    # Ownership comes from the company cache, so a warm request pays no extra read
+    if await get_company_owner(db, company_id) != str(current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Company not found or you don't have permission"
+        )
+
+def _check_barcode(company_id: str, barcode: str) -> None:
+    # The check character and embedded company id reject bad scans without a round trip
+    if settings.BARCODE_STRICT and barcode_company(barcode) != company_id:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Invalid barcode"
+        )
+
+@router.post("/stamp", response_model=StampResponse)
+async def stamp(
+    request: StampRequest,
+    idempotency_key: Optional[str] = Depends(get_idempotency_key),
+    pos_id: Optional[str] = Header(None, alias="X-POS-ID", max_length=64),
+    current_user: User = Depends(get_current_admin),
+    db = Depends(get_db)
+):
+    keyed = idempotent_request(idempotency_key, str(current_user.id), "stamp", request)
+    if keyed and (replay := keyed.cached_response()) is not None:
+        return replay
+    _check_barcode(request.company_id, request.barcode)
+    await _check_company_owner(db, request.company_id, current_user)
+    # A keyed stamp is written through even in write-behind mode: the key is
+    # recorded in the same update, so a retry can never stamp twice
+    try:
+        coupon, rules = await asyncio.gather(
+            stamp_coupon(
+                db, request.company_id, request.barcode, request.client_id,
+                idempotency_key=keyed and keyed.record_id, actor_id=str(current_user.id), pos_id=pos_id,
+                fingerprint=keyed and keyed.fingerprint
+            ),
+            get_company_rules(db, request.company_id),
+        )
+    except DuplicateKeyError:
+        raise _barcode_conflict()
+    except IdempotencyKeyReused:
+        raise keyed.key_reused()
+    invalidate_wallet(request.client_id)
+    result = _stamp_result(coupon, rules)
+    return keyed.remember(result) if keyed else result
+
+def _barcode_conflict() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Barcode is already registered to another company"
+    )
+
+def _stamp_result(coupon, rules) -> dict:
+    return {
+        **coupon.model_dump(mode="json"),
+        "unlocked_rewards": [rule._asdict() for rule in rules.unlocked(coupon.count - 1, coupon.count)],
+        "stamps_to_next_reward": rules.stamps_to_next_reward(coupon.count),
+    }
+
+@router.post("/stamps:batch", response_model=StampBatchResponse)
+async def stamp_batch(
+    request: StampBatchRequest,
+    idempotency_key: Optional[str] = Depends(get_idempotency_key),
+    pos_id: Optional[str] = Header(None, alias="X-POS-ID", max_length=64),
+    current_user: User = Depends(get_current_admin),
+    db = Depends(get_db)
+):
+    keyed = idempotent_request(idempotency_key, str(current_user.id), "stamps:batch", request)
+    if keyed and (replay := keyed.cached_response()) is not None:
+        return replay
+    await _check_company_owner(db, request.company_id, current_user)
+    # A batch spans many coupons, so its key is claimed in idempotency_keys first;
+    # the extra round trip is spread over the whole batch
+    if keyed and (replay := await keyed.claim(db)) is not None:
+        return replay
+    invalid = set()
+    if settings.BARCODE_STRICT:
+        companies = validate_barcodes(item.barcode for item in request.stamps)
+        invalid = {item.barcode for item, company_id in zip(request.stamps, companies) if company_id != request.company_id}
+    # Repeated (barcode, client_id) pairs collapse into one $inc
+    totals = {}
+    for item in request.stamps:
+        if item.barcode in invalid:
+            continue
+        key = (item.barcode, item.client_id)
+        totals[key] = totals.get(key, 0) + item.n
+    try:
+        failed = await stamp_coupons_batch(
+            db, request.company_id, totals, idempotency_key=keyed and keyed.record_id,
+            actor_id=str(current_user.id), pos_id=pos_id
+        ) if totals else set()
+    except Exception:
+        # Each coupon records the key with its stamps, so even after a partial
+        # write a retry under the same key skips the coupons already stamped
+        if keyed:
+            await keyed.release(db)
+        raise
+    for client_id in {client_id for _, client_id in totals}:
+        invalidate_wallet(client_id)
+    results = [
+        status.HTTP_422_UNPROCESSABLE_ENTITY if item.barcode in invalid
+        else status.HTTP_409_CONFLICT if (item.barcode, item.client_id) in failed
+        else status.HTTP_200_OK
+        for item in request.stamps
+    ]
+    result = {
+        "stamped": sum(n for key, n in totals.items() if key not in failed),
+        "results": results,
+    }
+    return await keyed.complete(db, result) if keyed else result
+
+@router.post("/redeem", response_model=RedeemResponse)
+async def redeem(
+    request: RedeemRequest,
+    idempotency_key: Optional[str] = Depends(get_idempotency_key),
+    pos_id: Optional[str] = Header(None, alias="X-POS-ID", max_length=64),
+    current_user: User = Depends(get_current_admin),
+    db = Depends(get_db)
+):
+    keyed = idempotent_request(idempotency_key, str(current_user.id), "redeem", request)
+    if keyed and (replay := keyed.cached_response()) is not None:
+        return replay
+    _check_barcode(request.company_id, request.barcode)
+    await _check_company_owner(db, request.company_id, current_user)
+    rules = await get_company_rules(db, request.company_id)
+    # Default to the cheapest reward
+    rule = rules.cheapest() if request.rule_id is None else rules.get(request.rule_id)
+    if rule is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Rule not found"
+        )
+    try:
+        coupon = await redeem_coupon(
+            db, request.company_id, request.barcode, request.client_id, rule.required_coupons,
+            idempotency_key=keyed and keyed.record_id, actor_id=str(current_user.id), pos_id=pos_id,
+            rule_id=rule.rule_id, fingerprint=keyed and keyed.fingerprint
+        )
+    except IdempotencyKeyReused:
+        raise keyed.key_reused()
+    if coupon is None:
+        # Only the failure path pays for a second read to explain itself
+        existing = await get_coupon_by_barcode_and_client(db, request.barcode, request.client_id)
+        if existing is None or existing.company_id != request.company_id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Coupon not found"
+            )
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Not enough coupons: {existing.count} of {rule.required_coupons} required"
+        )
+    invalidate_wallet(request.client_id)
+    result = {**coupon.model_dump(mode="json"), "redeemed_reward": rule._asdict()}
+    return keyed.remember(result) if keyed else result
+
+async def _get_visible_coupon(db, coupon_id: str, current_user: User, *fields: str) -> dict:
+    coupon = None
+    if ObjectId.is_valid(coupon_id):
+        coupon = await db.coupons.find_one(
+            {"_id": ObjectId(coupon_id)},
+            projection=dict.fromkeys(("company_id", "client_id", *fields), 1)
+        )
+    # Visible to the client holding the coupon and to the company's admin
+    if coupon is None:
+        owner_id = None
+    elif current_user.role == UserRole.CLIENT:
+        owner_id = coupon["client_id"]
+    else:
+        owner_id = await get_company_owner(db, coupon["company_id"])
+    if owner_id != str(current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Coupon not found"
+        )
+    return coupon
+
+@router.get("/{coupon_id}/events", response_model=List[CouponEvent])
+async def list_coupon_events(
+    coupon_id: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from a previous X-Next-Cursor header"),
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    await _get_visible_coupon(db, coupon_id, current_user)
+    # Newest first, seeking on the (coupon_id, _id) index
+    query = {"coupon_id": coupon_id}
+    if cursor is not None:
+        try:
+            query["_id"] = {"$lt": decode_cursor(cursor)}
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+    events = await db.coupon_events.find(query).sort("_id", -1).limit(limit).to_list(length=limit)
+    if len(events) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(events[-1]["_id"])
+    return [with_id(event) for event in events]
+
+async def _barcode_image(request: Request, db, coupon_id: str, current_user: User, image_format: str, scale: int) -> Response:
+    coupon = await _get_visible_coupon(db, coupon_id, current_user, "barcode")
+    try:
+        image = render_barcode_image(coupon["barcode"], image_format, scale)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Barcode cannot be rendered as Code 128"
+        )
+    # Same barcode and scale, same bytes: clients may keep the image forever
+    headers = {"ETag": image.etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or image.etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(image.body, media_type=MEDIA_TYPES[image_format], headers=headers)
+
+@router.get(
+    "/{coupon_id}/barcode.svg",
+    response_class=Response,
+    responses={200: {"content": {"image/svg+xml": {}}}, 304: {"description": "Not Modified"}}
+)
+async def get_barcode_svg(
+    coupon_id: str,
+    request: Request,
+    scale: int = Query(2, ge=1, le=10, description="Pixels per bar module"),
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    return await _barcode_image(request, db, coupon_id, current_user, "svg", scale)
+
+@router.get(
+    "/{coupon_id}/barcode.png",
+    response_class=Response,
+    responses={200: {"content": {"image/png": {}}}, 304: {"description": "Not Modified"}}
+)
+async def get_barcode_png(
+    coupon_id: str,
+    request: Request,
+    scale: int = Query(2, ge=1, le=10, description="Pixels per bar module"),
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    return await _barcode_image(request, db, coupon_id, current_user, "png", scale)
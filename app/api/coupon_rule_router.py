@@ -1,10 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from typing import List
 from app.models.coupon_rule import CouponRule, CouponRuleCreate, CouponRuleUpdate, CouponRuleInDB
 from app.models.user import User
 from app.core.auth import get_current_admin
-from app.db import get_db
+from app.core.companies import invalidate_company_rules
+from app.db import get_db, get_reporting_db
+from app.schemas.coupon_rule import iter_coupon_rules_by_company
+from app.schemas.documents import with_id
+from app.utils.streaming import wants_ndjson, ndjson_response
+from app.utils.responses import model_response
+from app.utils.raw_bson import raw_list_response, response_projection
+from app.config import settings
 from bson import ObjectId
+from pymongo import ReturnDocument
 
 router = APIRouter()
 
@@ -31,15 +39,21 @@ async def create_coupon_rule(
             detail="Required coupons must be greater than 0"
         )
     rule_data = rule.model_dump()
+    # Denormalized owner so later reads and writes need no companies lookup
+    rule_data["admin_id"] = str(current_user.id)
     result = await db.coupon_rules.insert_one(rule_data)
-    created_rule = await db.coupon_rules.find_one({"_id": result.inserted_id})
-    return {**created_rule, "id": str(created_rule["_id"])}
+    invalidate_company_rules(rule.company_id)
+    created = {**rule_data, "id": str(result.inserted_id)}
+    if settings.FAST_RESPONSES:
+        return model_response(CouponRule, created, status_code=status.HTTP_201_CREATED)
+    return created
 
 @router.get("/company/{company_id}", response_model=List[CouponRule])
 async def list_company_rules(
     company_id: str,
+    request: Request,
     current_user: User = Depends(get_current_admin),
-    db = Depends(get_db)
+    db = Depends(get_reporting_db)
 ):
     # Verify company exists and belongs to admin
     company = await db.companies.find_one({
@@ -51,8 +65,29 @@ async def list_company_rules(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Company not found or you don't have permission"
         )
-    rules = await db.coupon_rules.find({"company_id": company_id}).to_list(length=100)
-    return [{**rule, "id": str(rule["_id"])} for rule in rules]
+    if wants_ndjson(request):
+        return ndjson_response(iter_coupon_rules_by_company(db, company_id), CouponRule)
+    if settings.RAW_BSON_LISTS:
+        return raw_list_response(
+            db.coupon_rules.find_raw_batches({"company_id": company_id}, projection=response_projection(CouponRule))
+        )
+    rules = await db.coupon_rules.find({"company_id": company_id}).to_list(length=None)
+    result = [with_id(rule) for rule in rules]
+    return model_response(CouponRule, result) if settings.FAST_RESPONSES else result
+
+async def _rule_access_error(db, rule_id: str, action: str) -> HTTPException:
+    # Only reached when the owned-rule query missed: tell a missing rule apart
+    # from one that belongs to another admin
+    rule = await db.coupon_rules.find_one({"_id": ObjectId(rule_id)}, projection={"_id": 1})
+    if not rule:
+        return HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Rule not found"
+        )
+    return HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail=f"You don't have permission to {action} this rule"
+    )
 
 @router.get("/{rule_id}", response_model=CouponRule)
 async def get_coupon_rule(
@@ -60,23 +95,15 @@ async def get_coupon_rule(
     current_user: User = Depends(get_current_admin),
     db = Depends(get_db)
 ):
-    rule = await db.coupon_rules.find_one({"_id": ObjectId(rule_id)})
-    if not rule:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Rule not found"
-        )
-    # Verify company belongs to admin
-    company = await db.companies.find_one({
-        "_id": ObjectId(rule["company_id"]),
+    # admin_id is stamped on every rule, so ownership is part of the lookup
+    rule = await db.coupon_rules.find_one({
+        "_id": ObjectId(rule_id),
         "admin_id": str(current_user.id)
     })
-    if not company:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You don't have permission to access this rule"
-        )
-    return {**rule, "id": str(rule["_id"])}
+    if not rule:
+        raise await _rule_access_error(db, rule_id, "access")
+    result = with_id(rule)
+    return model_response(CouponRule, result) if settings.FAST_RESPONSES else result
 
 @router.put("/{rule_id}", response_model=CouponRule)
 async def update_coupon_rule(
@@ -85,34 +112,42 @@ async def update_coupon_rule(
     current_user: User = Depends(get_current_admin),
     db = Depends(get_db)
 ):
-    rule = await db.coupon_rules.find_one({"_id": ObjectId(rule_id)})
-    if not rule:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Rule not found"
-        )
-    # Verify company belongs to admin
-    company = await db.companies.find_one({
-        "_id": ObjectId(rule["company_id"]),
-        "admin_id": str(current_user.id)
-    })
-    if not company:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You don't have permission to update this rule"
-        )
     update_data = rule_update.model_dump(exclude_unset=True)
     if "required_coupons" in update_data and update_data["required_coupons"] <= 0:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Required coupons must be greater than 0"
         )
-    await db.coupon_rules.update_one(
-        {"_id": ObjectId(rule_id)},
-        {"$set": update_data}
-    )
-    updated_rule = await db.coupon_rules.find_one({"_id": ObjectId(rule_id)})
-    return {**updated_rule, "id": str(updated_rule["_id"])}
+    if "company_id" in update_data:
+        # Moving a rule requires owning the target company as well
+        company = await db.companies.find_one({
+            "_id": ObjectId(update_data["company_id"]),
+            "admin_id": str(current_user.id)
+        })
+        if not company:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Company not found or you don't have permission"
+            )
+    owned_rule = {
+        "_id": ObjectId(rule_id),
+        "admin_id": str(current_user.id)
+    }
+    if update_data:
+        updated_rule = await db.coupon_rules.find_one_and_update(
+            owned_rule,
+            {"$set": update_data},
+            return_document=ReturnDocument.AFTER
+        )
+    else:
+        updated_rule = await db.coupon_rules.find_one(owned_rule)
+    if not updated_rule:
+        raise await _rule_access_error(db, rule_id, "update")
+    if update_data:
+        # A moved rule also leaves its previous company, which we no longer know
+        invalidate_company_rules(None if "company_id" in update_data else updated_rule["company_id"])
+    result = with_id(updated_rule)
+    return model_response(CouponRule, result) if settings.FAST_RESPONSES else result
 
 @router.delete("/{rule_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_coupon_rule(
@@ -120,21 +155,14 @@ async def delete_coupon_rule(
     current_user: User = Depends(get_current_admin),
     db = Depends(get_db)
 ):
-    rule = await db.coupon_rules.find_one({"_id": ObjectId(rule_id)})
-    if not rule:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Rule not found"
-        )
-    # Verify company belongs to admin
-    company = await db.companies.find_one({
-        "_id": ObjectId(rule["company_id"]),
-        "admin_id": str(current_user.id)
-    })
-    if not company:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You don't have permission to delete this rule"
-        )
-    await db.coupon_rules.delete_one({"_id": ObjectId(rule_id)})
-    return None 
\ No newline at end of file
+    deleted_rule = await db.coupon_rules.find_one_and_delete(
+        {
+            "_id": ObjectId(rule_id),
+            "admin_id": str(current_user.id)
+        },
+        projection={"_id": 1, "company_id": 1}
+    )
+    if not deleted_rule:
+        raise await _rule_access_error(db, rule_id, "delete")
+    invalidate_company_rules(deleted_rule["company_id"])
+    return None
\ No newline at end of file
@@ -0,0 +1,17 @@
+from typing import List
+from fastapi import APIRouter, Depends
+from app.models.coupon import WalletCoupon
+from app.models.user import User
+from app.core.auth import get_current_user
+from app.core.wallets import get_wallet
+from app.db import get_db
+
+router = APIRouter()
+
+@router.get("/wallet", response_model=List[WalletCoupon])
+async def get_my_wallet(
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    # One aggregation joins companies and rules, however many cafes the client visits
+    return await get_wallet(db, str(current_user.id))
@@ -1,13 +1,59 @@
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     MONGODB_URL: str = "mongodb://localhost:27017"
     DATABASE_NAME: str = "coupon_api"
+    CREATE_INDEXES_ON_STARTUP: bool = True
+    RUN_MIGRATIONS_ON_STARTUP: bool = True
+    MONGODB_MAX_POOL_SIZE: int = 100
+    MONGODB_MIN_POOL_SIZE: int = 0
+    MONGODB_MAX_IDLE_TIME_MS: Optional[int] = None
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS: Optional[int] = None
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS: int = 30000
+    MONGODB_COMPRESSORS: str = ""
+    MONGODB_READ_PREFERENCE: str = "primary"
+    MONGODB_REPORTING_READ_PREFERENCE: str = "primary"
+    MONGODB_SLOW_COMMAND_MS: float = 100
+    DB_SERVER_TIMING: bool = True
     SECRET_KEY: str = "your-secret-key-change-this-in-production"
     JWT_SECRET_KEY: str = "your-secret-key-change-this-in-production"
     JWT_ALGORITHM: str = "HS256"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    AUTH_VERIFIED_CLAIMS: bool = False
+    TOKEN_VERSION_REFRESH_SECONDS: int = 30
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 30
+    COMPANY_CACHE_SIZE: int = 10000
+    COMPANY_CACHE_TTL_SECONDS: int = 60
+    WALLET_CACHE_SIZE: int = 10000
+    WALLET_CACHE_TTL_SECONDS: int = 10
+    IDEMPOTENCY_KEY_TTL_SECONDS: int = 86400
+    IDEMPOTENCY_CACHE_SIZE: int = 10000
+    IDEMPOTENCY_OPS_PER_COUPON: int = 32
+    IDEMPOTENCY_LOCK_SECONDS: int = 30
+    WRITE_BEHIND_ENABLED: bool = False
+    WRITE_BEHIND_JOURNAL_DIR: str = "write-behind-journal"
+    WRITE_BEHIND_FLUSH_INTERVAL_MS: int = 200
+    WRITE_BEHIND_FLUSH_MAX_OPS: int = 1000
+    WRITE_BEHIND_FSYNC: bool = False
+    WRITE_BEHIND_NODE_ID: str = ""
+    LEDGER_JOURNAL_DIR: str = "ledger-journal"
+    LEDGER_JOURNAL_FSYNC: bool = False
+    LEDGER_BATCH_SIZE: int = 500
+    LEDGER_FLUSH_INTERVAL_MS: int = 250
+    LEDGER_COMPACT_INTERVAL_SECONDS: int = 60
+    LEDGER_COMPACT_LAG_SECONDS: int = 30
+    BARCODE_STRICT: bool = False
+    BARCODE_IMAGE_CACHE_SIZE: int = 2000
+    FAST_RESPONSES: bool = False
+    RAW_BSON_LISTS: bool = False
+    METRICS_ENABLED: bool = True
+    METRICS_MULTIPROCESS_DIR: str = ""
+    METRICS_FLUSH_SECONDS: float = 5.0
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_QUEUE: int = 64
 
     class Config:
         env_file = ".env"
@@ -7,6 +7,10 @@ from fastapi.security import OAuth2PasswordBearer
 from app.models.user import User, UserInDB
 from app.config import settings
 from app.db import get_db
+from app.core.hashing import hashing_pool, HashingPoolFull
+from app.core.revocation import token_versions
+from app.core.principals import principal_cache
+from app.schemas.documents import to_model, with_id
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
@@ -17,14 +21,28 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+async def _run_on_hashing_pool(fn, *args):
+    try:
+        return await hashing_pool.run(fn, *args)
+    except HashingPoolFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_on_hashing_pool(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_on_hashing_pool(get_password_hash, password)
+
 async def authenticate_user(email: str, password: str, db):
     user_doc = await db.users.find_one({"email": email})
     if not user_doc:
         return False
-    # Convert MongoDB _id to string and create UserInDB instance
-    user_doc["_id"] = str(user_doc["_id"])
-    user_db = UserInDB(**user_doc)
-    if not verify_password(password, user_db.hashed_password):
+    user_db = to_model(UserInDB, user_doc)
+    if not await verify_password_async(password, user_db.hashed_password):
         return False
     return user_db
 
@@ -35,6 +53,27 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.JWT_SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
     return encoded_jwt
 
+def create_user_access_token(user: UserInDB) -> str:
+    """Issue a token carrying the claims needed to authorize without a user lookup."""
+    return create_access_token(
+        data={
+            "sub": user.email,
+            "role": user.role,
+            "uid": str(user.id),
+            "name": user.name,
+            "ver": user.token_version,
+        },
+        expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+
+def _user_from_claims(payload: dict) -> Optional[User]:
+    if not all(payload.get(claim) is not None for claim in ("uid", "name", "role")):
+        return None
+    try:
+        return User(id=payload["uid"], email=payload["sub"], name=payload["name"], role=payload["role"])
+    except ValueError:
+        return None
+
 async def get_current_user(token: str = Depends(oauth2_scheme), db = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -48,10 +87,26 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db = Depends(get
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user_doc = await db.users.find_one({"email": email})
-    if user_doc is None:
+    token_version = payload.get("ver", 0)
+    if settings.AUTH_VERIFIED_CLAIMS:
+        # Fast path: the signature vouches for the claims, revocation is checked locally
+        user = _user_from_claims(payload)
+        if user is not None:
+            if token_version < await token_versions.current_version(db, user.id):
+                raise credentials_exception
+            return user
+
+    async def load_principal():
+        user_doc = await db.users.find_one({"email": email})
+        if user_doc is None:
+            return None
+        user = to_model(User, with_id(user_doc))
+        return user, user_doc.get("token_version", 0)
+
+    principal = await principal_cache.get_or_load(email, load_principal)
+    if principal is None or token_version < principal[1]:
         raise credentials_exception
-    return User(id=str(user_doc["_id"]), **{k: v for k, v in user_doc.items() if k != "_id"})
+    return principal[0]
 
 async def get_current_admin(current_user: User = Depends(get_current_user)):
     if current_user.role != "admin":
@@ -0,0 +1,28 @@
+import hashlib
+from typing import NamedTuple
+from app.config import settings
+from app.utils.cache import AsyncTTLCache
+from app.utils.code128 import render_png, render_svg
+
+MEDIA_TYPES = {"svg": "image/svg+xml", "png": "image/png"}
+_RENDERERS = {"svg": render_svg, "png": render_png}
+
+
+class BarcodeImage(NamedTuple):
+    body: bytes
+    etag: str
+
+
+# A barcode never changes, so entries live until LRU eviction
+barcode_images = AsyncTTLCache(maxsize=settings.BARCODE_IMAGE_CACHE_SIZE, ttl=float("inf"))
+
+
+def render_barcode_image(barcode: str, image_format: str, scale: int) -> BarcodeImage:
+    """Rendered Code 128 image of ``barcode``; raises ValueError if it cannot be encoded."""
+    key = (barcode, image_format, scale)
+    image = barcode_images.get(key)
+    if image is None:
+        body = _RENDERERS[image_format](barcode, scale)
+        image = BarcodeImage(body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+        barcode_images.set(key, image)
+    return image
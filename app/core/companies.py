@@ -0,0 +1,56 @@
+from typing import Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from bson import ObjectId
+from app.config import settings
+from app.core.rule_index import CompiledRules
+from app.utils.cache import AsyncTTLCache
+
+# Hot-path lookups for coupon issuance, keyed by company id. Writes through the
+# routers invalidate the local worker; other workers catch up within the TTL.
+company_owners = AsyncTTLCache(
+    maxsize=settings.COMPANY_CACHE_SIZE,
+    ttl=settings.COMPANY_CACHE_TTL_SECONDS,
+)
+# Values are CompiledRules, so rule evaluation never touches the database.
+company_rules = AsyncTTLCache(
+    maxsize=settings.COMPANY_CACHE_SIZE,
+    ttl=settings.COMPANY_CACHE_TTL_SECONDS,
+)
+
+
+async def get_company_owner(db: AsyncIOMotorDatabase, company_id: str) -> Optional[str]:
+    """Return the ``admin_id`` owning ``company_id``, or None if there is no such company."""
+    if not ObjectId.is_valid(company_id):
+        return None
+
+    async def load():
+        company = await db.companies.find_one({"_id": ObjectId(company_id)}, projection={"admin_id": 1})
+        return company["admin_id"] if company else None
+
+    return await company_owners.get_or_load(company_id, load)
+
+
+async def get_company_rules(db: AsyncIOMotorDatabase, company_id: str) -> CompiledRules:
+    """Return the company's compiled coupon rules."""
+
+    async def load():
+        rules = await db.coupon_rules.find(
+            {"company_id": company_id},
+            projection={"required_coupons": 1, "reward": 1}
+        ).to_list(length=None)
+        return CompiledRules(rules)
+
+    return await company_rules.get_or_load(company_id, load)
+
+
+def invalidate_company(company_id: str) -> None:
+    company_owners.invalidate(company_id)
+    company_rules.invalidate(company_id)
+
+
+def invalidate_company_rules(company_id: Optional[str] = None) -> None:
+    """Drop cached rules for ``company_id``, or for every company when it is unknown."""
+    if company_id is None:
+        company_rules.clear()
+    else:
+        company_rules.invalidate(company_id)
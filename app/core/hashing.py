@@ -0,0 +1,97 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+from app.config import settings
+
+T = TypeVar("T")
+
+
+class HashingPoolFull(Exception):
+    """Raised when the hashing pool already has its maximum number of jobs queued."""
+
+
+class HashingPool:
+    """Bounded thread pool for CPU-heavy password hashing.
+
+    bcrypt releases the GIL while it works, so running it on a dedicated pool keeps
+    the event loop free and lets hashing throughput scale with the number of cores.
+    Jobs beyond ``max_workers + max_queue`` are rejected instead of piling up.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queue_wait_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.max_queue_wait_seconds = 0.0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="password-hash"
+            )
+        return self._executor
+
+    def _release(self, queue_wait: float, duration: float) -> None:
+        self._pending -= 1
+        self.completed += 1
+        self.queue_wait_seconds += queue_wait
+        self.hash_seconds += duration
+        self.max_queue_wait_seconds = max(self.max_queue_wait_seconds, queue_wait)
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        """Run ``fn(*args)`` on the pool, raising HashingPoolFull when saturated."""
+        if self._pending >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise HashingPoolFull()
+
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+        timings = [0.0, 0.0]
+
+        def job():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                timings[0] = started - submitted
+                timings[1] = time.perf_counter() - started
+
+        # The counter is only touched on the loop thread, and it is released when the
+        # job actually finishes rather than when a (possibly cancelled) caller stops waiting.
+        self._pending += 1
+        future = self._get_executor().submit(job)
+        future.add_done_callback(
+            lambda _: loop.call_soon_threadsafe(self._release, timings[0], timings[1])
+        )
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        """Snapshot of queue depth and timing counters."""
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": min(self._pending, self.max_workers),
+            "queued": max(self._pending - self.max_workers, 0),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "queue_wait_seconds_total": self.queue_wait_seconds,
+            "hash_seconds_total": self.hash_seconds,
+            "max_queue_wait_seconds": self.max_queue_wait_seconds,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+hashing_pool = HashingPool(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    max_queue=settings.PASSWORD_HASH_MAX_QUEUE,
+)
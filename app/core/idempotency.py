@@ -0,0 +1,125 @@
+"""Idempotency-Key support for coupon writes.
+
+Retried requests carrying the same key get the first attempt's response back
+instead of writing again. Two stores back this up:
+
+* an in-process LRU of recent responses, which answers same-worker retries
+  without touching MongoDB;
+* durable records. Single-coupon writes record the key and the request
+  fingerprint inside the coupon update itself (see ``app.schemas.coupon``), so
+  a new key costs no extra round trip. A key reused for a different request is
+  therefore rejected when it reaches the same coupon, but one reused on another
+  coupon is only caught while the first response is still in the LRU.
+  Multi-document writes claim the key in the TTL-indexed
+  ``idempotency_keys`` collection before writing, for the response, and record
+  it in every coupon they stamp, so a retry after a partial write skips those.
+"""
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+from fastapi import Header, HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
+from app.config import settings
+from app.utils.cache import AsyncTTLCache
+
+# Values are (request fingerprint, response) pairs.
+recent_responses = AsyncTTLCache(
+    maxsize=settings.IDEMPOTENCY_CACHE_SIZE,
+    ttl=settings.IDEMPOTENCY_KEY_TTL_SECONDS,
+)
+
+
+def get_idempotency_key(
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", min_length=1, max_length=255)
+) -> Optional[str]:
+    return idempotency_key
+
+
+class IdempotencyKeyReused(Exception):
+    """Raised when a write finds its key recorded for a request with a different body."""
+
+
+class IdempotentRequest:
+    """A write made under an Idempotency-Key, scoped to its user and operation."""
+
+    def __init__(self, key: str, user_id: str, operation: str, body: BaseModel):
+        self.key = key
+        self.record_id = f"{user_id}:{operation}:{key}"
+        self.fingerprint = hashlib.sha256(body.model_dump_json().encode()).hexdigest()
+
+    @staticmethod
+    def key_reused() -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used for a different request"
+        )
+
+    def _check_fingerprint(self, fingerprint: str) -> None:
+        if fingerprint != self.fingerprint:
+            raise self.key_reused()
+
+    def cached_response(self) -> Optional[Any]:
+        entry = recent_responses.get(self.record_id)
+        if entry is None:
+            return None
+        fingerprint, response = entry
+        self._check_fingerprint(fingerprint)
+        return response
+
+    def remember(self, response: Any) -> Any:
+        recent_responses.set(self.record_id, (self.fingerprint, response))
+        return response
+
+    async def claim(self, db: AsyncIOMotorDatabase) -> Optional[Any]:
+        """Reserve the key, or return the stored response if it was already used.
+
+        A claim is a lease of IDEMPOTENCY_LOCK_SECONDS. A retry that finds the
+        lease expired, because its holder crashed or could not store the
+        response, takes the key over, so the write behind it must be safe to
+        run again.
+        """
+        now = datetime.now(timezone.utc)
+        locked_until = now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+        try:
+            await db.idempotency_keys.insert_one({
+                "_id": self.record_id,
+                "fingerprint": self.fingerprint,
+                "response": None,
+                "locked_until": locked_until,
+                "created_at": now,
+            })
+            return None
+        except DuplicateKeyError:
+            record = await db.idempotency_keys.find_one({"_id": self.record_id})
+        if record is None:
+            # Expired or released between the insert and the read; claim afresh
+            return await self.claim(db)
+        self._check_fingerprint(record["fingerprint"])
+        if record["response"] is None:
+            taken = await db.idempotency_keys.update_one(
+                {"_id": self.record_id, "response": None, "locked_until": {"$not": {"$gte": now}}},
+                {"$set": {"locked_until": locked_until}}
+            )
+            if taken.modified_count:
+                return None
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still in progress"
+            )
+        return self.remember(record["response"])
+
+    async def complete(self, db: AsyncIOMotorDatabase, response: Any) -> Any:
+        await db.idempotency_keys.update_one({"_id": self.record_id}, {"$set": {"response": response}})
+        return self.remember(response)
+
+    async def release(self, db: AsyncIOMotorDatabase) -> None:
+        """Forget a claimed key whose write failed, so the client may retry it."""
+        await db.idempotency_keys.delete_one({"_id": self.record_id, "response": None})
+
+
+def idempotent_request(
+    key: Optional[str], user_id: str, operation: str, body: BaseModel
+) -> Optional[IdempotentRequest]:
+    return IdempotentRequest(key, user_id, operation, body) if key is not None else None
@@ -0,0 +1,80 @@
+"""Per-process journal slots.
+
+Processes sharing a journal directory each lock a ``worker-<n>`` slot in it
+with an exclusive ``flock`` for as long as they run, so uvicorn workers never
+read each other's open segments. A slot no running process holds belonged to a
+process that stopped or crashed; whoever locks it next replays its segments.
+"""
+import fcntl
+import os
+import re
+from typing import List, Optional, Tuple
+
+SEGMENT = re.compile(r"^segment-(\d+)\.log$")
+_SLOT = re.compile(r"^worker-(\d+)$")
+
+
+def slot_dir(root: str, slot: int) -> str:
+    return os.path.join(root, f"worker-{slot}")
+
+
+def lock_slot(root: str, slot: int) -> Optional[int]:
+    """Open and exclusively lock a slot; None if another process holds it."""
+    path = slot_dir(root, slot)
+    os.makedirs(path, exist_ok=True)
+    fd = os.open(os.path.join(path, "lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def claim_slot(root: str) -> Tuple[int, int]:
+    """Lock the lowest free slot; returns the slot and its lock descriptor."""
+    os.makedirs(root, exist_ok=True)
+    slot = 0
+    while (fd := lock_slot(root, slot)) is None:
+        slot += 1
+    return slot, fd
+
+
+def lock_abandoned_slots(root: str, own_slot: Optional[int] = None) -> List[Tuple[int, int]]:
+    """Lock every slot under ``root`` no running process holds.
+
+    Returns ``(slot, lock descriptor)`` pairs; closing a descriptor releases its slot.
+    """
+    if not os.path.isdir(root):
+        return []
+    slots = []
+    for name in sorted(os.listdir(root)):
+        match = _SLOT.match(name)
+        if match is None or int(match.group(1)) == own_slot:
+            continue
+        fd = lock_slot(root, int(match.group(1)))
+        if fd is not None:
+            slots.append((int(match.group(1)), fd))
+    return slots
+
+
+def segment_paths(path: str) -> List[Tuple[int, str]]:
+    """``(number, path)`` of the segments in a slot directory, oldest first."""
+    segments = []
+    for name in os.listdir(path):
+        match = SEGMENT.match(name)
+        if match:
+            segments.append((int(match.group(1)), os.path.join(path, name)))
+    return sorted(segments)
+
+
+def unwritten_segments(root: str) -> List[str]:
+    """Paths of non-empty segments in any slot under ``root``."""
+    if not os.path.isdir(root):
+        return []
+    return [
+        path
+        for name in sorted(os.listdir(root)) if _SLOT.match(name)
+        for _, path in segment_paths(os.path.join(root, name))
+        if os.path.getsize(path)
+    ]
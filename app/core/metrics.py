@@ -0,0 +1,338 @@
+"""Prometheus text-format metrics without a client library.
+
+Request counters and latency histograms are plain ints and floats in dicts,
+updated only from the event loop, so they need no locks. Pool and cache
+figures are read from their own ``stats()`` at scrape time.
+
+DbTimingMiddleware reports the Mongo time of each request to the client as
+a ``Server-Timing`` header, from what CommandStatsListener charged to it.
+
+With several uvicorn workers, set METRICS_MULTIPROCESS_DIR: every worker
+writes its samples to ``<dir>/<pid>.json`` each METRICS_FLUSH_SECONDS (and
+on scrape), and ``/metrics`` adds up all the files, whichever worker serves
+it. Counters of exited workers keep counting towards the totals, as in
+prometheus_client's multiprocess mode; their gauges are dropped once the
+file goes stale. Empty the directory before starting the server.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+from app.config import settings
+from app.core.barcode_images import barcode_images
+from app.core.companies import company_owners, company_rules
+from app.core.hashing import hashing_pool
+from app.core.idempotency import recent_responses
+from app.core.principals import principal_cache
+from app.core.wallets import wallets
+from app.db import RequestDbTime, command_stats, current_db_time, pool_stats
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Route label for requests that matched no route, so scanners can't blow up the series count
+UNMATCHED_ROUTE = "unmatched"
+
+Labels = Tuple[Tuple[str, str], ...]
+# (sample name, labels) -> value
+Samples = Dict[Tuple[str, Labels], float]
+# name -> (type, help, samples)
+Families = Dict[str, Tuple[str, str, Samples]]
+
+
+class RequestMetrics:
+    """Per-worker request counts, latency histograms and in-flight requests."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.requests: Dict[Tuple[str, str, str], int] = {}
+        # (method, route) -> per-bucket counts (the last one is +Inf), then the sum
+        self.latency: Dict[Tuple[str, str], List[float]] = {}
+        self.in_flight = 0
+
+    def observe(self, method: str, route: str, status: int, seconds: float) -> None:
+        key = (method, route, str(status))
+        self.requests[key] = self.requests.get(key, 0) + 1
+        histogram = self.latency.get((method, route))
+        if histogram is None:
+            histogram = self.latency[method, route] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def families(self) -> Families:
+        requests: Samples = {
+            ("coupon_api_requests_total", (("method", method), ("route", route), ("status", status))): count
+            for (method, route, status), count in self.requests.items()
+        }
+        latency: Samples = {}
+        for (method, route), histogram in self.latency.items():
+            labels = (("method", method), ("route", route))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), histogram):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                latency["coupon_api_request_duration_seconds_bucket", labels + (("le", le),)] = cumulative
+            latency["coupon_api_request_duration_seconds_sum", labels] = histogram[-1]
+            latency["coupon_api_request_duration_seconds_count", labels] = cumulative
+        return {
+            "coupon_api_requests_total": ("counter", "HTTP requests by route template and status.", requests),
+            "coupon_api_request_duration_seconds": (
+                "histogram", "HTTP request latency by route template.", latency
+            ),
+            "coupon_api_requests_in_flight": (
+                "gauge", "HTTP requests being served.", {("coupon_api_requests_in_flight", ()): self.in_flight}
+            ),
+        }
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware feeding RequestMetrics; labels by route template, not raw path."""
+
+    def __init__(self, app, metrics: Optional[RequestMetrics] = None):
+        self.app = app
+        self.metrics = metrics or request_metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.in_flight -= 1
+            # The router records the matched route in the shared scope
+            route = scope.get("route")
+            self.metrics.observe(
+                scope["method"], getattr(route, "path", UNMATCHED_ROUTE), status, time.perf_counter() - started
+            )
+
+
+class DbTimingMiddleware:
+    """Pure ASGI middleware adding ``Server-Timing: db;dur=<ms>;count=<commands>``."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        db_time = RequestDbTime(scope)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timing = f"db;dur={db_time.seconds * 1000:.1f};count={db_time.count}"
+                message["headers"] = [*message.get("headers", ()), (b"server-timing", timing.encode())]
+            await send(message)
+
+        token = current_db_time.set(db_time)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_db_time.reset(token)
+
+
+def _add(families: Families, kind: str, name: str, help_text: str, value: float, labels: Labels = ()) -> None:
+    families.setdefault(name, (kind, help_text, {}))[2][name, labels] = value
+
+
+def _merge(into: Families, families: Families) -> Families:
+    for name, (kind, help_text, samples) in families.items():
+        merged = into.setdefault(name, (kind, help_text, {}))[2]
+        for key, value in samples.items():
+            merged[key] = merged.get(key, 0) + value
+    return into
+
+
+CACHES = {
+    "barcode_images": barcode_images,
+    "company_owners": company_owners,
+    "company_rules": company_rules,
+    "idempotency": recent_responses,
+    "principals": principal_cache,
+    "wallets": wallets,
+}
+
+
+def runtime_families() -> Families:
+    """Hashing pool, Mongo pool and cache figures as of now."""
+    families: Families = {}
+    hashing = hashing_pool.stats()
+    prefix = "coupon_api_hashing_pool"
+    _add(families, "gauge", f"{prefix}_workers", "Password hashing threads.", hashing["workers"])
+    _add(families, "gauge", f"{prefix}_in_flight", "Passwords being hashed.", hashing["in_flight"])
+    _add(families, "gauge", f"{prefix}_queued", "Hashing jobs waiting for a thread.", hashing["queued"])
+    _add(families, "counter", f"{prefix}_completed_total", "Hashing jobs completed.", hashing["completed"])
+    _add(families, "counter", f"{prefix}_rejected_total", "Hashing jobs rejected with a full queue.", hashing["rejected"])
+    _add(families, "counter", f"{prefix}_queue_wait_seconds_total", "Time hashing jobs spent queued.",
+         hashing["queue_wait_seconds_total"])
+    _add(families, "counter", f"{prefix}_hash_seconds_total", "Time spent hashing.", hashing["hash_seconds_total"])
+
+    mongo = pool_stats.stats()
+    prefix = "coupon_api_mongo_pool"
+    _add(families, "gauge", f"{prefix}_max_size", "Connection pool size limit.", mongo["max_pool_size"])
+    _add(families, "gauge", f"{prefix}_open_connections", "Open connections.", mongo["open_connections"])
+    _add(families, "gauge", f"{prefix}_checked_out", "Connections in use.", mongo["checked_out"])
+    _add(families, "gauge", f"{prefix}_wait_queue", "Operations waiting for a connection.", mongo["wait_queue"])
+    _add(families, "counter", f"{prefix}_checkouts_total", "Connection checkouts.", mongo["checkouts"])
+    _add(families, "counter", f"{prefix}_checkout_failures_total", "Failed connection checkouts.",
+         mongo["checkout_failures"])
+    _add(families, "counter", f"{prefix}_clears_total", "Connection pool clears.", mongo["pool_clears"])
+
+    commands = command_stats.stats()
+    for name, (count, seconds) in commands["commands"].items():
+        labels = (("command", name),)
+        _add(families, "counter", "coupon_api_mongo_commands_total", "Mongo commands by name.", count, labels)
+        _add(families, "counter", "coupon_api_mongo_command_seconds_total", "Time spent in Mongo commands.",
+             seconds, labels)
+    _add(families, "counter", "coupon_api_mongo_slow_commands_total", "Mongo commands over MONGODB_SLOW_COMMAND_MS.",
+         commands["slow_commands"])
+
+    prefix = "coupon_api_cache"
+    for name, cache in CACHES.items():
+        stats = cache.stats()
+        labels = (("cache", name),)
+        _add(families, "gauge", f"{prefix}_size", "Cached entries.", stats["size"], labels)
+        _add(families, "gauge", f"{prefix}_max_size", "Cache capacity.", stats["maxsize"], labels)
+        _add(families, "counter", f"{prefix}_hits_total", "Cache hits.", stats["hits"], labels)
+        _add(families, "counter", f"{prefix}_misses_total", "Cache misses.", stats["misses"], labels)
+        _add(families, "counter", f"{prefix}_evictions_total", "Entries evicted to stay in size.", stats["evictions"], labels)
+    return families
+
+
+def _with_hit_ratios(families: Families) -> Families:
+    # Derived after merging, since ratios of several workers can't be added up
+    hits = families.get("coupon_api_cache_hits_total", ("", "", {}))[2]
+    misses = families.get("coupon_api_cache_misses_total", ("", "", {}))[2]
+    ratios: Samples = {}
+    for (_, labels), hit_count in hits.items():
+        lookups = hit_count + misses.get(("coupon_api_cache_misses_total", labels), 0)
+        ratios["coupon_api_cache_hit_ratio", labels] = hit_count / lookups if lookups else 0.0
+    families["coupon_api_cache_hit_ratio"] = ("gauge", "Cache hits per lookup.", ratios)
+    return families
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(families: Families) -> str:
+    """Prometheus text exposition format, version 0.0.4."""
+    lines = []
+    for name in sorted(families):
+        kind, help_text, samples = families[name]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (sample, labels), value in samples.items():
+            if labels:
+                label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels)
+                sample = f"{sample}{{{label_text}}}"
+            lines.append(f"{sample} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _dump(families: Families) -> str:
+    return json.dumps([
+        [name, kind, help_text, [[sample, [list(label) for label in labels], value] for (sample, labels), value in samples.items()]]
+        for name, (kind, help_text, samples) in families.items()
+    ])
+
+
+def _load(text: str, gauges: bool) -> Families:
+    return {
+        name: (kind, help_text, {(sample, tuple(map(tuple, labels))): value for sample, labels, value in samples})
+        for name, kind, help_text, samples in json.loads(text)
+        if gauges or kind != "gauge"
+    }
+
+
+class MetricsRegistry:
+    """This worker's metrics, and in multiprocess mode everyone else's."""
+
+    def __init__(self, requests: RequestMetrics, directory: str = "", flush_seconds: float = 5.0):
+        self.requests = requests
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self._timer: Optional[asyncio.Task] = None
+
+    @property
+    def _path(self) -> str:
+        return os.path.join(self.directory, f"{os.getpid()}.json")
+
+    def local_families(self) -> Families:
+        return _merge(self.requests.families(), runtime_families())
+
+    def write(self) -> None:
+        """Publish this worker's samples for the others; written atomically."""
+        temporary = f"{self._path}.tmp"
+        with open(temporary, "w") as snapshot:
+            snapshot.write(_dump(self.local_families()))
+        os.replace(temporary, self._path)
+
+    def collect(self) -> Families:
+        if not self.directory:
+            return _with_hit_ratios(self.local_families())
+        self.write()
+        stale_before = time.time() - 3 * self.flush_seconds
+        families: Families = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                fresh = os.path.getmtime(path) >= stale_before
+                with open(path) as snapshot:
+                    _merge(families, _load(snapshot.read(), gauges=fresh))
+            except (OSError, ValueError):
+                # Replaced or removed mid-read; the next scrape picks it up
+                continue
+        return _with_hit_ratios(families)
+
+    def exposition(self) -> str:
+        return render(self.collect())
+
+    def start(self) -> None:
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._timer = asyncio.ensure_future(self._run_timer())
+
+    def stop(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+            # Final counts stay behind for the workers still serving
+            self.write()
+
+    async def _run_timer(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                self.write()
+            except OSError:
+                logger.exception("Writing metrics to %s failed", self.directory)
+
+
+request_metrics = RequestMetrics()
+metrics = MetricsRegistry(
+    request_metrics,
+    directory=settings.METRICS_MULTIPROCESS_DIR,
+    flush_seconds=settings.METRICS_FLUSH_SECONDS,
+)
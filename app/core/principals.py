@@ -0,0 +1,13 @@
+from app.config import settings
+from app.utils.cache import AsyncTTLCache
+
+# Authenticated principals keyed by email; values are (User, token_version) pairs.
+principal_cache = AsyncTTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_SIZE,
+    ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+)
+
+
+def invalidate_principal(user_id: str) -> None:
+    """Drop any cached principal for ``user_id`` after it was changed or removed."""
+    principal_cache.invalidate_where(lambda entry: entry[0].id == user_id)
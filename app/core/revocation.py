@@ -0,0 +1,97 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from bson import ObjectId
+from pymongo import ReturnDocument
+from app.config import settings
+from app.core.principals import invalidate_principal
+
+
+class TokenVersionRegistry:
+    """Per-worker view of users whose tokens have been revoked.
+
+    Revoking a user bumps ``users.token_version`` and stamps
+    ``token_version_changed_at``; tokens minted with an older ``ver`` claim are
+    rejected. Versions are keyed by user id, which tokens carry as ``uid``. A
+    token minted before a revocation expires within ACCESS_TOKEN_EXPIRE_MINUTES
+    of it, so only users revoked or deleted within that window are loaded, in
+    one query each per refresh interval, and verified-claims requests stay off
+    Mongo.
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self._versions: Dict[str, int] = {}
+        self._loaded_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    async def _refresh(self, db: AsyncIOMotorDatabase) -> None:
+        async with self._lock:
+            if time.monotonic() - self._loaded_at < self.refresh_seconds:
+                return
+            versions = {}
+            now = datetime.utcnow()
+            revoked_since = now - timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+            async for doc in db.users.find({"token_version_changed_at": {"$gt": revoked_since}}, {"token_version": 1}):
+                versions[str(doc["_id"])] = doc["token_version"]
+            # The TTL monitor runs once a minute, so expired entries may linger briefly
+            async for doc in db.deleted_users.find({"expires_at": {"$gt": now}}):
+                versions[str(doc["_id"])] = doc["token_version"]
+            self._versions = versions
+            self._loaded_at = time.monotonic()
+
+    async def current_version(self, db: AsyncIOMotorDatabase, user_id: str) -> int:
+        """Return the minimum token version still accepted for ``user_id``."""
+        if time.monotonic() - self._loaded_at >= self.refresh_seconds:
+            await self._refresh(db)
+        return self._versions.get(user_id, 0)
+
+    def record(self, user_id: str, version: int) -> None:
+        self._versions[user_id] = max(version, self._versions.get(user_id, 0))
+
+
+token_versions = TokenVersionRegistry(settings.TOKEN_VERSION_REFRESH_SECONDS)
+
+
+async def revoke_user_tokens(
+    db: AsyncIOMotorDatabase, user_id: str, changes: Optional[dict] = None, only_if: Optional[dict] = None
+) -> bool:
+    """Invalidate every token issued to a user so far, applying ``changes`` in the same write.
+
+    With ``only_if``, a user not also matching that filter is left alone and
+    False is returned.
+    """
+    update = {"$inc": {"token_version": 1}, "$set": {**(changes or {}), "token_version_changed_at": datetime.utcnow()}}
+    user_doc = await db.users.find_one_and_update(
+        {"_id": ObjectId(user_id), **(only_if or {})},
+        update,
+        projection={"token_version": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if user_doc is None:
+        return False
+    token_versions.record(user_id, user_doc["token_version"])
+    invalidate_principal(user_id)
+    return True
+
+
+async def forget_user(db: AsyncIOMotorDatabase, user_id: str) -> bool:
+    """Delete a user and reject the tokens it still holds until they expire."""
+    user_doc = await db.users.find_one_and_delete({"_id": ObjectId(user_id)}, projection={"token_version": 1})
+    if user_doc is None:
+        return False
+    version = user_doc.get("token_version", 0) + 1
+    # Kept as long as a token issued right now stays valid, then dropped by the TTL index
+    await db.deleted_users.update_one(
+        {"_id": user_doc["_id"]},
+        {"$set": {
+            "token_version": version,
+            "expires_at": datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+        }},
+        upsert=True,
+    )
+    token_versions.record(user_id, version)
+    invalidate_principal(user_id)
+    return True
@@ -0,0 +1,63 @@
+from array import array
+from bisect import bisect_right
+from typing import Iterable, List, NamedTuple, Optional
+
+
+class RuleEntry(NamedTuple):
+    rule_id: str
+    required_coupons: int
+    reward: str
+
+
+class CompiledRules:
+    """A company's reward rules, sorted by ``required_coupons`` for bisect lookups.
+
+    Thresholds live in a compact ``array`` parallel to the rule ids and rewards,
+    so evaluating a count is O(log n) and touches no Python objects until a
+    rule is actually returned.
+    """
+
+    __slots__ = ("thresholds", "rule_ids", "rewards")
+
+    def __init__(self, rules: Iterable[dict]):
+        ordered = sorted(rules, key=lambda rule: rule["required_coupons"])
+        self.thresholds = array("q", (rule["required_coupons"] for rule in ordered))
+        self.rule_ids = tuple(str(rule["_id"]) for rule in ordered)
+        self.rewards = tuple(rule["reward"] for rule in ordered)
+
+    def __len__(self) -> int:
+        return len(self.thresholds)
+
+    def __getitem__(self, index: int) -> RuleEntry:
+        return RuleEntry(self.rule_ids[index], self.thresholds[index], self.rewards[index])
+
+    def cheapest(self) -> Optional[RuleEntry]:
+        return self[0] if self.thresholds else None
+
+    def get(self, rule_id: str) -> Optional[RuleEntry]:
+        try:
+            return self[self.rule_ids.index(rule_id)]
+        except ValueError:
+            return None
+
+    def best_reachable(self, count: int) -> Optional[RuleEntry]:
+        """The highest-threshold rule a balance of ``count`` can pay for."""
+        index = bisect_right(self.thresholds, count)
+        return self[index - 1] if index else None
+
+    def next_reward(self, count: int) -> Optional[RuleEntry]:
+        """The cheapest rule ``count`` cannot pay for yet."""
+        index = bisect_right(self.thresholds, count)
+        return self[index] if index < len(self.thresholds) else None
+
+    def stamps_to_next_reward(self, count: int) -> Optional[int]:
+        rule = self.next_reward(count)
+        return rule.required_coupons - count if rule else None
+
+    def reachable(self, count: int) -> List[RuleEntry]:
+        """Every rule a balance of ``count`` can pay for, cheapest first."""
+        return [self[index] for index in range(bisect_right(self.thresholds, count))]
+
+    def unlocked(self, before: int, after: int) -> List[RuleEntry]:
+        """Rules whose threshold was crossed by moving a count from ``before`` to ``after``."""
+        return [self[index] for index in range(bisect_right(self.thresholds, before), bisect_right(self.thresholds, after))]
@@ -0,0 +1,70 @@
+from typing import List
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from app.config import settings
+from app.core.rule_index import CompiledRules
+from app.core.write_behind import coupon_counters
+from app.utils.cache import AsyncTTLCache
+
+# Keyed by client id. Stamps and redemptions through the routers invalidate the
+# local worker; company renames and rule edits show up within the TTL.
+wallets = AsyncTTLCache(
+    maxsize=settings.WALLET_CACHE_SIZE,
+    ttl=settings.WALLET_CACHE_TTL_SECONDS,
+)
+
+
+def wallet_pipeline(client_id: str) -> List[dict]:
+    """Every coupon of ``client_id`` joined with its company's name and reward rules."""
+    return [
+        {"$match": {"client_id": client_id}},
+        {"$project": {"company_id": 1, "barcode": 1, "count": 1, "updated_at": 1}},
+        {"$lookup": {
+            "from": "companies",
+            "let": {"company_id": {"$convert": {"input": "$company_id", "to": "objectId", "onError": None}}},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$_id", "$$company_id"]}}},
+                {"$project": {"_id": 0, "name": 1}},
+            ],
+            "as": "company",
+        }},
+        {"$lookup": {
+            "from": "coupon_rules",
+            "localField": "company_id",
+            "foreignField": "company_id",
+            "pipeline": [{"$project": {"required_coupons": 1, "reward": 1}}],
+            "as": "rules",
+        }},
+        # Most recently used cafes first
+        {"$sort": {"updated_at": -1, "_id": 1}},
+    ]
+
+
+def _wallet_coupon(coupon_doc: dict) -> dict:
+    coupon_id = str(coupon_doc["_id"])
+    count = coupon_doc.get("count", 0) + coupon_counters.pending_delta(coupon_id)
+    rules = CompiledRules(coupon_doc["rules"])
+    next_reward = rules.next_reward(count)
+    return {
+        "id": coupon_id,
+        "company_id": coupon_doc["company_id"],
+        "company_name": coupon_doc["company"][0]["name"] if coupon_doc["company"] else None,
+        "barcode": coupon_doc["barcode"],
+        "count": count,
+        "redeemable_rewards": [rule._asdict() for rule in rules.reachable(count)],
+        "next_reward": next_reward._asdict() if next_reward else None,
+        "stamps_to_next_reward": rules.stamps_to_next_reward(count),
+    }
+
+
+async def get_wallet(db: AsyncIOMotorDatabase, client_id: str) -> List[dict]:
+    """The client's coupons with reward progress, in one aggregation round trip."""
+
+    async def load():
+        coupon_docs = await db.coupons.aggregate(wallet_pipeline(client_id)).to_list(length=None)
+        return [_wallet_coupon(coupon_doc) for coupon_doc in coupon_docs]
+
+    return await wallets.get_or_load(client_id, load)
+
+
+def invalidate_wallet(client_id: str) -> None:
+    wallets.invalidate(client_id)
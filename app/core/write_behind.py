@@ -0,0 +1,264 @@
+"""Write-behind aggregation of coupon count increments.
+
+Hot cafes hammer the same few coupon documents with ``$inc``. With
+WRITE_BEHIND_ENABLED, increments are journaled to a local append-only file,
+summed in memory and flushed as one unordered ``bulk_write`` every
+WRITE_BEHIND_FLUSH_INTERVAL_MS or WRITE_BEHIND_FLUSH_MAX_OPS increments.
+
+Each flush covers one journal segment and tags every coupon it touches with the
+segment's sequence number under ``write_behind_seq.<node>``; a coupon already
+carrying that (or a later) number is skipped. Replaying a segment after a crash
+or a failed flush is therefore safe. The last number written for each node is
+kept in ``write_behind_slots``, so a restart never issues a lower one, even if
+the clock went backwards.
+
+Every process journals to its own ``worker-<n>`` slot under
+WRITE_BEHIND_JOURNAL_DIR (see ``app.core.journal``) and uses ``<node>-<n>`` as
+its node id, so uvicorn workers sharing one directory never read each other's
+open segments or skip each other's increments. ``<node>`` is
+WRITE_BEHIND_NODE_ID, which must stay the same across restarts: every node id
+leaves a field on each coupon it touches. On startup a process replays the
+segments of its own slot and of any slot no running process holds, e.g. after
+scaling down the worker count.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from bson import ObjectId
+from pymongo import UpdateOne
+from app.config import settings
+from app.core.journal import claim_slot, lock_abandoned_slots, segment_paths, slot_dir
+
+logger = logging.getLogger(__name__)
+
+
+class CounterAggregator:
+    def __init__(
+        self,
+        journal_dir: str,
+        flush_interval_ms: int,
+        flush_max_ops: int,
+        node_id: str = "",
+        fsync: bool = False,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.journal_root = journal_dir
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_ops = flush_max_ops
+        # Used as a field name, so it must not contain dots or a leading "$"
+        self.node_prefix = re.sub(r"[^A-Za-z0-9_-]", "_", node_id)
+        self.fsync = fsync
+        # Set once a journal slot is locked in start()
+        self.journal_dir: Optional[str] = None
+        self.node_id: Optional[str] = None
+        self._slot_fd: Optional[int] = None
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        self._pending: Dict[str, int] = {}
+        self._pending_ops = 0
+        # Sealed segments waiting to be written, oldest first: (seq, path, deltas)
+        self._sealed: List[Tuple[int, str, Dict[str, int]]] = []
+        self._seq = 0
+        self._fd: Optional[int] = None
+        self._path: Optional[str] = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._timer: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flush_failures = 0
+        self.flushed_ops = 0
+        self.flushed_coupons = 0
+        self.flush_seconds_total = 0.0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def _next_seq(self) -> int:
+        # Starts from the last number persisted for the slot (see start), so a
+        # clock gone backwards can't issue a number a coupon already carries
+        self._seq = max(time.time_ns(), self._seq + 1)
+        return self._seq
+
+    def _open_segment(self) -> None:
+        self._path = os.path.join(self.journal_dir, f"segment-{self._next_seq():020d}.log")
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _seal_segment(self) -> None:
+        os.close(self._fd)
+        if self._pending:
+            self._sealed.append((self._seq, self._path, self._pending))
+        else:
+            os.remove(self._path)
+        self._pending = {}
+        self._pending_ops = 0
+        self._open_segment()
+
+    @staticmethod
+    def _read_segment(path: str) -> Dict[str, int]:
+        deltas: Dict[str, int] = {}
+        with open(path, encoding="ascii", errors="replace") as journal:
+            for line in journal:
+                parts = line.split()
+                # A torn last line from a crash mid-write never reached the caller
+                if len(parts) != 2 or not line.endswith("\n"):
+                    continue
+                coupon_id, delta = parts
+                deltas[coupon_id] = deltas.get(coupon_id, 0) + int(delta)
+        return deltas
+
+    def _slot_node_id(self, slot: int) -> str:
+        return f"{self.node_prefix}-{slot}"
+
+    def _load_segments(self, path: str) -> List[Tuple[int, str, Dict[str, int]]]:
+        return [(seq, segment, self._read_segment(segment)) for seq, segment in segment_paths(path)]
+
+    async def _replay_abandoned_slots(self, own_slot: int) -> None:
+        for slot, fd in lock_abandoned_slots(self.journal_root, own_slot):
+            try:
+                segments = self._load_segments(slot_dir(self.journal_root, slot))
+                if segments:
+                    logger.info("Replaying %d write-behind journal segment(s) of worker-%d", len(segments), slot)
+                for seq, path, deltas in segments:
+                    await self._write_segment(seq, deltas, self._slot_node_id(slot))
+                    os.remove(path)
+            except Exception:
+                logger.exception("Replaying write-behind journal worker-%d failed; retried on next startup", slot)
+            finally:
+                # Closing the descriptor releases the lock
+                os.close(fd)
+
+    async def start(self, db: AsyncIOMotorDatabase) -> None:
+        if not self.node_prefix:
+            raise RuntimeError("WRITE_BEHIND_NODE_ID must be set when write-behind is enabled")
+        self._db = db
+        slot, self._slot_fd = claim_slot(self.journal_root)
+        self.journal_dir = slot_dir(self.journal_root, slot)
+        self.node_id = self._slot_node_id(slot)
+        state = await db.write_behind_slots.find_one({"_id": self.node_id})
+        if state is not None:
+            self._seq = max(self._seq, state["seq"])
+        self._sealed = self._load_segments(self.journal_dir)
+        if self._sealed:
+            self._seq = max(self._seq, self._sealed[-1][0])
+            logger.info("Replaying %d write-behind journal segment(s)", len(self._sealed))
+        self._open_segment()
+        await self.flush()
+        await self._replay_abandoned_slots(slot)
+        self._timer = asyncio.ensure_future(self._run_timer())
+
+    async def stop(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._fd is not None:
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Final write-behind flush failed; the journal is replayed on startup")
+            # Whatever was buffered is sealed by now, leaving the open segment empty
+            os.close(self._fd)
+            os.remove(self._path)
+            self._fd = None
+        if self._slot_fd is not None:
+            os.close(self._slot_fd)
+            self._slot_fd = None
+
+    async def _run_timer(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed")
+
+    def increment(self, coupon_id: str, delta: int = 1) -> None:
+        """Journal and buffer an increment; it reaches MongoDB on the next flush."""
+        os.write(self._fd, f"{coupon_id} {delta}\n".encode("ascii"))
+        if self.fsync:
+            os.fsync(self._fd)
+        self._pending[coupon_id] = self._pending.get(coupon_id, 0) + delta
+        self._pending_ops += 1
+        if self._pending_ops >= self.flush_max_ops and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    def pending_delta(self, coupon_id: str) -> int:
+        """Increments for ``coupon_id`` accepted but not yet written to MongoDB."""
+        delta = self._pending.get(coupon_id, 0)
+        for _, _, deltas in self._sealed:
+            delta += deltas.get(coupon_id, 0)
+        return delta
+
+    def has_pending(self) -> bool:
+        """Whether any increment accepted by this process is not yet in MongoDB."""
+        return bool(self._pending or self._sealed)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if self._pending:
+                self._seal_segment()
+            while self._sealed:
+                seq, path, deltas = self._sealed[0]
+                await self._write_segment(seq, deltas)
+                self._sealed.pop(0)
+                os.remove(path)
+
+    async def _write_segment(self, seq: int, deltas: Dict[str, int], node_id: Optional[str] = None) -> None:
+        node_id = node_id or self.node_id
+        marker = f"write_behind_seq.{node_id}"
+        now = datetime.now(timezone.utc)
+        operations = [
+            UpdateOne(
+                {"_id": ObjectId(coupon_id), marker: {"$not": {"$gte": seq}}},
+                {"$inc": {"count": delta}, "$set": {marker: seq, "updated_at": now}}
+            )
+            for coupon_id, delta in deltas.items()
+            if delta
+        ]
+        started = time.perf_counter()
+        try:
+            if operations:
+                await self._db.coupons.bulk_write(operations, ordered=False)
+                # Until this lands, the segment's file still holds the number
+                await self._db.write_behind_slots.update_one(
+                    {"_id": node_id}, {"$max": {"seq": seq}}, upsert=True
+                )
+        except Exception:
+            # The segment stays sealed and is retried, idempotently, on the next flush
+            self.flush_failures += 1
+            raise
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.flushed_ops += sum(abs(delta) for delta in deltas.values())
+        self.flushed_coupons += len(operations)
+        self.flush_seconds_total += elapsed
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending_ops": self._pending_ops,
+            "pending_coupons": len(self._pending),
+            "sealed_segments": len(self._sealed),
+            "flushes": self.flushes,
+            "flush_failures": self.flush_failures,
+            "flushed_ops": self.flushed_ops,
+            "flushed_coupons": self.flushed_coupons,
+            "flush_seconds_total": self.flush_seconds_total,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+        }
+
+
+coupon_counters = CounterAggregator(
+    journal_dir=settings.WRITE_BEHIND_JOURNAL_DIR,
+    flush_interval_ms=settings.WRITE_BEHIND_FLUSH_INTERVAL_MS,
+    flush_max_ops=settings.WRITE_BEHIND_FLUSH_MAX_OPS,
+    node_id=settings.WRITE_BEHIND_NODE_ID,
+    fsync=settings.WRITE_BEHIND_FSYNC,
+    enabled=settings.WRITE_BEHIND_ENABLED,
+)
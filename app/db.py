@@ -1,13 +1,243 @@
+import asyncio
+import json
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+from fastapi import Depends
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import monitoring
+from pymongo.read_preferences import read_pref_mode_from_name, make_read_preference
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Tracks connection pool usage; events arrive on driver threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open_connections = 0
+        self.checked_out = 0
+        self.wait_queue = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def _add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def connection_created(self, event):
+        self._add(open_connections=1)
+
+    def connection_closed(self, event):
+        self._add(open_connections=-1)
+
+    def connection_check_out_started(self, event):
+        self._add(wait_queue=1)
+
+    def connection_checked_out(self, event):
+        self._add(wait_queue=-1, checked_out=1, checkouts=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(wait_queue=-1, checkout_failures=1)
+
+    def connection_checked_in(self, event):
+        self._add(checked_out=-1)
+
+    def pool_cleared(self, event):
+        self._add(pool_clears=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_pool_size": settings.MONGODB_MAX_POOL_SIZE,
+                "min_pool_size": settings.MONGODB_MIN_POOL_SIZE,
+                "open_connections": self.open_connections,
+                "checked_out": self.checked_out,
+                "wait_queue": self.wait_queue,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "pool_clears": self.pool_clears,
+            }
+
+
+class RequestDbTime:
+    """Commands issued on behalf of one request and the time they took."""
+
+    __slots__ = ("scope", "count", "seconds")
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+
+    @property
+    def label(self) -> Optional[str]:
+        if self.scope is None:
+            return None
+        return f"{self.scope.get('method')} {self.scope.get('path')}"
+
+
+# Set per request by DbTimingMiddleware; Motor runs driver calls in a copy of
+# the caller's context, so command events see the request that issued them
+current_db_time: ContextVar[Optional[RequestDbTime]] = ContextVar("current_db_time", default=None)
+
+# Where each command keeps its filter; update/delete hold a list of statements
+_FILTER_FIELDS = {
+    "find": "filter",
+    "aggregate": "pipeline",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+}
+
+
+def redact(value: Any) -> Any:
+    """The shape of a filter: keys and operators kept, every value replaced by "?"."""
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # One entry per distinct shape, so a long $in list stays one "?"
+        shapes = []
+        for item in value:
+            shape = redact(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+
+def filter_shape(command_name: str, command: dict) -> Any:
+    if command_name in ("update", "delete"):
+        return redact([statement.get("q") for statement in command.get(f"{command_name}s", ())])
+    field = _FILTER_FIELDS.get(command_name)
+    return redact(command.get(field)) if field else None
+
+
+def _collection(command_name: str, command: dict) -> Optional[str]:
+    name = command.get("collection") if command_name == "getMore" else command.get(command_name)
+    return name if isinstance(name, str) else None
+
+
+class CommandStatsListener(monitoring.CommandListener):
+    """Times every command, charges it to the issuing request and logs slow ones."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (connection, request id) -> (request, command) of commands in flight
+        self._pending: Dict[Tuple[Any, int], Tuple[Optional[RequestDbTime], dict]] = {}
+        # command name -> [count, seconds]
+        self.commands: Dict[str, list] = {}
+        self.slow_commands = 0
+
+    def started(self, event):
+        command = event.command if settings.MONGODB_SLOW_COMMAND_MS else {}
+        with self._lock:
+            self._pending[event.connection_id, event.request_id] = (current_db_time.get(), command)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool = False):
+        seconds = event.duration_micros / 1e6
+        with self._lock:
+            request, command = self._pending.pop((event.connection_id, event.request_id), (None, {}))
+            totals = self.commands.setdefault(event.command_name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            if request is not None:
+                request.count += 1
+                request.seconds += seconds
+        threshold = settings.MONGODB_SLOW_COMMAND_MS
+        if threshold and seconds * 1000 >= threshold:
+            with self._lock:
+                self.slow_commands += 1
+            self._log_slow(event, command, request, seconds, failed)
+
+    def _log_slow(self, event, command: dict, request: Optional[RequestDbTime], seconds: float, failed: bool):
+        entry = {
+            "event": "slow_mongo_command",
+            "command": event.command_name,
+            "database": event.database_name,
+            "collection": _collection(event.command_name, command),
+            "duration_ms": round(seconds * 1000, 3),
+            "request": request.label if request is not None else None,
+            "filter": filter_shape(event.command_name, command),
+        }
+        if failed:
+            entry["failed"] = True
+        logger.warning(json.dumps(entry, default=str))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "commands": {name: tuple(totals) for name, totals in self.commands.items()},
+                "slow_commands": self.slow_commands,
+            }
+
+
+def client_options() -> dict:
+    """Driver options from Settings; unset values keep the driver defaults."""
+    options = {
+        "maxPoolSize": settings.MONGODB_MAX_POOL_SIZE,
+        "minPoolSize": settings.MONGODB_MIN_POOL_SIZE,
+        "maxIdleTimeMS": settings.MONGODB_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": settings.MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": settings.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+        "compressors": settings.MONGODB_COMPRESSORS or None,
+        "readPreference": settings.MONGODB_READ_PREFERENCE,
+    }
+    return {name: value for name, value in options.items() if value is not None}
+
+
+pool_stats = PoolStatsListener()
+command_stats = CommandStatsListener()
+
+
 class Database:
     client: AsyncIOMotorClient = None
     database: AsyncIOMotorDatabase = None
+    reporting_database: AsyncIOMotorDatabase = None
 
     async def connect_to_mongodb(self):
-        self.client = AsyncIOMotorClient(settings.MONGODB_URL)
+        self.client = AsyncIOMotorClient(
+            settings.MONGODB_URL,
+            event_listeners=[pool_stats, command_stats],
+            **client_options(),
+        )
         self.database = self.client[settings.DATABASE_NAME]
+        self.reporting_database = self.database
+        if settings.MONGODB_REPORTING_READ_PREFERENCE != settings.MONGODB_READ_PREFERENCE:
+            self.reporting_database = self.database.with_options(
+                read_preference=make_read_preference(
+                    read_pref_mode_from_name(settings.MONGODB_REPORTING_READ_PREFERENCE), None
+                )
+            )
+        if settings.MONGODB_MIN_POOL_SIZE:
+            await self.prewarm_pool(settings.MONGODB_MIN_POOL_SIZE)
+
+    async def prewarm_pool(self, size: int):
+        """Open ``size`` sockets up front so the first requests don't pay for handshakes."""
+        await asyncio.gather(*(self.client.admin.command("ping") for _ in range(size)))
 
     async def close_mongodb_connection(self):
         if self.client:
@@ -20,3 +250,9 @@ async def get_database() -> AsyncIOMotorDatabase:
 
 async def get_db() -> AsyncIOMotorDatabase:
     return db.database
+
+async def get_reporting_db(database: AsyncIOMotorDatabase = Depends(get_db)) -> AsyncIOMotorDatabase:
+    """Database handle for list/report reads, honouring MONGODB_REPORTING_READ_PREFERENCE."""
+    if database is db.database and db.reporting_database is not None:
+        return db.reporting_database
+    return database
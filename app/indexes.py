@@ -0,0 +1,139 @@
+"""Declarative MongoDB index registry.
+
+Applied idempotently on startup, or from the command line::
+
+    python -m app.indexes --dry-run   # report missing / extra indexes
+    python -m app.indexes             # create missing indexes
+"""
+import argparse
+import asyncio
+import logging
+from typing import Dict, List
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        # Login, registration and every database-backed auth check
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        # Revocation refresh only scans users whose tokens were revoked recently
+        IndexModel(
+            [("token_version_changed_at", ASCENDING)],
+            name="token_version_changed_at",
+            partialFilterExpression={"token_version_changed_at": {"$exists": True}},
+        ),
+    ],
+    "deleted_users": [
+        # Revocation markers of deleted users, kept until their last token expires
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "companies": [
+        IndexModel([("admin_id", ASCENDING), ("_id", ASCENDING)], name="admin_id__id"),
+    ],
+    "coupon_rules": [
+        IndexModel([("company_id", ASCENDING)], name="company_id"),
+    ],
+    "coupons": [
+        # A client holds at most one coupon per barcode
+        IndexModel(
+            [("barcode", ASCENDING), ("client_id", ASCENDING)],
+            name="barcode_client_id_unique",
+            unique=True,
+        ),
+        IndexModel([("client_id", ASCENDING)], name="client_id"),
+        IndexModel([("company_id", ASCENDING)], name="company_id"),
+    ],
+    "coupon_events": [
+        # Per-coupon history, paged newest first
+        IndexModel([("coupon_id", ASCENDING), ("_id", ASCENDING)], name="coupon_id__id"),
+        # Events after a coupon's snapshot, and the compactor's windows
+        IndexModel([("coupon_id", ASCENDING), ("seq", ASCENDING)], name="coupon_id_seq"),
+        IndexModel([("seq", ASCENDING)], name="seq"),
+    ],
+    "idempotency_keys": [
+        IndexModel(
+            [("created_at", ASCENDING)],
+            name="created_at_ttl",
+            expireAfterSeconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS,
+        ),
+    ],
+}
+
+# Options that change index semantics and therefore take part in comparisons
+_COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+def _spec(document: dict) -> tuple:
+    # The server may report directions as floats (1.0) where the registry uses ints
+    return (
+        tuple(
+            (field, int(direction) if isinstance(direction, (int, float)) else direction)
+            for field, direction in dict(document["key"]).items()
+        ),
+        tuple((option, document.get(option)) for option in _COMPARED_OPTIONS),
+    )
+
+
+async def diff_indexes(db: AsyncIOMotorDatabase) -> Dict[str, dict]:
+    """Compare the registry with the live indexes of every registered collection."""
+    report = {}
+    for collection, models in INDEXES.items():
+        existing = await db[collection].index_information()
+        existing.pop("_id_", None)
+        existing_specs = {name: _spec(info) for name, info in existing.items()}
+        wanted = {model.document["name"]: _spec(model.document) for model in models}
+        report[collection] = {
+            "missing": [name for name, spec in wanted.items() if existing_specs.get(name) != spec],
+            "extra": [name for name in existing_specs if name not in wanted],
+        }
+    return report
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase) -> None:
+    """Create every registered index; already-existing identical indexes are a no-op.
+
+    Raises RuntimeError when a unique index can't be built.
+    """
+    for collection, models in INDEXES.items():
+        try:
+            await db[collection].create_indexes(models)
+        except OperationFailure as exc:
+            # Typically duplicate data blocking a unique index or a conflicting
+            # definition. Registration and stamp idempotency rely on unique
+            # indexes raising DuplicateKeyError, so refuse to serve without them;
+            # for the rest, keep serving and let `--dry-run` point at the problem.
+            existing = await db[collection].index_information()
+            missing_unique = [
+                model.document["name"]
+                for model in models
+                if model.document.get("unique")
+                and _spec(existing.get(model.document["name"], {"key": {}})) != _spec(model.document)
+            ]
+            if missing_unique:
+                raise RuntimeError(
+                    f"Could not create unique indexes {missing_unique} on {collection}: {exc}"
+                ) from exc
+            logger.error("Could not create indexes on %s: %s", collection, exc)
+
+
+async def _main(dry_run: bool) -> None:
+    from app.db import db
+
+    await db.connect_to_mongodb()
+    try:
+        if not dry_run:
+            await ensure_indexes(db.database)
+        for collection, entry in (await diff_indexes(db.database)).items():
+            print(f"{collection}: missing={entry['missing']} extra={entry['extra']}")
+    finally:
+        await db.close_mongodb_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply or inspect MongoDB indexes.")
+    parser.add_argument("--dry-run", action="store_true", help="only report missing and extra indexes")
+    asyncio.run(_main(parser.parse_args().dry_run))
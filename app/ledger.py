@@ -0,0 +1,330 @@
+"""Append-only coupon ledger.
+
+Every stamp and redemption made through the API is recorded in
+``coupon_events``. Events are journaled to a local append-only file, like
+write-behind increments (see ``app.core.journal``), and written in batches;
+each carries the actor and the POS terminal that made the change.
+
+Each event is stamped with ``seq``, the server's clock when it is written, not
+when it was recorded. A compactor folds events into a per-coupon ``snapshot``
+({count, upto}) in contiguous ``seq`` windows, so a coupon's count can be
+rebuilt from its snapshot plus the events after ``snapshot.upto`` instead of
+its whole history. Windows stop LEDGER_COMPACT_LAG_SECONDS behind the same
+clock, so an event retried after a failed batch still lands after the last
+folded window. Run by hand with::
+
+    python -m app.ledger compact
+    python -m app.ledger rebuild [coupon_id ...]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from bson import ObjectId, json_util
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from app.config import settings
+from app.core.journal import claim_slot, lock_abandoned_slots, segment_paths, slot_dir, unwritten_segments
+from app.models.coupon_event import CouponEventType
+
+logger = logging.getLogger(__name__)
+
+_BEGINNING = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def coupon_event(
+    coupon_id: str,
+    company_id: str,
+    event_type: CouponEventType,
+    delta: int,
+    actor_id: str,
+    pos_id: Optional[str] = None,
+    rule_id: Optional[str] = None,
+    event_id: Optional[ObjectId] = None,
+) -> dict:
+    return {
+        # Generated here rather than by the server, so a retried batch cannot duplicate events
+        "_id": event_id or ObjectId(),
+        "coupon_id": coupon_id,
+        "company_id": company_id,
+        "type": event_type.value,
+        "delta": delta,
+        "actor_id": actor_id,
+        "pos_id": pos_id,
+        "rule_id": rule_id,
+        "created_at": datetime.now(timezone.utc),
+    }
+
+
+def _event_upsert(event: dict) -> UpdateOne:
+    # Values are literals: a POS id such as "$x" must not be read as a field path
+    fields = {name: {"$literal": value} for name, value in event.items() if name != "_id"}
+    return UpdateOne(
+        {"_id": event["_id"]},
+        # A replayed event keeps the seq of the attempt that stored it
+        [{"$set": {**fields, "seq": {"$ifNull": ["$seq", "$$NOW"]}}}],
+        upsert=True,
+    )
+
+
+class EventWriter:
+    """Journals ledger events and writes them with one ``bulk_write`` per batch."""
+
+    def __init__(self, journal_dir: str, batch_size: int, flush_interval_ms: int, fsync: bool = False):
+        self.journal_root = journal_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.fsync = fsync
+        # Set once a journal slot is locked in start()
+        self.journal_dir: Optional[str] = None
+        self._slot_fd: Optional[int] = None
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        # Events of the open segment; sealed segments wait on disk, oldest first
+        self._buffer: List[dict] = []
+        self._sealed: List[str] = []
+        self._segment = 0
+        self._fd: Optional[int] = None
+        self._path: Optional[str] = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._timer: Optional[asyncio.Task] = None
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+
+    def _open_segment(self) -> None:
+        self._segment = max(time.time_ns(), self._segment + 1)
+        self._path = os.path.join(self.journal_dir, f"segment-{self._segment:020d}.log")
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _seal_segment(self) -> None:
+        os.close(self._fd)
+        if self._buffer:
+            self._sealed.append(self._path)
+        else:
+            os.remove(self._path)
+        self._buffer = []
+        self._open_segment()
+
+    @staticmethod
+    def _read_segment(path: str) -> List[dict]:
+        with open(path, encoding="ascii") as journal:
+            # A torn last line from a crash mid-write never reached the caller
+            return [json_util.loads(line) for line in journal if line.endswith("\n")]
+
+    async def start(self, db: AsyncIOMotorDatabase) -> None:
+        self._db = db
+        slot, self._slot_fd = claim_slot(self.journal_root)
+        self.journal_dir = slot_dir(self.journal_root, slot)
+        segments = segment_paths(self.journal_dir)
+        if segments:
+            self._segment = segments[-1][0]
+            self._sealed = [path for _, path in segments]
+            logger.info("Replaying %d ledger journal segment(s)", len(segments))
+        self._open_segment()
+        await self.flush()
+        await self._replay_abandoned_slots(slot)
+        self._timer = asyncio.ensure_future(self._run_timer())
+
+    async def _replay_abandoned_slots(self, own_slot: int) -> None:
+        for slot, fd in lock_abandoned_slots(self.journal_root, own_slot):
+            try:
+                segments = segment_paths(slot_dir(self.journal_root, slot))
+                if segments:
+                    logger.info("Replaying %d ledger journal segment(s) of worker-%d", len(segments), slot)
+                for _, path in segments:
+                    await self._write_events(self._read_segment(path))
+                    os.remove(path)
+            except Exception:
+                logger.exception("Replaying ledger journal worker-%d failed; retried on next startup", slot)
+            finally:
+                # Closing the descriptor releases the lock
+                os.close(fd)
+
+    async def stop(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._fd is not None:
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Final ledger flush failed; the journal is replayed on startup")
+            # Whatever was buffered is sealed by now, leaving the open segment empty
+            os.close(self._fd)
+            os.remove(self._path)
+            self._fd = None
+        if self._slot_fd is not None:
+            os.close(self._slot_fd)
+            self._slot_fd = None
+
+    async def _run_timer(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Writing coupon events failed")
+
+    def record(self, events: Iterable[dict]) -> None:
+        """Journal and buffer events; they reach ``coupon_events`` on the next flush."""
+        events = list(events)
+        if self._fd is not None:
+            os.write(self._fd, "".join(json_util.dumps(event) + "\n" for event in events).encode("ascii"))
+            if self.fsync:
+                os.fsync(self._fd)
+        self._buffer.extend(events)
+        if len(self._buffer) >= self.batch_size and self._fd is not None:
+            # Sealed right away, so however long MongoDB is away at most one batch stays in memory
+            self._seal_segment()
+            if self._flush_task is None or self._flush_task.done():
+                self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self) -> None:
+        if self._fd is None:
+            return
+        async with self._flush_lock:
+            if self._buffer:
+                self._seal_segment()
+            while self._sealed:
+                await self._write_events(self._read_segment(self._sealed[0]))
+                os.remove(self._sealed.pop(0))
+
+    async def _write_events(self, events: List[dict]) -> None:
+        for start in range(0, len(events), self.batch_size):
+            batch = events[start:start + self.batch_size]
+            try:
+                await self._db.coupon_events.bulk_write([_event_upsert(event) for event in batch], ordered=False)
+            except Exception:
+                # The segment stays on disk and is retried, idempotently, on the next flush
+                self.failures += 1
+                raise
+            self.written += len(batch)
+            self.batches += 1
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "sealed_segments": len(self._sealed),
+            "written": self.written,
+            "batches": self.batches,
+            "failures": self.failures,
+        }
+
+
+coupon_events = EventWriter(
+    journal_dir=settings.LEDGER_JOURNAL_DIR,
+    batch_size=settings.LEDGER_BATCH_SIZE,
+    flush_interval_ms=settings.LEDGER_FLUSH_INTERVAL_MS,
+    fsync=settings.LEDGER_JOURNAL_FSYNC,
+)
+
+
+async def compact_coupon_events(db: AsyncIOMotorDatabase, lag_seconds: float) -> int:
+    """Fold the next window of events into coupon snapshots; returns coupons updated.
+
+    The window is claimed in ``ledger_state`` before it is applied and every
+    coupon records the window it was folded up to, so an interrupted or
+    concurrent run replays the same window without counting anything twice.
+    The horizon comes from the server's clock, the one that stamps ``seq``.
+    """
+    horizon = {"$subtract": ["$$NOW", int(lag_seconds * 1000)]}
+    try:
+        state = await db.ledger_state.find_one_and_update(
+            {"_id": "compactor", "pending_to": {"$exists": False}, "$expr": {"$lt": ["$upto", horizon]}},
+            [{"$set": {"upto": {"$ifNull": ["$upto", _BEGINNING]}, "pending_to": horizon}}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # A window is already claimed, so finish that one instead, unless the
+        # previous window already reached the horizon
+        state = await db.ledger_state.find_one({"_id": "compactor"})
+        if "pending_to" not in state:
+            return 0
+    window_from, window_to = state["upto"], state["pending_to"]
+
+    totals = await db.coupon_events.aggregate([
+        {"$match": {"seq": {"$gte": window_from, "$lt": window_to}}},
+        {"$group": {"_id": "$coupon_id", "delta": {"$sum": "$delta"}}},
+    ]).to_list(length=None)
+    if totals:
+        await db.coupons.bulk_write([
+            UpdateOne(
+                {"_id": ObjectId(total["_id"]), "snapshot.upto": {"$not": {"$gte": window_to}}},
+                {"$inc": {"snapshot.count": total["delta"]}, "$set": {"snapshot.upto": window_to}}
+            )
+            for total in totals
+        ], ordered=False)
+    await db.ledger_state.update_one(
+        {"_id": "compactor", "pending_to": window_to},
+        {"$set": {"upto": window_to}, "$unset": {"pending_to": ""}}
+    )
+    return len(totals)
+
+
+async def run_compactor(db: AsyncIOMotorDatabase) -> None:
+    while True:
+        await asyncio.sleep(settings.LEDGER_COMPACT_INTERVAL_SECONDS)
+        try:
+            await compact_coupon_events(db, settings.LEDGER_COMPACT_LAG_SECONDS)
+        except Exception:
+            logger.exception("Coupon ledger compaction failed")
+
+
+async def ledger_count(db: AsyncIOMotorDatabase, coupon_id: str) -> int:
+    """The coupon's count according to its snapshot and the events after it."""
+    coupon = await db.coupons.find_one({"_id": ObjectId(coupon_id)}, projection={"snapshot": 1})
+    snapshot = (coupon or {}).get("snapshot", {})
+    tail = await db.coupon_events.aggregate([
+        {"$match": {"coupon_id": coupon_id, "seq": {"$gte": snapshot.get("upto", _BEGINNING)}}},
+        {"$group": {"_id": None, "delta": {"$sum": "$delta"}}},
+    ]).to_list(length=1)
+    return snapshot.get("count", 0) + (tail[0]["delta"] if tail else 0)
+
+
+async def rebuild_counts(db: AsyncIOMotorDatabase, coupon_ids: Optional[List[str]] = None) -> int:
+    """Reset ``count`` from the ledger for the given coupons, or for every coupon.
+
+    Meant for incident recovery while writes are paused. Refuses while this
+    host's ledger or write-behind journals hold anything not yet written: the
+    events would be missing from the rebuilt counts, and the increments would
+    land on top of them. Journals on other hosts can't be checked from here.
+    """
+    unwritten = unwritten_segments(settings.LEDGER_JOURNAL_DIR) + unwritten_segments(settings.WRITE_BEHIND_JOURNAL_DIR)
+    if unwritten:
+        raise RuntimeError(
+            f"{len(unwritten)} journal segment(s) not written yet, e.g. {unwritten[0]}; "
+            "start the API to replay them, then stop writes and rebuild"
+        )
+    if coupon_ids is None:
+        coupon_ids = [str(coupon_id) for coupon_id in await db.coupon_events.distinct("coupon_id")]
+    for coupon_id in coupon_ids:
+        count = await ledger_count(db, coupon_id)
+        await db.coupons.update_one({"_id": ObjectId(coupon_id)}, {"$set": {"count": count}})
+    return len(coupon_ids)
+
+
+async def _main(command: str, coupon_ids: List[str]) -> None:
+    from app.db import db
+
+    await db.connect_to_mongodb()
+    try:
+        if command == "compact":
+            print(f"compacted {await compact_coupon_events(db.database, settings.LEDGER_COMPACT_LAG_SECONDS)} coupons")
+        else:
+            print(f"rebuilt {await rebuild_counts(db.database, coupon_ids or None)} coupons")
+    finally:
+        await db.close_mongodb_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact the coupon ledger or rebuild counts from it.")
+    parser.add_argument("command", choices=["compact", "rebuild"])
+    parser.add_argument("coupon_ids", nargs="*", help="coupons to rebuild (default: all with events)")
+    args = parser.parse_args()
+    asyncio.run(_main(args.command, args.coupon_ids))
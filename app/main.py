@@ -1,17 +1,43 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.db import db
+from fastapi.responses import PlainTextResponse
+from app.db import db, pool_stats
+from app.config import settings
+from app.indexes import ensure_indexes
+from app.migrations import run_migrations
+from app.core.hashing import hashing_pool
+from app.core.write_behind import coupon_counters
+from app.core.metrics import CONTENT_TYPE, DbTimingMiddleware, MetricsMiddleware, metrics
+from app.ledger import coupon_events, run_compactor
 from app.api.auth import router as auth_router
 from app.api.company import router as company_router
 from app.api.coupon_rule_router import router as coupon_rule_router
+from app.api.coupon import router as coupon_router
+from app.api.me import router as me_router
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     await db.connect_to_mongodb()
+    if settings.CREATE_INDEXES_ON_STARTUP:
+        await ensure_indexes(db.database)
+    if settings.RUN_MIGRATIONS_ON_STARTUP:
+        await run_migrations(db.database)
+    if coupon_counters.enabled:
+        await coupon_counters.start(db.database)
+    await coupon_events.start(db.database)
+    compactor = asyncio.ensure_future(run_compactor(db.database))
+    if settings.METRICS_ENABLED:
+        metrics.start()
     yield
     # Shutdown
+    metrics.stop()
+    compactor.cancel()
+    await coupon_events.stop()
+    await coupon_counters.stop()
     await db.close_mongodb_connection()
+    hashing_pool.shutdown()
 
 app = FastAPI(
     title="Coupon API",
@@ -20,10 +46,33 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+if settings.DB_SERVER_TIMING:
+    app.add_middleware(DbTimingMiddleware)
+
 app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(company_router, prefix="/api/companies", tags=["Companies"])
 app.include_router(coupon_rule_router, prefix="/api/coupon-rules", tags=["Coupon Rules"])
+app.include_router(coupon_router, prefix="/api/coupons", tags=["Coupons"])
+app.include_router(me_router, prefix="/api/me", tags=["Me"])
 
 @app.get("/health", tags=["Health"])
 async def health_check():
     return {"status": "ok", "message": "Coupon API is running"}
+
+@app.get("/health/db-pool", tags=["Health"])
+async def db_pool_stats():
+    return pool_stats.stats()
+
+@app.get("/health/write-behind", tags=["Health"])
+async def write_behind_stats():
+    return coupon_counters.stats()
+
+@app.get("/health/ledger", tags=["Health"])
+async def ledger_stats():
+    return coupon_events.stats()
+
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.exposition(), media_type=CONTENT_TYPE)
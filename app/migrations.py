@@ -0,0 +1,118 @@
+"""Idempotent data migrations.
+
+Run on startup when RUN_MIGRATIONS_ON_STARTUP is set, or manually::
+
+    python -m app.migrations
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+logger = logging.getLogger(__name__)
+
+
+async def backfill_coupon_rule_admin_ids(db: AsyncIOMotorDatabase) -> None:
+    """Stamp each coupon rule with its company's ``admin_id``.
+
+    Runs entirely server side: rules missing the field are joined to their
+    company and merged back, so no documents travel through the application.
+    """
+    pipeline = [
+        {"$match": {"admin_id": {"$exists": False}}},
+        {"$lookup": {
+            "from": "companies",
+            "let": {
+                "company_oid": {"$convert": {"input": "$company_id", "to": "objectId", "onError": None}}
+            },
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$_id", "$$company_oid"]}}},
+                {"$project": {"admin_id": 1}},
+            ],
+            "as": "company",
+        }},
+        {"$unwind": "$company"},
+        {"$project": {"admin_id": "$company.admin_id"}},
+        {"$merge": {
+            "into": "coupon_rules",
+            "on": "_id",
+            "whenMatched": "merge",
+            "whenNotMatched": "discard",
+        }},
+    ]
+    await db.coupon_rules.aggregate(pipeline).to_list(length=None)
+
+
+async def seed_coupon_snapshots(db: AsyncIOMotorDatabase) -> None:
+    """Snapshot the counts that predate the coupon ledger, once.
+
+    Coupons created afterwards start from zero and are fully described by their
+    events. The compactor starts folding from the same point.
+    """
+    if await db.ledger_state.find_one({"_id": "compactor"}, projection={"_id": 1}):
+        return
+    start = datetime.now(timezone.utc)
+    await db.coupons.update_many(
+        {"snapshot": {"$exists": False}},
+        [{"$set": {"snapshot": {"count": {"$ifNull": ["$count", 0]}, "upto": start}}}]
+    )
+    await db.ledger_state.insert_one({"_id": "compactor", "upto": start})
+
+
+async def order_coupon_events_by_seq(db: AsyncIOMotorDatabase) -> None:
+    """Give events written before ``seq`` existed one, and date the windows.
+
+    The ledger used to order events and window bounds by ``_id``. Compactor
+    windows end on whole seconds, as does the time embedded in an ObjectId, so
+    converting both keeps every event on the same side of every bound.
+    """
+    await db.coupon_events.update_many(
+        {"seq": {"$exists": False}}, [{"$set": {"seq": {"$toDate": "$_id"}}}]
+    )
+    await db.coupons.update_many(
+        {"snapshot.upto": {"$type": "objectId"}}, [{"$set": {"snapshot.upto": {"$toDate": "$snapshot.upto"}}}]
+    )
+    for field in ("upto", "pending_to"):
+        await db.ledger_state.update_one(
+            {"_id": "compactor", field: {"$type": "objectId"}}, [{"$set": {field: {"$toDate": f"${field}"}}}]
+        )
+
+
+async def stamp_token_version_changes(db: AsyncIOMotorDatabase) -> None:
+    """Date revocations made before ``token_version_changed_at`` existed.
+
+    Revocation refreshes only load users changed within the token lifetime, so
+    these count as revoked now and drop out once that window has passed.
+    """
+    await db.users.update_many(
+        {"token_version": {"$gt": 0}, "token_version_changed_at": {"$exists": False}},
+        {"$set": {"token_version_changed_at": datetime.utcnow()}}
+    )
+
+
+MIGRATIONS = [
+    backfill_coupon_rule_admin_ids,
+    seed_coupon_snapshots,
+    order_coupon_events_by_seq,
+    stamp_token_version_changes,
+]
+
+
+async def run_migrations(db: AsyncIOMotorDatabase) -> None:
+    for migration in MIGRATIONS:
+        logger.info("Running migration %s", migration.__name__)
+        await migration(db)
+
+
+async def _main() -> None:
+    from app.db import db
+
+    await db.connect_to_mongodb()
+    try:
+        await run_migrations(db.database)
+    finally:
+        await db.close_mongodb_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field
+from typing import List, Optional
 from datetime import datetime
 
 
@@ -22,4 +23,59 @@ class CouponInDB(CouponBase):
 class Coupon(CouponBase):
     id: str
     client_id: str
-    count: int
\ No newline at end of file
+    count: int
+
+
+class StampRequest(CouponBase):
+    client_id: str
+
+
+class Reward(BaseModel):
+    rule_id: str
+    required_coupons: int
+    reward: str
+
+
+class StampResponse(Coupon):
+    unlocked_rewards: List[Reward] = []
+    stamps_to_next_reward: Optional[int] = None
+
+
+class RedeemRequest(StampRequest):
+    rule_id: Optional[str] = None
+
+
+class RedeemResponse(Coupon):
+    redeemed_reward: Reward
+
+
+class WalletCoupon(BaseModel):
+    id: str
+    company_id: str
+    company_name: Optional[str] = None
+    barcode: str
+    count: int
+    redeemable_rewards: List[Reward] = []
+    next_reward: Optional[Reward] = None
+    stamps_to_next_reward: Optional[int] = None
+
+
+# Items per batch, and stamps per item; even a batch repeating one coupon stays far from int64
+MAX_BATCH_SIZE = 10000
+
+
+class StampBatchItem(BaseModel):
+    barcode: str
+    client_id: str
+    n: int = Field(1, ge=1, le=MAX_BATCH_SIZE)
+
+
+class StampBatchRequest(BaseModel):
+    company_id: str
+    stamps: List[StampBatchItem] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+
+class StampBatchResponse(BaseModel):
+    stamped: int
+    # One HTTP-style status per request item, in request order: 200, 409 or 422
+    results: List[int]
\ No newline at end of file
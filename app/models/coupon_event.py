@@ -0,0 +1,21 @@
+from pydantic import BaseModel
+from typing import Optional
+from datetime import datetime
+from enum import Enum
+
+
+class CouponEventType(str, Enum):
+    STAMP = "stamp"
+    REDEEM = "redeem"
+
+
+class CouponEvent(BaseModel):
+    id: str
+    coupon_id: str
+    company_id: str
+    type: CouponEventType
+    delta: int
+    actor_id: str
+    pos_id: Optional[str] = None
+    rule_id: Optional[str] = None
+    created_at: datetime
@@ -20,6 +20,7 @@ class CouponRuleUpdate(BaseModel):
 
 class CouponRuleInDB(CouponRuleBase):
     id: str = Field(..., alias="_id")
+    admin_id: Optional[str] = None
     
 
 class CouponRule(CouponRuleBase):
@@ -21,6 +21,7 @@ class UserCreate(UserBase):
 class UserInDB(UserBase):
     id: Optional[str] = Field(None, alias="_id")
     hashed_password: str
+    token_version: int = 0
     
 
 class User(UserBase):
@@ -1,8 +1,9 @@
-from typing import Optional, List
+from typing import AsyncIterator, Optional, List
 from datetime import datetime, timezone
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
 from app.models.company import CompanyCreate, CompanyInDB, Company
+from app.schemas.documents import iter_models, to_model
 
 
 async def create_company(db: AsyncIOMotorDatabase, company: CompanyCreate) -> str:
@@ -17,28 +18,29 @@ async def create_company(db: AsyncIOMotorDatabase, company: CompanyCreate) -> st
 async def get_company_by_id(db: AsyncIOMotorDatabase, company_id: str) -> Optional[CompanyInDB]:
     """Get company by ID."""
     company_doc = await db.companies.find_one({"_id": ObjectId(company_id)})
-    if company_doc:
-        company_doc["_id"] = str(company_doc["_id"])
-        return CompanyInDB(**company_doc)
-    return None
+    return to_model(CompanyInDB, company_doc)
+
+
+async def iter_companies_by_admin(db: AsyncIOMotorDatabase, admin_id: str) -> AsyncIterator[CompanyInDB]:
+    """Stream the companies managed by an admin one at a time."""
+    async for company in iter_models(CompanyInDB, db.companies.find({"admin_id": admin_id})):
+        yield company
 
 
 async def get_companies_by_admin(db: AsyncIOMotorDatabase, admin_id: str) -> List[CompanyInDB]:
     """Get all companies managed by an admin."""
-    companies = []
-    async for company_doc in db.companies.find({"admin_id": admin_id}):
-        company_doc["_id"] = str(company_doc["_id"])
-        companies.append(CompanyInDB(**company_doc))
-    return companies
+    return [company async for company in iter_companies_by_admin(db, admin_id)]
+
+
+async def iter_all_companies(db: AsyncIOMotorDatabase) -> AsyncIterator[CompanyInDB]:
+    """Stream all companies one at a time."""
+    async for company in iter_models(CompanyInDB, db.companies.find()):
+        yield company
 
 
 async def get_all_companies(db: AsyncIOMotorDatabase) -> List[CompanyInDB]:
     """Get all companies."""
-    companies = []
-    async for company_doc in db.companies.find():
-        company_doc["_id"] = str(company_doc["_id"])
-        companies.append(CompanyInDB(**company_doc))
-    return companies
+    return [company async for company in iter_all_companies(db)]
 
 
 async def update_company(db: AsyncIOMotorDatabase, company_id: str, update_data: dict) -> bool:
@@ -1,8 +1,22 @@
-from typing import Optional, List
+import logging
+from typing import Dict, Optional, List, Set, Tuple
 from datetime import datetime, timezone
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from app.config import settings
+from app.core.idempotency import IdempotencyKeyReused
+from app.core.write_behind import coupon_counters
+from app.ledger import coupon_event, coupon_events
+from app.models.coupon_event import CouponEventType
 from app.models.coupon import CouponCreate, CouponInDB, Coupon
+from app.schemas.documents import to_model, to_models
+
+logger = logging.getLogger(__name__)
+
+# Write-behind markers and recent idempotency keys are bookkeeping, not coupon fields
+COUPON_PROJECTION = {"write_behind_seq": 0, "ops": 0}
 
 
 async def create_coupon(db: AsyncIOMotorDatabase, coupon: CouponCreate, client_id: str) -> str:
@@ -17,40 +31,41 @@ async def create_coupon(db: AsyncIOMotorDatabase, coupon: CouponCreate, client_i
     return str(result.inserted_id)
 
 
+def _to_coupons(coupon_docs: List[dict]) -> List[CouponInDB]:
+    for coupon_doc in coupon_docs:
+        # Increments still buffered by the write-behind aggregator
+        coupon_doc["count"] = coupon_doc.get("count", 0) + coupon_counters.pending_delta(str(coupon_doc["_id"]))
+    return to_models(CouponInDB, coupon_docs)
+
+
+def _to_coupon(coupon_doc: dict) -> CouponInDB:
+    return _to_coupons([coupon_doc])[0]
+
+
 async def get_coupon_by_id(db: AsyncIOMotorDatabase, coupon_id: str) -> Optional[CouponInDB]:
     """Get coupon by ID."""
-    coupon_doc = await db.coupons.find_one({"_id": ObjectId(coupon_id)})
+    coupon_doc = await db.coupons.find_one({"_id": ObjectId(coupon_id)}, projection=COUPON_PROJECTION)
     if coupon_doc:
-        coupon_doc["_id"] = str(coupon_doc["_id"])
-        return CouponInDB(**coupon_doc)
+        return _to_coupon(coupon_doc)
     return None
 
 
 async def get_coupon_by_barcode_and_client(db: AsyncIOMotorDatabase, barcode: str, client_id: str) -> Optional[CouponInDB]:
     """Get coupon by barcode and client ID."""
-    coupon_doc = await db.coupons.find_one({"barcode": barcode, "client_id": client_id})
+    coupon_doc = await db.coupons.find_one({"barcode": barcode, "client_id": client_id}, projection=COUPON_PROJECTION)
     if coupon_doc:
-        coupon_doc["_id"] = str(coupon_doc["_id"])
-        return CouponInDB(**coupon_doc)
+        return _to_coupon(coupon_doc)
     return None
 
 
 async def get_coupons_by_client(db: AsyncIOMotorDatabase, client_id: str) -> List[CouponInDB]:
     """Get all coupons for a client."""
-    coupons = []
-    async for coupon_doc in db.coupons.find({"client_id": client_id}):
-        coupon_doc["_id"] = str(coupon_doc["_id"])
-        coupons.append(CouponInDB(**coupon_doc))
-    return coupons
+    return _to_coupons(await db.coupons.find({"client_id": client_id}, projection=COUPON_PROJECTION).to_list(length=None))
 
 
 async def get_coupons_by_company(db: AsyncIOMotorDatabase, company_id: str) -> List[CouponInDB]:
     """Get all coupons for a company."""
-    coupons = []
-    async for coupon_doc in db.coupons.find({"company_id": company_id}):
-        coupon_doc["_id"] = str(coupon_doc["_id"])
-        coupons.append(CouponInDB(**coupon_doc))
-    return coupons
+    return _to_coupons(await db.coupons.find({"company_id": company_id}, projection=COUPON_PROJECTION).to_list(length=None))
 
 
 async def update_coupon_count(db: AsyncIOMotorDatabase, coupon_id: str, new_count: int) -> bool:
@@ -63,7 +78,14 @@ async def update_coupon_count(db: AsyncIOMotorDatabase, coupon_id: str, new_coun
 
 
 async def increment_coupon_count(db: AsyncIOMotorDatabase, coupon_id: str) -> bool:
-    """Increment coupon count by 1."""
+    """Increment coupon count by 1.
+
+    In write-behind mode the increment is journaled and buffered, and True only
+    means it was accepted; it reaches the coupon on the next flush.
+    """
+    if coupon_counters.enabled:
+        coupon_counters.increment(str(ObjectId(coupon_id)))
+        return True
     result = await db.coupons.update_one(
         {"_id": ObjectId(coupon_id)},
         {"$inc": {"count": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}}
@@ -71,6 +93,281 @@ async def increment_coupon_count(db: AsyncIOMotorDatabase, coupon_id: str) -> bo
     return result.modified_count > 0
 
 
+def _count_update(
+    delta: int, now: datetime, idempotency_key: Optional[str], event_id: Optional[ObjectId] = None,
+    fingerprint: Optional[str] = None
+):
+    if idempotency_key is None:
+        return {
+            "$inc": {"count": delta},
+            "$set": {"updated_at": now},
+            "$setOnInsert": {"created_at": now},
+        }
+    # Pipeline form, so the key is recorded with the resulting count in the same
+    # atomic update; only the most recent keys are kept per coupon
+    op = {"key": {"$literal": idempotency_key}, "count": "$count", "at": now}
+    if event_id is not None:
+        op["event"] = event_id
+    if fingerprint is not None:
+        op["fp"] = fingerprint
+    return [
+        {"$set": {
+            "count": {"$add": [{"$ifNull": ["$count", 0]}, delta]},
+            "updated_at": now,
+            "created_at": {"$ifNull": ["$created_at", now]},
+        }},
+        {"$set": {"ops": {"$slice": [
+            {"$concatArrays": [
+                {"$ifNull": ["$ops", []]},
+                [op],
+            ]},
+            -settings.IDEMPOTENCY_OPS_PER_COUPON,
+        ]}}},
+    ]
+
+
+def _ensure_coupon(now: datetime) -> dict:
+    # Creates a missing coupon and leaves an existing one untouched, so hot coupons
+    # see no document write; the count arrives with the next write-behind flush
+    return {"$setOnInsert": {"count": 0, "created_at": now, "updated_at": now}}
+
+
+def _unapplied(query: dict, idempotency_key: Optional[str]) -> dict:
+    # A coupon that already carries the key must not match again
+    return query if idempotency_key is None else {**query, "ops.key": {"$ne": idempotency_key}}
+
+
+async def _replayed(
+    db: AsyncIOMotorDatabase, query: dict, idempotency_key: Optional[str], fingerprint: Optional[str] = None
+) -> Optional[CouponInDB]:
+    """The coupon as it stood right after the write recorded under ``idempotency_key``.
+
+    Raises IdempotencyKeyReused when the key was recorded with another fingerprint.
+    """
+    if idempotency_key is None:
+        return None
+    coupon_doc = await db.coupons.find_one(
+        {**query, "ops.key": idempotency_key}, projection={"write_behind_seq": 0}
+    )
+    if coupon_doc is None:
+        return None
+    op = next(op for op in coupon_doc["ops"] if op["key"] == idempotency_key)
+    if fingerprint is not None and op.get("fp", fingerprint) != fingerprint:
+        raise IdempotencyKeyReused()
+    coupon_doc["count"] = op["count"]
+    return to_model(CouponInDB, coupon_doc)
+
+
+async def stamp_coupon(
+    db: AsyncIOMotorDatabase, company_id: str, barcode: str, client_id: str, stamps: int = 1,
+    idempotency_key: Optional[str] = None, actor_id: Optional[str] = None, pos_id: Optional[str] = None,
+    fingerprint: Optional[str] = None
+) -> CouponInDB:
+    """Add stamps to a client's coupon, creating it on the first stamp, in one round trip.
+
+    With ``idempotency_key``, a repeated call returns the coupon as the first
+    call left it instead of stamping again; the key is recorded with
+    ``fingerprint``, and a repeat with another one raises IdempotencyKeyReused.
+    With ``actor_id``, the stamp is
+    recorded in the coupon ledger. Raises DuplicateKeyError when the barcode is
+    already held by the client under another company.
+
+    In write-behind mode an unkeyed stamp only makes sure the coupon exists and
+    buffers the increment; keyed stamps are always written through, since the
+    key is recorded in the same update.
+    """
+    query = {"barcode": barcode, "client_id": client_id, "company_id": company_id}
+    buffered = coupon_counters.enabled and idempotency_key is None
+    now = datetime.now(timezone.utc)
+    update = _ensure_coupon(now) if buffered else _count_update(stamps, now, idempotency_key, fingerprint=fingerprint)
+    try:
+        coupon_doc = await db.coupons.find_one_and_update(
+            _unapplied(query, idempotency_key), update, projection=COUPON_PROJECTION, upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # A coupon already recording the key no longer matches, so a retry lands here too
+        replayed = await _replayed(db, query, idempotency_key, fingerprint)
+        if replayed is not None:
+            return replayed
+        # Two first stamps raced to insert; the loser now finds the winner's document
+        coupon_doc = await db.coupons.find_one_and_update(
+            _unapplied(query, idempotency_key), update, projection=COUPON_PROJECTION, upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    if buffered:
+        # _to_coupon adds the buffered stamps back into the returned count
+        coupon_counters.increment(str(coupon_doc["_id"]), stamps)
+    if actor_id is not None:
+        coupon_events.record([
+            coupon_event(str(coupon_doc["_id"]), company_id, CouponEventType.STAMP, stamps, actor_id, pos_id)
+        ])
+    return _to_coupon(coupon_doc)
+
+
+async def stamp_coupons_batch(
+    db: AsyncIOMotorDatabase, company_id: str, stamps: Dict[Tuple[str, str], int],
+    idempotency_key: Optional[str] = None, actor_id: Optional[str] = None, pos_id: Optional[str] = None
+) -> Set[Tuple[str, str]]:
+    """Apply ``{(barcode, client_id): n}`` stamps in one unordered bulk write.
+
+    Returns the keys that could not be stamped because the barcode is held by
+    the client under another company. With ``actor_id``, applied stamps are
+    recorded in the coupon ledger, best-effort.
+
+    With ``idempotency_key``, every coupon records the key with its stamps, as
+    a keyed single stamp does, so a retry after any failure, even one that left
+    the batch partly written, skips the coupons already stamped under the key
+    and the caller may release the key on error. Keyed batches are written
+    through; in write-behind mode an unkeyed batch only creates missing coupons
+    and the stamps are buffered.
+    """
+    buffered = coupon_counters.enabled and idempotency_key is None
+    # Recorded next to the key, so a retry re-records the same events instead of new ones
+    event_ids = {key: ObjectId() for key in stamps} if idempotency_key and actor_id is not None else {}
+    failed, replayed = await _bulk_stamp(db, company_id, stamps, buffered, idempotency_key, event_ids)
+    applied = {key: n for key, n in stamps.items() if key not in failed and key not in replayed}
+    if actor_id is not None and replayed:
+        coupon_events.record(
+            coupon_event(coupon_id, company_id, CouponEventType.STAMP, stamps[key], actor_id, pos_id, event_id=event_id)
+            for key, (coupon_id, event_id) in replayed.items()
+            if event_id is not None
+        )
+    if (buffered or actor_id is not None) and applied:
+        # bulk_write only reports ids of inserted coupons; one read resolves the rest
+        try:
+            coupon_docs = await db.coupons.find(
+                {
+                    "company_id": company_id,
+                    "barcode": {"$in": list({barcode for barcode, _ in applied})},
+                    "client_id": {"$in": list({client_id for _, client_id in applied})},
+                },
+                projection={"barcode": 1, "client_id": 1}
+            ).to_list(length=None)
+        except Exception:
+            if buffered:
+                # Nothing is stamped until buffered, so the caller may still retry
+                raise
+            # The stamps are written: missing ledger events beat a retry applying them twice
+            logger.exception("Reading stamped coupons for the ledger failed; %d events not recorded", len(applied))
+            return failed
+        coupon_docs = [doc for doc in coupon_docs if (doc["barcode"], doc["client_id"]) in applied]
+        if buffered:
+            for coupon_doc in coupon_docs:
+                coupon_counters.increment(str(coupon_doc["_id"]), applied[coupon_doc["barcode"], coupon_doc["client_id"]])
+        if actor_id is not None:
+            coupon_events.record(
+                coupon_event(
+                    str(coupon_doc["_id"]), company_id, CouponEventType.STAMP,
+                    applied[coupon_doc["barcode"], coupon_doc["client_id"]], actor_id, pos_id,
+                    event_id=event_ids.get((coupon_doc["barcode"], coupon_doc["client_id"]))
+                )
+                for coupon_doc in coupon_docs
+            )
+    return failed
+
+
+async def _bulk_stamp(
+    db: AsyncIOMotorDatabase, company_id: str, stamps: Dict[Tuple[str, str], int], buffered: bool = False,
+    idempotency_key: Optional[str] = None, event_ids: Optional[Dict[Tuple[str, str], ObjectId]] = None
+) -> Tuple[Set[Tuple[str, str]], Dict[Tuple[str, str], Tuple[str, Optional[ObjectId]]]]:
+    """Returns the keys held under another company, and the coupon and event ids of
+    the keys an earlier attempt under ``idempotency_key`` already stamped."""
+    now = datetime.now(timezone.utc)
+    keys = list(stamps)
+    event_ids = event_ids or {}
+    replayed = {}
+    # Duplicate keys come from insert races, from a barcode held under another
+    # company, or from a coupon that already records the idempotency key, which
+    # no longer matches its filter; one retry of just those operations separates them
+    for _ in range(2):
+        operations = [
+            UpdateOne(
+                _unapplied({"barcode": barcode, "client_id": client_id, "company_id": company_id}, idempotency_key),
+                _ensure_coupon(now) if buffered else _count_update(
+                    stamps[barcode, client_id], now, idempotency_key, event_ids.get((barcode, client_id))
+                ),
+                upsert=True
+            )
+            for barcode, client_id in keys
+        ]
+        try:
+            await db.coupons.bulk_write(operations, ordered=False)
+            return set(), replayed
+        except BulkWriteError as exc:
+            # Unordered: every operation not reported here was applied
+            errors = exc.details["writeErrors"]
+            if any(error["code"] != 11000 for error in errors):
+                raise
+            keys = [keys[error["index"]] for error in errors]
+        if idempotency_key is not None:
+            replayed.update(await _recorded(db, company_id, keys, idempotency_key))
+            keys = [key for key in keys if key not in replayed]
+            if not keys:
+                return set(), replayed
+    return set(keys), replayed
+
+
+async def _recorded(
+    db: AsyncIOMotorDatabase, company_id: str, keys: List[Tuple[str, str]], idempotency_key: str
+) -> Dict[Tuple[str, str], Tuple[str, Optional[ObjectId]]]:
+    coupon_docs = await db.coupons.find(
+        {
+            "company_id": company_id,
+            "barcode": {"$in": list({barcode for barcode, _ in keys})},
+            "client_id": {"$in": list({client_id for _, client_id in keys})},
+            "ops.key": idempotency_key,
+        },
+        projection={"barcode": 1, "client_id": 1, "ops": {"$elemMatch": {"key": idempotency_key}}}
+    ).to_list(length=None)
+    wanted = set(keys)
+    return {
+        (doc["barcode"], doc["client_id"]): (str(doc["_id"]), doc["ops"][0].get("event"))
+        for doc in coupon_docs
+        if (doc["barcode"], doc["client_id"]) in wanted
+    }
+
+
+async def redeem_coupon(
+    db: AsyncIOMotorDatabase, company_id: str, barcode: str, client_id: str, required: int,
+    idempotency_key: Optional[str] = None, actor_id: Optional[str] = None, pos_id: Optional[str] = None,
+    rule_id: Optional[str] = None, fingerprint: Optional[str] = None
+) -> Optional[CouponInDB]:
+    """Spend ``required`` stamps if the coupon holds at least that many.
+
+    The balance check and the decrement are one conditional update, so concurrent
+    redemptions can never spend the same stamps twice. With ``idempotency_key``,
+    a repeated call returns the coupon as the first call left it, or raises
+    IdempotencyKeyReused if it was made with another ``fingerprint``. With
+    ``actor_id``, the redemption is recorded in the coupon ledger. Returns None
+    when the coupon does not exist or its count is too low.
+
+    In write-behind mode a redemption the stored count can't cover flushes this
+    process's buffered stamps and tries once more, so stamps it has already
+    acknowledged can be spent.
+    """
+    query = {"barcode": barcode, "client_id": client_id, "company_id": company_id}
+    redeem = {**_unapplied(query, idempotency_key), "count": {"$gte": required}}
+    update = _count_update(-required, datetime.now(timezone.utc), idempotency_key, fingerprint=fingerprint)
+    coupon_doc = await db.coupons.find_one_and_update(
+        redeem, update, projection=COUPON_PROJECTION, return_document=ReturnDocument.AFTER
+    )
+    if coupon_doc is None and coupon_counters.enabled and coupon_counters.has_pending():
+        await coupon_counters.flush()
+        coupon_doc = await db.coupons.find_one_and_update(
+            redeem, update, projection=COUPON_PROJECTION, return_document=ReturnDocument.AFTER
+        )
+    if coupon_doc:
+        if actor_id is not None:
+            coupon_events.record([
+                coupon_event(
+                    str(coupon_doc["_id"]), company_id, CouponEventType.REDEEM, -required, actor_id, pos_id, rule_id
+                )
+            ])
+        return _to_coupon(coupon_doc)
+    return await _replayed(db, query, idempotency_key, fingerprint)
+
+
 async def delete_coupon(db: AsyncIOMotorDatabase, coupon_id: str) -> bool:
     """Delete coupon by ID."""
     result = await db.coupons.delete_one({"_id": ObjectId(coupon_id)})
@@ -1,12 +1,15 @@
-from typing import Optional, List
+from typing import AsyncIterator, Optional, List
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
 from app.models.coupon_rule import CouponRuleCreate, CouponRuleInDB, CouponRule
+from app.schemas.documents import iter_models, to_model
 
 
-async def create_coupon_rule(db: AsyncIOMotorDatabase, coupon_rule: CouponRuleCreate) -> str:
+async def create_coupon_rule(db: AsyncIOMotorDatabase, coupon_rule: CouponRuleCreate, admin_id: Optional[str] = None) -> str:
     """Create a new coupon rule in the database."""
     coupon_rule_dict = coupon_rule.model_dump()
+    if admin_id is not None:
+        coupon_rule_dict["admin_id"] = admin_id
     
     result = await db.coupon_rules.insert_one(coupon_rule_dict)
     return str(result.inserted_id)
@@ -15,19 +18,18 @@ async def create_coupon_rule(db: AsyncIOMotorDatabase, coupon_rule: CouponRuleCr
 async def get_coupon_rule_by_id(db: AsyncIOMotorDatabase, rule_id: str) -> Optional[CouponRuleInDB]:
     """Get coupon rule by ID."""
     rule_doc = await db.coupon_rules.find_one({"_id": ObjectId(rule_id)})
-    if rule_doc:
-        rule_doc["_id"] = str(rule_doc["_id"])
-        return CouponRuleInDB(**rule_doc)
-    return None
+    return to_model(CouponRuleInDB, rule_doc)
+
+
+async def iter_coupon_rules_by_company(db: AsyncIOMotorDatabase, company_id: str) -> AsyncIterator[CouponRuleInDB]:
+    """Stream the coupon rules of a company one at a time."""
+    async for rule in iter_models(CouponRuleInDB, db.coupon_rules.find({"company_id": company_id})):
+        yield rule
 
 
 async def get_coupon_rules_by_company(db: AsyncIOMotorDatabase, company_id: str) -> List[CouponRuleInDB]:
     """Get all coupon rules for a company."""
-    rules = []
-    async for rule_doc in db.coupon_rules.find({"company_id": company_id}):
-        rule_doc["_id"] = str(rule_doc["_id"])
-        rules.append(CouponRuleInDB(**rule_doc))
-    return rules
+    return [rule async for rule in iter_coupon_rules_by_company(db, company_id)]
 
 
 async def update_coupon_rule(db: AsyncIOMotorDatabase, rule_id: str, update_data: dict) -> bool:
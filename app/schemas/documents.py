@@ -0,0 +1,61 @@
+"""Converting MongoDB documents into models, a page at a time.
+
+Every helper used to stringify ``_id`` and call ``Model(**doc)`` once per row.
+Here a whole page goes through one cached ``TypeAdapter(List[Model])`` call,
+which spends its time in pydantic-core instead of per-row Python dispatch.
+
+There is deliberately no unvalidated path: with pydantic 2, validating a
+flat document is cheap next to allocating the instance, and both
+``model_construct`` and building instances by hand measured slower than the
+batch call (see benchmarks/bench_documents.py).
+"""
+from functools import lru_cache
+from typing import AsyncIterable, AsyncIterator, Iterable, List, Optional, Type, TypeVar
+from pydantic import BaseModel, TypeAdapter
+
+Model = TypeVar("Model", bound=BaseModel)
+
+# Documents converted per call when streaming a cursor: about one server
+# batch, so the first rows still go out early
+PAGE_SIZE = 100
+
+
+def with_id(doc: dict) -> dict:
+    """Copy of ``doc`` carrying its ObjectId as the string ``id`` response models expect."""
+    return {**doc, "id": str(doc["_id"])}
+
+
+@lru_cache(maxsize=None)
+def _list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+
+def to_models(model: Type[Model], docs: Iterable[dict]) -> List[Model]:
+    """Convert raw documents, stringifying ``_id`` in place, in one batch."""
+    docs = list(docs)
+    for doc in docs:
+        if "_id" in doc:
+            doc["_id"] = str(doc["_id"])
+    return _list_adapter(model).validate_python(docs)
+
+
+def to_model(model: Type[Model], doc: Optional[dict]) -> Optional[Model]:
+    """Single-document to_models; None stays None."""
+    if doc is None:
+        return None
+    if "_id" in doc:
+        doc["_id"] = str(doc["_id"])
+    return model.model_validate(doc)
+
+
+async def iter_models(model: Type[Model], cursor: AsyncIterable[dict]) -> AsyncIterator[Model]:
+    """Stream a cursor as models, converting PAGE_SIZE documents per call."""
+    page = []
+    async for doc in cursor:
+        page.append(doc)
+        if len(page) >= PAGE_SIZE:
+            for instance in to_models(model, page):
+                yield instance
+            page = []
+    for instance in to_models(model, page):
+        yield instance
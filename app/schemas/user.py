@@ -3,6 +3,12 @@ from datetime import datetime
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
 from app.models.user import UserCreate, UserInDB, User
+from app.core.principals import invalidate_principal
+from app.core.revocation import forget_user, revoke_user_tokens
+from app.schemas.documents import to_model
+
+# Fields carried as token claims; changing one must retire the tokens that hold the old value
+CLAIM_FIELDS = ("email", "name", "role")
 
 
 async def create_user(db: AsyncIOMotorDatabase, user: UserCreate, hashed_password: str) -> str:
@@ -18,31 +24,31 @@ async def create_user(db: AsyncIOMotorDatabase, user: UserCreate, hashed_passwor
 async def get_user_by_id(db: AsyncIOMotorDatabase, user_id: str) -> Optional[UserInDB]:
     """Get user by ID."""
     user_doc = await db.users.find_one({"_id": ObjectId(user_id)})
-    if user_doc:
-        user_doc["_id"] = str(user_doc["_id"])
-        return UserInDB(**user_doc)
-    return None
+    return to_model(UserInDB, user_doc)
 
 
 async def get_user_by_email(db: AsyncIOMotorDatabase, email: str) -> Optional[UserInDB]:
     """Get user by email."""
     user_doc = await db.users.find_one({"email": email})
-    if user_doc:
-        user_doc["_id"] = str(user_doc["_id"])
-        return UserInDB(**user_doc)
-    return None
+    return to_model(UserInDB, user_doc)
 
 
 async def update_user(db: AsyncIOMotorDatabase, user_id: str, update_data: dict) -> bool:
-    """Update user data."""
+    """Update user data; True if the user was modified."""
+    claims = {field: update_data[field] for field in CLAIM_FIELDS if field in update_data}
+    # Only a claim that actually changes retires the user's tokens
+    if claims and await revoke_user_tokens(
+        db, user_id, update_data, only_if={"$or": [{field: {"$ne": value}} for field, value in claims.items()]}
+    ):
+        return True
     result = await db.users.update_one(
         {"_id": ObjectId(user_id)},
         {"$set": update_data}
     )
+    invalidate_principal(user_id)
     return result.modified_count > 0
 
 
 async def delete_user(db: AsyncIOMotorDatabase, user_id: str) -> bool:
     """Delete user by ID."""
-    result = await db.users.delete_one({"_id": ObjectId(user_id)})
-    return result.deleted_count > 0
\ No newline at end of file
+    return await forget_user(db, user_id)
\ No newline at end of file
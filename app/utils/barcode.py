@@ -0,0 +1,101 @@
+"""Self-validating coupon barcodes.
+
+A barcode is the 12-byte company id followed by a 32-bit sequence number,
+written as 26 Crockford Base32 characters, plus one Luhn mod 32 check
+character: 27 characters in all. A mistyped or foreign code is rejected
+without touching MongoDB, and the company is read straight from the code.
+
+Only the canonical uppercase form is accepted, so a coupon can never be
+stored under two spellings of the same barcode.
+"""
+import re
+from operator import getitem
+from typing import Iterable, List, Optional, Tuple
+from bson import ObjectId
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+BARCODE_LENGTH = 27
+MAX_SEQUENCE = 2 ** 32 - 1
+
+_BASE = len(ALPHABET)
+# Crockford characters to the digits int(..., 32) understands; anything else
+# becomes "!" and fails the shape check
+_TO_DIGITS = {code: "!" for code in range(128)}
+_TO_DIGITS.update(str.maketrans(ALPHABET, "0123456789abcdefghijklmnopqrstuv"))
+# Kept so validate_barcodes can translate a whole batch joined by newlines
+_TO_DIGITS[ord("\n")] = "\n"
+_DIGIT_VALUES = bytes.maketrans(b"0123456789abcdefghijklmnopqrstuv", bytes(range(_BASE)))
+_FROM_DIGITS = str.maketrans("0123456789abcdefghijklmnopqrstuv", ALPHABET)
+# 128 payload bits in 130: the leading character is at most 7
+_SHAPE = re.compile(r"[0-7][0-9a-v]{26}", re.ASCII)
+
+
+def _addend(factor: int, value: int) -> int:
+    product = factor * value
+    return product // _BASE + product % _BASE
+
+
+# Luhn mod N doubles every second character counting left from the check
+# character; with a fixed length that is a per-position lookup table
+_ADDENDS = tuple(
+    bytes(_addend(2 if (BARCODE_LENGTH - 1 - position) % 2 else 1, value) for value in range(_BASE))
+    for position in range(BARCODE_LENGTH)
+)
+
+
+def _checksum(values: bytes) -> int:
+    return sum(map(getitem, _ADDENDS, values)) % _BASE
+
+
+def _to_base32(number: int) -> str:
+    digits = []
+    for _ in range(BARCODE_LENGTH - 1):
+        number, value = divmod(number, _BASE)
+        digits.append("0123456789abcdefghijklmnopqrstuv"[value])
+    return "".join(reversed(digits))
+
+
+def encode_barcode(company_id: str, sequence: int) -> str:
+    """The barcode for coupon ``sequence`` of ``company_id``."""
+    if not 0 <= sequence <= MAX_SEQUENCE:
+        raise ValueError("Barcode sequence out of range")
+    number = int.from_bytes(ObjectId(company_id).binary, "big") << 32 | sequence
+    digits = _to_base32(number)
+    check = -_checksum(digits.encode("ascii").translate(_DIGIT_VALUES)) % _BASE
+    return digits.translate(_FROM_DIGITS) + ALPHABET[check]
+
+
+def _decode_digits(digits: str) -> Optional[Tuple[str, int]]:
+    if not _SHAPE.fullmatch(digits) or _checksum(digits.encode("ascii").translate(_DIGIT_VALUES)):
+        return None
+    number = int(digits[:-1], _BASE)
+    return str(ObjectId((number >> 32).to_bytes(12, "big"))), number & MAX_SEQUENCE
+
+
+def decode_barcode(barcode: str) -> Tuple[str, int]:
+    """The (company_id, sequence) encoded in ``barcode``; raises ValueError if invalid."""
+    decoded = _decode_digits(barcode.translate(_TO_DIGITS))
+    if decoded is None:
+        raise ValueError("Invalid barcode")
+    return decoded
+
+
+def barcode_company(barcode: str) -> Optional[str]:
+    """The company ``barcode`` belongs to, or None if it is not a valid barcode."""
+    decoded = _decode_digits(barcode.translate(_TO_DIGITS))
+    return decoded and decoded[0]
+
+
+def validate_barcodes(barcodes: Iterable[str]) -> List[Optional[str]]:
+    """barcode_company for a whole batch, e.g. the rows of a bulk import file.
+
+    The whole batch is translated in one pass; if a code contains a newline
+    the codes are checked one by one instead.
+    """
+    barcodes = list(barcodes)
+    if not barcodes:
+        return []
+    rows = "\n".join(barcodes).translate(_TO_DIGITS).split("\n")
+    if len(rows) != len(barcodes):
+        return [barcode_company(barcode) for barcode in barcodes]
+    return [decoded and decoded[0] for decoded in map(_decode_digits, rows)]
@@ -0,0 +1,87 @@
+"""Pure-Python Code 128 encoder with SVG and PNG output.
+
+Barcodes made only of digits (an even number of them) use code set C, two
+digits per symbol; everything else printable ASCII uses code set B.
+"""
+import struct
+import zlib
+from typing import List
+
+# Bar/space widths in modules for symbol values 0-106 (103-105 are the
+# start codes, 106 the stop code with its final bar)
+_PATTERNS = (
+    "212222", "222122", "222221", "121223", "121322", "131222", "122213", "122312", "132212", "221213",
+    "221312", "231212", "112232", "122132", "122231", "113222", "123122", "123221", "223211", "221132",
+    "221231", "213212", "223112", "312131", "311222", "321122", "321221", "312212", "322112", "322211",
+    "212123", "212321", "232121", "111323", "131123", "131321", "112313", "132113", "132311", "211313",
+    "231113", "231311", "112133", "112331", "132131", "113123", "113321", "133121", "313121", "211331",
+    "231131", "213113", "213311", "213131", "311123", "311321", "331121", "312113", "312311", "332111",
+    "314111", "221411", "431111", "111224", "111422", "121124", "121421", "141122", "141221", "112214",
+    "112412", "122114", "122411", "142112", "142211", "241211", "221114", "413111", "241112", "134111",
+    "111242", "121142", "121241", "114212", "124112", "124211", "411212", "421112", "421211", "212141",
+    "214121", "412121", "111143", "111341", "131141", "114113", "114311", "411113", "411311", "113141",
+    "114131", "311141", "411131", "211412", "211214", "211232", "2331112",
+)
+_START_B = 104
+_START_C = 105
+_STOP = 106
+QUIET_ZONE = 10
+BAR_HEIGHT = 40
+
+
+def symbols(data: str) -> List[int]:
+    """Symbol values for ``data``, from start code through check symbol."""
+    if not data:
+        raise ValueError("Nothing to encode")
+    if data.isascii() and data.isdigit() and len(data) % 2 == 0:
+        values = [_START_C] + [int(data[i:i + 2]) for i in range(0, len(data), 2)]
+    elif all(32 <= ord(char) < 127 for char in data):
+        values = [_START_B] + [ord(char) - 32 for char in data]
+    else:
+        raise ValueError("Code 128 can only encode printable ASCII")
+    check = (values[0] + sum(position * value for position, value in enumerate(values[1:], 1))) % 103
+    return values + [check]
+
+
+def modules(data: str) -> List[int]:
+    """Alternating bar/space widths, in modules, starting with a bar; no quiet zones."""
+    return [int(width) for value in symbols(data) + [_STOP] for width in _PATTERNS[value]]
+
+
+def render_svg(data: str, scale: int = 2) -> bytes:
+    widths = modules(data)
+    x = QUIET_ZONE
+    bars = []
+    for index, width in enumerate(widths):
+        if index % 2 == 0:
+            bars.append(f'<rect x="{x * scale}" width="{width * scale}" height="{BAR_HEIGHT * scale}"/>')
+        x += width
+    total_width = (x + QUIET_ZONE) * scale
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{total_width}" height="{BAR_HEIGHT * scale}" '
+        f'viewBox="0 0 {total_width} {BAR_HEIGHT * scale}" shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="#fff"/><g fill="#000">{"".join(bars)}</g></svg>'
+    ).encode("ascii")
+
+
+def _png_chunk(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I", len(payload)) + kind + payload + struct.pack(">I", zlib.crc32(kind + payload))
+
+
+def render_png(data: str, scale: int = 2) -> bytes:
+    # 1-bit grayscale: 0 is black, 1 white. Every row of a linear barcode is
+    # the same, so one row is built and repeated
+    pixels = "1" * QUIET_ZONE
+    for index, width in enumerate(modules(data)):
+        pixels += ("0" if index % 2 == 0 else "1") * width
+    pixels += "1" * QUIET_ZONE
+    pixels = "".join(pixel * scale for pixel in pixels)
+    width, height = len(pixels), BAR_HEIGHT * scale
+    padded = pixels.ljust(-(-width // 8) * 8, "1")
+    row = b"\x00" + int(padded, 2).to_bytes(len(padded) // 8, "big")
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 1, 0, 0, 0, 0)),
+        _png_chunk(b"IDAT", zlib.compress(row * height, 9)),
+        _png_chunk(b"IEND", b""),
+    ))
@@ -0,0 +1,17 @@
+import base64
+import binascii
+from bson import ObjectId
+from bson.errors import InvalidId
+
+
+def encode_cursor(last_id: ObjectId) -> str:
+    """Opaque keyset cursor pointing just past ``last_id``."""
+    return base64.urlsafe_b64encode(ObjectId(last_id).binary).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> ObjectId:
+    """Inverse of encode_cursor; raises ValueError for malformed cursors."""
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (binascii.Error, InvalidId, UnicodeEncodeError, TypeError) as exc:
+        raise ValueError("Invalid cursor") from exc
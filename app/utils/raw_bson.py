@@ -0,0 +1,59 @@
+"""Opt-in raw BSON pass-through for large list endpoints.
+
+With RAW_BSON_LISTS, list endpoints read ``find_raw_batches`` and the server
+projects each document straight into the response shape (``_id`` becomes
+the string ``id``, missing optional fields become their default). Each raw
+batch is then decoded and encoded to JSON in one call apiece, with no models,
+no response validation and no jsonable_encoder pass, and a long list streams
+out batch by batch instead of being held whole.
+
+libbson's own BSON-to-JSON transcoder (python-bsonjs) was measured as well
+and is several times slower per document than ``decode_all`` followed by
+orjson, so it is not used.
+
+Only response models made of strings, numbers, booleans and nulls can go
+through here; the projection does not convert dates.
+"""
+from functools import lru_cache
+from typing import AsyncIterable, AsyncIterator, Type
+import bson
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from app.utils.responses import dumps
+
+
+@lru_cache(maxsize=None)
+def _projection(model: Type[BaseModel]) -> tuple:
+    projection = {"_id": 0}
+    for name, field in model.model_fields.items():
+        if name == "id":
+            projection[name] = {"$toString": "$_id"}
+        elif field.is_required():
+            projection[name] = f"${name}"
+        else:
+            projection[name] = {"$ifNull": [f"${name}", {"$literal": field.get_default()}]}
+    return tuple(projection.items())
+
+
+def response_projection(model: Type[BaseModel]) -> dict:
+    """Find projection that makes the server return documents shaped like ``model``."""
+    return dict(_projection(model))
+
+
+async def read_batches(batches: AsyncIterable[bytes]) -> bytes:
+    """Every batch of a small result, concatenated into one."""
+    return b"".join([batch async for batch in batches])
+
+
+async def _json_array(batches: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    separator = b"["
+    async for batch in batches:
+        if batch:
+            yield separator + dumps(bson.decode_all(batch))[1:-1]
+            separator = b","
+    yield b"[]" if separator == b"[" else b"]"
+
+
+def raw_list_response(batches: AsyncIterable[bytes]) -> StreamingResponse:
+    """Stream raw batches as one JSON array, a batch per chunk."""
+    return StreamingResponse(_json_array(batches), media_type="application/json")
@@ -0,0 +1,62 @@
+"""Opt-in fast JSON responses for trusted database documents.
+
+With FAST_RESPONSES, handlers wrap their result in ``model_response``:
+documents are projected onto the response model's fields without
+validation and serialized once, with orjson when it is installed (``pip
+install orjson``; not a declared dependency) and pydantic-core otherwise. Returning a
+Response also skips FastAPI's own response_model validation and encoding.
+
+Building model instances with ``model_construct`` was measured too, but in
+pydantic 2 it runs in Python and costs more than validating, so plain dicts
+shaped like the model are serialized instead. Only use this for flat models
+and for data read from, or just written to, our own collections.
+"""
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Type, Union
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+import pydantic_core
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        # UTC as "Z", like pydantic
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+    return pydantic_core.to_json(content)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+@lru_cache(maxsize=None)
+def _field_defaults(model: Type[BaseModel]) -> Tuple[Tuple[str, Any], ...]:
+    return tuple(
+        (name, None if field.is_required() else field.get_default(call_default_factory=True))
+        for name, field in model.model_fields.items()
+    )
+
+
+def _project(fields: Tuple[Tuple[str, Any], ...], item: dict) -> dict:
+    return {name: item.get(name, default) for name, default in fields}
+
+
+def model_response(
+    model: Type[BaseModel],
+    data: Union[dict, List[dict]],
+    status_code: int = 200,
+    headers: Optional[Dict[str, str]] = None,
+) -> FastJSONResponse:
+    """``data`` shaped by ``model`` without validation, serialized in one pass."""
+    fields = _field_defaults(model)
+    if isinstance(data, list):
+        content = [_project(fields, item) for item in data]
+    else:
+        content = _project(fields, data)
+    return FastJSONResponse(content, status_code=status_code, headers=headers)
@@ -0,0 +1,29 @@
+from typing import Any, AsyncIterator, Type
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Rows per chunk written to the socket; small enough that the first bytes
+# leave long before a large cursor is exhausted
+NDJSON_ROWS_PER_CHUNK = 64
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def ndjson_response(items: AsyncIterator[Any], response_model: Type[BaseModel]) -> StreamingResponse:
+    """Stream ``items`` as newline-delimited JSON shaped by ``response_model``."""
+
+    async def chunks():
+        lines = []
+        async for item in items:
+            lines.append(response_model.model_validate(item, from_attributes=True).model_dump_json())
+            if len(lines) >= NDJSON_ROWS_PER_CHUNK:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+    return StreamingResponse(chunks(), media_type=NDJSON_MEDIA_TYPE)
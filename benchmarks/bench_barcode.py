@@ -0,0 +1,49 @@
+"""Barcode codec throughput: encoding, single-code checks and batch validation.
+
+Pure CPU, no database needed. A tenth of the codes carry one mistyped
+character, as a noisy bulk import file would::
+
+    python -m benchmarks.bench_barcode [codes]
+"""
+import random
+import sys
+import time
+
+from bson import ObjectId
+
+from app.utils.barcode import ALPHABET, barcode_company, encode_barcode, validate_barcodes
+
+
+def mistype(barcode: str) -> str:
+    position = random.randrange(len(barcode))
+    char = random.choice(ALPHABET.replace(barcode[position], ""))
+    return barcode[:position] + char + barcode[position + 1:]
+
+
+def rate(name: str, count: int, seconds: float) -> None:
+    print(f"{name:<28} {count / seconds:>12,.0f} codes/s  {seconds / count * 1e6:6.2f} us/code")
+
+
+def main(total: int) -> None:
+    company_ids = [str(ObjectId()) for _ in range(50)]
+
+    started = time.perf_counter()
+    barcodes = [encode_barcode(company_ids[i % len(company_ids)], i) for i in range(total)]
+    rate("encode", total, time.perf_counter() - started)
+
+    barcodes = [mistype(barcode) if i % 10 == 0 else barcode for i, barcode in enumerate(barcodes)]
+
+    started = time.perf_counter()
+    single = [barcode_company(barcode) for barcode in barcodes]
+    rate("barcode_company loop", total, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    batch = validate_barcodes(barcodes)
+    rate("validate_barcodes", total, time.perf_counter() - started)
+
+    assert single == batch
+    print(f"rejected {batch.count(None):,} of {total:,} (expected {len(range(0, total, 10)):,})")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
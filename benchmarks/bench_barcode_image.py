@@ -0,0 +1,48 @@
+"""Barcode image rendering: raw renders per second and LRU hit ratio.
+
+Pure CPU, no database needed. The cached run replays Zipf-distributed views
+(a few regulars open their coupon all the time) through render_barcode_image::
+
+    python -m benchmarks.bench_barcode_image [views] [coupons]
+"""
+import random
+import sys
+import time
+
+from bson import ObjectId
+
+from app.core.barcode_images import barcode_images, render_barcode_image
+from app.utils.barcode import encode_barcode
+from app.utils.code128 import render_png, render_svg
+
+
+def main(views: int, coupons: int) -> None:
+    company_id = str(ObjectId())
+    barcodes = [encode_barcode(company_id, sequence) for sequence in range(coupons)]
+
+    for name, render in (("svg", render_svg), ("png", render_png)):
+        count = min(views, 5000)
+        started = time.perf_counter()
+        for i in range(count):
+            body = render(barcodes[i % coupons], 2)
+        elapsed = time.perf_counter() - started
+        print(f"render {name:<4} {count / elapsed:>10,.0f} renders/s  {len(body):,} bytes")
+
+    weights = [1 / (rank + 1) for rank in range(coupons)]
+    traffic = random.choices(barcodes, weights=weights, k=views)
+    barcode_images.clear()
+    started = time.perf_counter()
+    for barcode in traffic:
+        render_barcode_image(barcode, "png", 2)
+    elapsed = time.perf_counter() - started
+    stats = barcode_images.stats()
+    print(
+        f"cached png  {views / elapsed:>10,.0f} views/s  hit_ratio={stats['hit_ratio']:.3f} "
+        f"(cache {stats['maxsize']:,} of {coupons:,} coupons)"
+    )
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    views, coupons = (args + [100000, 20000][len(args):])[:2]
+    main(views, coupons)
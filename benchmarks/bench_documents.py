@@ -0,0 +1,87 @@
+"""Converting raw coupon documents into CouponInDB, per row and per batch.
+
+Pure CPU, no database needed. Each run gets fresh documents shaped like
+what the driver returns (ObjectId ``_id``, datetimes, the idempotency
+``ops`` array on some) and keeps the best of a few rounds::
+
+    python -m benchmarks.bench_documents [documents] [rounds]
+"""
+import gc
+import sys
+import time
+from datetime import datetime, timezone
+
+from bson import ObjectId
+
+from app.models.coupon import CouponInDB
+from app.schemas.documents import to_models
+
+
+def raw_documents(count: int):
+    now = datetime.now(timezone.utc)
+    company_id, client_id = str(ObjectId()), str(ObjectId())
+    return [
+        {"_id": ObjectId(), "company_id": company_id, "barcode": f"CAFE-{i}", "client_id": client_id,
+         "count": i % 25, "created_at": now, "updated_at": now,
+         **({"ops": [{"key": f"key-{i}", "count": i % 25, "at": now}]} if i % 10 == 0 else {})}
+        for i in range(count)
+    ]
+
+
+def per_row(docs):
+    coupons = []
+    for doc in docs:
+        doc["_id"] = str(doc["_id"])
+        coupons.append(CouponInDB(**doc))
+    return coupons
+
+
+def model_construct(docs):
+    coupons = []
+    for doc in docs:
+        doc["_id"] = str(doc["_id"])
+        coupons.append(CouponInDB.model_construct(**doc))
+    return coupons
+
+
+def unvalidated(docs):
+    # The best a trusted, validation-free path could do: fill __dict__ directly
+    fields = [(field.alias or name, name) for name, field in CouponInDB.model_fields.items()]
+    coupons = []
+    for doc in docs:
+        doc["_id"] = str(doc["_id"])
+        coupon = CouponInDB.__new__(CouponInDB)
+        object.__setattr__(coupon, "__dict__", {name: doc[key] for key, name in fields})
+        object.__setattr__(coupon, "__pydantic_fields_set__", set(CouponInDB.model_fields))
+        object.__setattr__(coupon, "__pydantic_extra__", None)
+        object.__setattr__(coupon, "__pydantic_private__", None)
+        coupons.append(coupon)
+    return coupons
+
+
+CONVERTERS = {
+    "CouponInDB(**doc) per row": per_row,
+    "model_construct per row": model_construct,
+    "unvalidated, by hand": unvalidated,
+    "to_models": lambda docs: to_models(CouponInDB, docs),
+}
+
+
+def main(count: int, rounds: int) -> None:
+    baseline = None
+    for name, convert in CONVERTERS.items():
+        best = float("inf")
+        for _ in range(rounds):
+            docs = raw_documents(count)
+            gc.collect()
+            started = time.perf_counter()
+            convert(docs)
+            best = min(best, time.perf_counter() - started)
+        baseline = baseline or best
+        print(f"{name:<28} {best * 1000:>8.0f} ms  {count / best:>10,.0f} docs/s  x{baseline / best:.2f}")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    count, rounds = (args + [100000, 5][len(args):])[:2]
+    main(count, rounds)
@@ -0,0 +1,59 @@
+"""Overhead of the metrics middleware, and the cost of a scrape.
+
+Pure CPU, no database needed: times ``GET /health`` through the ASGI app with
+and without MetricsMiddleware, then renders /metrics after ``routes`` route
+templates have been observed::
+
+    python -m benchmarks.bench_metrics [requests] [routes]
+"""
+import asyncio
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from app.core.metrics import MetricsMiddleware, MetricsRegistry, RequestMetrics
+from app.main import health_check
+
+
+def build_app(with_metrics: bool) -> FastAPI:
+    app = FastAPI()
+    app.get("/health")(health_check)
+    if with_metrics:
+        app.add_middleware(MetricsMiddleware, metrics=RequestMetrics())
+    return app
+
+
+async def requests_per_second(app: FastAPI, total: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(200):
+            await client.get("/health")
+        started = time.perf_counter()
+        for _ in range(total):
+            await client.get("/health")
+        return total / (time.perf_counter() - started)
+
+
+async def main(total: int, routes: int) -> None:
+    before = await requests_per_second(build_app(False), total)
+    after = await requests_per_second(build_app(True), total)
+    overhead = (1 / after - 1 / before) * 1e6
+    print(f"GET /health  {before:>8,.0f} -> {after:>8,.0f} req/s  (~{overhead:.0f} us per request)")
+
+    requests = RequestMetrics()
+    for i in range(routes):
+        for status in (200, 404):
+            requests.observe("GET", f"/api/route-{i}/{{id}}", status, 0.01 * (i % 7))
+    registry = MetricsRegistry(requests)
+    started = time.perf_counter()
+    text = registry.exposition()
+    elapsed = time.perf_counter() - started
+    print(f"scrape with {routes} routes  {elapsed * 1000:.1f} ms  {len(text):,} bytes")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    total, routes = (args + [5000, 50][len(args):])[:2]
+    asyncio.run(main(total, routes))
@@ -0,0 +1,127 @@
+"""CPU time and peak memory of large list responses, decoded versus raw BSON.
+
+Like bench_responses this swaps MongoDB for an in-memory stand-in, here one
+that keeps documents as BSON: ``find`` decodes its batches the way the
+driver would, ``find_raw_batches`` hands them over untouched (already
+projected, as the server would). Each path is timed over ``requests``
+requests, then run once more under tracemalloc for its peak::
+
+    python -m benchmarks.bench_raw_bson [rows] [requests]
+"""
+import asyncio
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import bson
+import httpx
+from bson import ObjectId
+
+from app.config import settings
+from app.core.auth import get_current_admin
+from app.db import get_db
+from app.main import app
+from app.models.company import Company
+from app.models.coupon import Coupon
+from app.models.coupon_rule import CouponRule
+from app.models.user import User
+from app.utils import responses
+
+ADMIN = User(id=str(ObjectId()), email="bench@example.com", name="Bench", role="admin")
+# Documents per batch after the first, roughly what 16 MB replies hold for these sizes
+BATCH_SIZE = 10000
+
+
+def batches(documents, first=101):
+    """Documents split like a server reply: 101 first, then up to BATCH_SIZE."""
+    yield documents[:first]
+    for start in range(first, len(documents), BATCH_SIZE):
+        yield documents[start:start + BATCH_SIZE]
+
+
+class MemoryCursor:
+    def __init__(self, raw_batches):
+        self.raw_batches = raw_batches
+
+    async def to_list(self, length=None):
+        return [doc for batch in self.raw_batches for doc in bson.decode_all(batch)]
+
+    async def __aiter__(self):
+        for batch in self.raw_batches:
+            yield batch
+
+
+class MemoryCollection:
+    def __init__(self, docs, model):
+        self.full = [b"".join(map(bson.encode, batch)) for batch in batches(docs)]
+        projected = [{**{k: v for k, v in doc.items() if k in model.model_fields}, "id": str(doc["_id"])} for doc in docs]
+        self.projected = [b"".join(map(bson.encode, batch)) for batch in batches(projected)]
+
+    def find(self, *args, **kwargs):
+        return MemoryCursor(self.full)
+
+    def find_raw_batches(self, *args, **kwargs):
+        return MemoryCursor(self.projected)
+
+    async def find_one(self, *args, **kwargs):
+        return {"_id": ObjectId()}
+
+
+class MemoryDatabase:
+    def __init__(self, rows: int):
+        now = datetime.now(timezone.utc)
+        company_id = str(ObjectId())
+        self.companies = MemoryCollection([], Company)
+        self.coupons = MemoryCollection([
+            {"_id": ObjectId(), "company_id": company_id, "barcode": f"CAFE-{i}", "client_id": str(ObjectId()),
+             "count": i % 25, "created_at": now, "updated_at": now,
+             "ops": [{"key": f"key-{i}", "count": i % 25, "at": now}]}
+            for i in range(rows)
+        ], Coupon)
+        self.coupon_rules = MemoryCollection([
+            {"_id": ObjectId(), "company_id": company_id, "required_coupons": i + 1, "reward": f"Reward {i}",
+             "admin_id": ADMIN.id}
+            for i in range(rows)
+        ], CouponRule)
+        self.company_id = company_id
+
+
+async def measure(client: httpx.AsyncClient, url: str, total: int):
+    (await client.get(url)).raise_for_status()
+    started = time.process_time()
+    for _ in range(total):
+        (await client.get(url)).raise_for_status()
+    cpu = (time.process_time() - started) / total
+    tracemalloc.start()
+    (await client.get(url)).raise_for_status()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return cpu, peak
+
+
+async def main(rows: int, total: int) -> None:
+    memory_db = MemoryDatabase(rows)
+    app.dependency_overrides[get_db] = lambda: memory_db
+    app.dependency_overrides[get_current_admin] = lambda: ADMIN
+    urls = {
+        "coupons": f"/api/companies/{memory_db.company_id}/coupons",
+        "coupon rules": f"/api/coupon-rules/company/{memory_db.company_id}",
+    }
+    modes = [("decoded", False), ("raw", True)]
+    print(f"encoder: {'orjson' if responses.orjson else 'pydantic-core'}")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, url in urls.items():
+            for mode, raw in modes:
+                settings.RAW_BSON_LISTS = raw
+                cpu, peak = await measure(client, url, total)
+                print(f"{name + ' ' + mode:<20} {cpu * 1000:>8.1f} ms CPU  {peak / 2**20:>7.1f} MiB peak  ({rows:,} rows)")
+    settings.RAW_BSON_LISTS = False
+    app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    rows, total = (args + [10000, 20][len(args):])[:2]
+    asyncio.run(main(rows, total))
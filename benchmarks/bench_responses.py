@@ -0,0 +1,105 @@
+"""Requests per second of the read endpoints with and without FAST_RESPONSES.
+
+Serialization is CPU work, so this benchmark swaps MongoDB for an in-memory
+stand-in and overrides authentication: what is left is routing, response
+validation and JSON encoding. Runs with orjson when it is installed::
+
+    python -m benchmarks.bench_responses [requests] [page_size]
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+from bson import ObjectId
+
+from app.config import settings
+from app.core.auth import get_current_admin
+from app.db import get_db
+from app.main import app
+from app.models.user import User
+from app.utils import responses
+
+ADMIN = User(id=str(ObjectId()), email="bench@example.com", name="Bench", role="admin")
+
+
+class MemoryCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, *args):
+        return self
+
+    def skip(self, count):
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return list(self.docs)
+
+
+class MemoryCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, *args, **kwargs):
+        return MemoryCursor(self.docs)
+
+    async def find_one(self, *args, **kwargs):
+        return self.docs[0]
+
+
+class MemoryDatabase:
+    def __init__(self, page_size: int):
+        now = datetime.now(timezone.utc)
+        self.companies = MemoryCollection([
+            {"_id": ObjectId(), "name": f"Cafe {i}", "description": "Espresso and cake",
+             "admin_id": ADMIN.id, "created_at": now}
+            for i in range(page_size)
+        ])
+        self.coupon_rules = MemoryCollection([
+            {"_id": ObjectId(), "company_id": str(self.companies.docs[0]["_id"]), "required_coupons": i + 1,
+             "reward": f"Reward {i}", "admin_id": ADMIN.id}
+            for i in range(page_size)
+        ])
+
+
+async def requests_per_second(client: httpx.AsyncClient, url: str, total: int) -> float:
+    started = time.perf_counter()
+    for _ in range(total):
+        (await client.get(url)).raise_for_status()
+    return total / (time.perf_counter() - started)
+
+
+async def main(total: int, page_size: int) -> None:
+    memory_db = MemoryDatabase(page_size)
+    app.dependency_overrides[get_db] = lambda: memory_db
+    app.dependency_overrides[get_current_admin] = lambda: ADMIN
+    company_id = memory_db.companies.docs[0]["_id"]
+    urls = {
+        f"GET /api/companies/ (limit={min(page_size, 100)})": f"/api/companies/?limit={min(page_size, 100)}",
+        f"GET /api/coupon-rules/company/{{id}} ({page_size} rules)": f"/api/coupon-rules/company/{company_id}",
+        "GET /api/companies/{id}": f"/api/companies/{company_id}",
+    }
+    print(f"encoder: {'orjson' if responses.orjson else 'pydantic-core'}")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, url in urls.items():
+            settings.FAST_RESPONSES = False
+            await requests_per_second(client, url, 50)
+            before = await requests_per_second(client, url, total)
+            settings.FAST_RESPONSES = True
+            await requests_per_second(client, url, 50)
+            after = await requests_per_second(client, url, total)
+            print(f"{name:<48} {before:>8,.0f} -> {after:>8,.0f} req/s  x{after / before:.2f}")
+    app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    total, page_size = (args + [2000, 500][len(args):])[:2]
+    asyncio.run(main(total, page_size))
@@ -0,0 +1,48 @@
+"""Stamps per second: ``POST /api/coupons/stamps:batch`` against a loop of single stamps.
+
+Both runs stamp the same mix of clients, with repeats, so the batch also gets to
+collapse duplicates::
+
+    python -m benchmarks.bench_stamp_batch [stamps] [batch_size] [clients]
+"""
+import asyncio
+import sys
+import time
+
+from bson import ObjectId
+
+from benchmarks.common import bench_client, commands
+
+
+async def main(total: int, batch_size: int, clients: int) -> None:
+    async with bench_client() as client:
+        response = await client.post("/api/companies/", json={"name": "Batch Cafe"})
+        company_id = response.json()["id"]
+        barcode = f"CAFE-{company_id}"
+        client_ids = [str(ObjectId()) for _ in range(clients)]
+        items = [{"barcode": barcode, "client_id": client_ids[i % clients]} for i in range(total)]
+        # Warm the company cache so neither run pays for it
+        await client.post("/api/coupons/stamp", json={**items[0], "company_id": company_id})
+
+        before, started = commands.count, time.perf_counter()
+        for item in items:
+            (await client.post("/api/coupons/stamp", json={**item, "company_id": company_id})).raise_for_status()
+        single_secs, single_trips = time.perf_counter() - started, commands.count - before
+
+        before, started = commands.count, time.perf_counter()
+        for offset in range(0, total, batch_size):
+            (await client.post(
+                "/api/coupons/stamps:batch",
+                json={"company_id": company_id, "stamps": items[offset:offset + batch_size]},
+            )).raise_for_status()
+        batch_secs, batch_trips = time.perf_counter() - started, commands.count - before
+
+    print(f"{'single stamp loop':<28} {total / single_secs:>10,.0f} stamps/s  round_trips={single_trips}")
+    print(f"{f'batch of {batch_size}':<28} {total / batch_secs:>10,.0f} stamps/s  round_trips={batch_trips}")
+    print(f"speedup x{single_secs / batch_secs:.1f}")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    total, batch_size, clients = (args + [10000, 1000, 2000][len(args):])[:3]
+    asyncio.run(main(total, batch_size, clients))
@@ -0,0 +1,70 @@
+"""Wallet latency and round trips: ``GET /api/me/wallet`` against the N+1 schema helpers.
+
+Gives one client a coupon at each of ``cafes`` companies with a few rules each,
+then times the naive get_coupons_by_client + per-company lookups and the
+endpoint with its cache disabled, and warm::
+
+    python -m benchmarks.bench_wallet [cafes] [iterations]
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime, timezone
+
+from app.core.wallets import wallets
+from app.db import db
+from app.schemas.company import get_company_by_id
+from app.schemas.coupon import get_coupons_by_client
+from app.schemas.coupon_rule import get_coupon_rules_by_company
+from benchmarks.common import bench_client, commands, report, timed
+
+
+async def n_plus_one(client_id: str) -> None:
+    for coupon in await get_coupons_by_client(db.database, client_id):
+        await get_company_by_id(db.database, coupon.company_id)
+        await get_coupon_rules_by_company(db.database, coupon.company_id)
+
+
+async def main(cafes: int, iterations: int) -> None:
+    async with bench_client(role="client") as client:
+        client_id = str(client.user.id)
+        now = datetime.now(timezone.utc)
+        companies = await db.database.companies.insert_many(
+            [{"name": f"Cafe {i}", "admin_id": "bench"} for i in range(cafes)]
+        )
+        company_ids = [str(company_id) for company_id in companies.inserted_ids]
+        await db.database.coupon_rules.insert_many([
+            {"company_id": company_id, "required_coupons": required, "reward": f"Reward {required}"}
+            for company_id in company_ids for required in (5, 10, 20)
+        ])
+        await db.database.coupons.insert_many([
+            {"company_id": company_id, "barcode": f"CAFE-{i}", "client_id": client_id, "count": i % 25,
+             "created_at": now, "updated_at": now}
+            for i, company_id in enumerate(company_ids)
+        ])
+
+        samples, trips = [], 0
+        for _ in range(iterations):
+            before, started = commands.count, time.perf_counter()
+            await n_plus_one(client_id)
+            samples.append(time.perf_counter() - started)
+            trips += commands.count - before
+        report(f"N+1 helpers ({cafes} cafes)", samples, round_trips=trips / iterations)
+
+        for label, maxsize in (("cold", 0), ("cached", wallets.maxsize)):
+            wallets.clear()
+            wallets.maxsize = maxsize
+            samples, trips = [], 0
+            for _ in range(iterations):
+                response, elapsed, round_trips = await timed(client, "GET", "/api/me/wallet")
+                response.raise_for_status()
+                samples.append(elapsed)
+                trips += round_trips
+            # Includes the principal lookup unless it is cached
+            report(f"GET /api/me/wallet {label}", samples, round_trips=trips / iterations)
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    cafes, iterations = (args + [30, 200][len(args):])[:2]
+    asyncio.run(main(cafes, iterations))
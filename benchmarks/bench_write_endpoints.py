@@ -0,0 +1,58 @@
+"""Latency and round trips per write endpoint of the company and coupon-rule routers.
+
+Run against a local MongoDB, once on this tree and once on a checkout from before
+the single-round-trip rewrite, and compare the ``round_trips`` and p50 columns::
+
+    python -m benchmarks.bench_write_endpoints [iterations]
+"""
+import asyncio
+import sys
+from collections import defaultdict
+
+from benchmarks.common import bench_client, report, timed
+
+
+async def main(iterations: int) -> None:
+    samples = defaultdict(list)
+    trips = defaultdict(list)
+
+    def record(name, elapsed, round_trips):
+        samples[name].append(elapsed)
+        trips[name].append(round_trips)
+
+    async with bench_client() as client:
+        for i in range(iterations):
+            response, elapsed, rt = await timed(client, "POST", "/api/companies/", json={"name": f"Cafe {i}"})
+            record("POST /api/companies/", elapsed, rt)
+            company_id = response.json()["id"]
+
+            _, elapsed, rt = await timed(
+                client, "PUT", f"/api/companies/{company_id}", json={"description": "renamed"}
+            )
+            record("PUT /api/companies/{id}", elapsed, rt)
+
+            response, elapsed, rt = await timed(
+                client, "POST", "/api/coupon-rules/",
+                json={"company_id": company_id, "required_coupons": 10, "reward": "Free coffee"},
+            )
+            record("POST /api/coupon-rules/", elapsed, rt)
+            rule_id = response.json()["id"]
+
+            _, elapsed, rt = await timed(
+                client, "PUT", f"/api/coupon-rules/{rule_id}", json={"required_coupons": 8}
+            )
+            record("PUT /api/coupon-rules/{id}", elapsed, rt)
+
+            _, elapsed, rt = await timed(client, "DELETE", f"/api/coupon-rules/{rule_id}")
+            record("DELETE /api/coupon-rules/{id}", elapsed, rt)
+
+            _, elapsed, rt = await timed(client, "DELETE", f"/api/companies/{company_id}")
+            record("DELETE /api/companies/{id}", elapsed, rt)
+
+    for name, values in samples.items():
+        # Every request also pays for one principal lookup unless it is cached
+        report(name, values, round_trips=sum(trips[name]) / len(trips[name]))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,108 @@
+"""Shared helpers for the benchmark scripts.
+
+The scripts drive the ASGI app in-process against a real MongoDB (``MONGODB_URL``)
+using a throwaway database, so numbers include driver and server time but no
+network hop to uvicorn. Run them from the repository root, e.g.::
+
+    python -m benchmarks.bench_write_endpoints
+"""
+import os
+
+os.environ.setdefault("DATABASE_NAME", "coupon_api_bench")
+
+import statistics
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+import httpx
+from bson import ObjectId
+from pymongo import monitoring
+
+from app.config import settings
+from app.core.auth import create_user_access_token, get_password_hash
+from app.db import db
+from app.indexes import ensure_indexes
+from app.main import app
+from app.models.user import UserInDB
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts commands sent to the server, i.e. database round trips."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def started(self, event):
+        with self._lock:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+commands = CommandCounter()
+monitoring.register(commands)
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(name: str, samples: List[float], round_trips: float = None) -> Dict[str, float]:
+    """Print and return latency stats for one benchmark; samples are seconds."""
+    row = {
+        "n": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+    extra = f"  round_trips={round_trips:.2f}" if round_trips is not None else ""
+    print(
+        f"{name:<40} n={row['n']:<6} mean={row['mean_ms']:7.2f}ms "
+        f"p50={row['p50_ms']:7.2f}ms p99={row['p99_ms']:7.2f}ms{extra}"
+    )
+    return row
+
+
+async def timed(client: httpx.AsyncClient, method: str, url: str, **kwargs):
+    """Issue one request, returning (response, seconds, round trips)."""
+    before = commands.count
+    started = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    elapsed = time.perf_counter() - started
+    return response, elapsed, commands.count - before
+
+
+@asynccontextmanager
+async def bench_client(role: str = "admin"):
+    """Connect the app to a fresh benchmark database and yield an authorized client."""
+    await db.connect_to_mongodb()
+    await db.client.drop_database(settings.DATABASE_NAME)
+    await ensure_indexes(db.database)
+    user_id = ObjectId()
+    user = UserInDB(
+        _id=str(user_id),
+        email=f"bench-{user_id}@example.com",
+        name="Bench User",
+        role=role,
+        hashed_password=get_password_hash("bench-password"),
+    )
+    await db.database.users.insert_one(
+        {"_id": user_id, **user.model_dump(mode="json", exclude={"id"})}
+    )
+    headers = {"Authorization": f"Bearer {create_user_access_token(user)}"}
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client:
+            client.user = user
+            yield client
+    finally:
+        await db.client.drop_database(settings.DATABASE_NAME)
+        await db.close_mongodb_connection()
@@ -0,0 +1,63 @@
+"""Peak-hour load test for ``POST /api/coupons/stamp``.
+
+Keeps ``concurrency`` counters busy stamping a pool of client coupons and reports
+latency percentiles, throughput and round trips per stamp against the p99 target::
+
+    python -m benchmarks.load_stamp [requests] [concurrency] [clients]
+"""
+import asyncio
+import sys
+import time
+
+from bson import ObjectId
+
+from benchmarks.common import bench_client, commands, report
+
+P99_TARGET_MS = 5.0
+
+
+async def main(total: int, concurrency: int, clients: int) -> None:
+    async with bench_client() as client:
+        response = await client.post("/api/companies/", json={"name": "Load Test Cafe"})
+        company_id = response.json()["id"]
+        for required, reward in ((10, "Free coffee"), (25, "Free cake")):
+            await client.post(
+                "/api/coupon-rules/",
+                json={"company_id": company_id, "required_coupons": required, "reward": reward},
+            )
+        client_ids = [str(ObjectId()) for _ in range(clients)]
+
+        def body(i):
+            return {"company_id": company_id, "barcode": f"CAFE-{company_id}", "client_id": client_ids[i % clients]}
+
+        # Warm the company caches and the connection pool before measuring
+        for i in range(min(clients, 100)):
+            await client.post("/api/coupons/stamp", json=body(i))
+
+        samples = []
+        queue = iter(range(total))
+
+        async def counter():
+            for i in queue:
+                sent = time.perf_counter()
+                response = await client.post("/api/coupons/stamp", json=body(i))
+                samples.append(time.perf_counter() - sent)
+                response.raise_for_status()
+
+        # Commands are counted process wide, so round trips are averaged over the run
+        before = commands.count
+        started = time.perf_counter()
+        await asyncio.gather(*[counter() for _ in range(concurrency)])
+        wall = time.perf_counter() - started
+        round_trips = (commands.count - before) / total
+
+    row = report("POST /api/coupons/stamp", samples, round_trips=round_trips)
+    print(f"throughput={total / wall:,.0f} req/s  concurrency={concurrency}  clients={clients}")
+    verdict = "PASS" if row["p99_ms"] < P99_TARGET_MS else "FAIL"
+    print(f"p99 target {P99_TARGET_MS:.1f}ms: {verdict}")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    total, concurrency, clients = (args + [20000, 32, 1000][len(args):])[:3]
+    asyncio.run(main(total, concurrency, clients))
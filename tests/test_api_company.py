@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, Mock, patch
 from fastapi.testclient import TestClient
 from fastapi import Depends
 from app.main import app
@@ -7,10 +7,38 @@ from app.models.user import User
 from app.core.auth import create_access_token
 from app.api.company import router
 from datetime import datetime, timedelta
+import bson
 from bson import ObjectId
 
 client = TestClient(app)
 
+
+class RawCursor:
+    """Stand-in for a find_raw_batches cursor over already projected documents."""
+
+    def __init__(self, batches):
+        self._batches = iter(batches)
+        self.limited = None
+
+    def sort(self, *args):
+        return self
+
+    def skip(self, count):
+        return self
+
+    def limit(self, count):
+        self.limited = count
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._batches)
+        except StopIteration:
+            raise StopAsyncIteration
+
 @pytest.fixture
 def admin_user():
     """Create a sample admin user for testing."""
@@ -96,6 +124,8 @@ class TestCompanyAPI:
             assert data["name"] == "Test Cafe"
             assert data["description"] == "A test cafe"
             assert data["admin_id"] == admin_user.id
+            assert data["id"] == "507f1f77bcf86cd799439013"
+            mock_db.companies.find_one.assert_not_called()
         finally:
             # Clear overrides
             app.dependency_overrides.clear()
@@ -128,52 +158,144 @@ class TestCompanyAPI:
 
         assert response.status_code == 401
 
-    @pytest.mark.asyncio
-    async def test_list_companies_success(self, admin_user, admin_token, sample_company):
-        """Test successful company listing."""
+    def _list_db(self, companies):
         mock_db = AsyncMock()
-        mock_cursor = AsyncMock()
+        mock_cursor = Mock()
+        mock_cursor.sort.return_value = mock_cursor
         mock_cursor.skip.return_value = mock_cursor
         mock_cursor.limit.return_value = mock_cursor
-        mock_cursor.to_list.return_value = [sample_company]
-        mock_db.companies.find.return_value = mock_cursor
+        mock_cursor.to_list = AsyncMock(return_value=companies)
+        mock_db.companies.find = Mock(return_value=mock_cursor)
+        return mock_db, mock_cursor
 
-        with patch("app.api.company.get_db", return_value=mock_db), \
-             patch("app.api.company.get_current_admin", return_value=admin_user):
-            
-            response = client.get(
-                "/api/companies/",
-                headers={"Authorization": f"Bearer {admin_token}"}
-            )
+    @pytest.mark.asyncio
+    async def test_list_companies_success(self, admin_user, admin_token, sample_company):
+        """Test successful company listing."""
+        from app.api.company import get_db, get_current_admin
+        mock_db, _ = self._list_db([sample_company])
+
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin_user
+        try:
+            response = client.get("/api/companies/")
+        finally:
+            app.dependency_overrides.clear()
 
         assert response.status_code == 200
         data = response.json()
         assert len(data) == 1
         assert data[0]["name"] == "Test Cafe"
         assert data[0]["admin_id"] == admin_user.id
+        # A short page means there is nothing further to fetch
+        assert "X-Next-Cursor" not in response.headers
 
     @pytest.mark.asyncio
     async def test_list_companies_pagination(self, admin_user, admin_token):
         """Test company listing with pagination."""
-        mock_db = AsyncMock()
-        mock_cursor = AsyncMock()
-        mock_cursor.skip.return_value = mock_cursor
-        mock_cursor.limit.return_value = mock_cursor
-        mock_cursor.to_list.return_value = []
-        mock_db.companies.find.return_value = mock_cursor
+        from app.api.company import get_db, get_current_admin
+        mock_db, mock_cursor = self._list_db([])
 
-        with patch("app.api.company.get_db", return_value=mock_db), \
-             patch("app.api.company.get_current_admin", return_value=admin_user):
-            
-            response = client.get(
-                "/api/companies/?skip=10&limit=5",
-                headers={"Authorization": f"Bearer {admin_token}"}
-            )
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin_user
+        try:
+            response = client.get("/api/companies/?skip=10&limit=5")
+        finally:
+            app.dependency_overrides.clear()
 
         assert response.status_code == 200
         mock_cursor.skip.assert_called_with(10)
         mock_cursor.limit.assert_called_with(5)
 
+    @pytest.mark.asyncio
+    async def test_list_companies_cursor(self, admin_user, admin_token, sample_company):
+        """Test keyset pagination seeks past the cursor instead of skipping."""
+        from app.api.company import get_db, get_current_admin
+        from app.utils.pagination import encode_cursor
+        mock_db, mock_cursor = self._list_db([sample_company])
+        after = ObjectId("507f1f77bcf86cd799439000")
+
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin_user
+        try:
+            response = client.get(f"/api/companies/?limit=1&cursor={encode_cursor(after)}")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        mock_db.companies.find.assert_called_with({"admin_id": admin_user.id, "_id": {"$gt": after}})
+        mock_cursor.sort.assert_called_with("_id", 1)
+        mock_cursor.skip.assert_called_with(0)
+        assert response.headers["X-Next-Cursor"] == encode_cursor(sample_company["_id"])
+
+    @pytest.mark.asyncio
+    async def test_list_companies_fast_responses(self, admin_user, admin_token, sample_company, monkeypatch):
+        """Test that fast mode returns the same body and keeps the cursor header."""
+        from app.api.company import get_db, get_current_admin
+        from app.config import settings
+        from app.utils.pagination import encode_cursor
+        mock_db, _ = self._list_db([sample_company])
+
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin_user
+        try:
+            slow = client.get("/api/companies/?limit=1")
+            monkeypatch.setattr(settings, "FAST_RESPONSES", True)
+            fast = client.get("/api/companies/?limit=1")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert fast.status_code == 200
+        assert fast.json() == slow.json()
+        assert set(fast.json()[0]) == {"id", "name", "description", "admin_id"}
+        assert fast.headers["X-Next-Cursor"] == encode_cursor(sample_company["_id"])
+
+    @pytest.mark.asyncio
+    async def test_list_companies_raw_bson(self, admin_user, admin_token, sample_company, monkeypatch):
+        """Test that raw mode returns the same body and cursor from the projected batch."""
+        from app.api.company import get_db, get_current_admin
+        from app.config import settings
+        from app.utils.pagination import encode_cursor
+        mock_db, _ = self._list_db([sample_company])
+        projected = {
+            "name": sample_company["name"], "description": sample_company["description"],
+            "id": str(sample_company["_id"]), "admin_id": sample_company["admin_id"],
+        }
+        raw_cursor = RawCursor([bson.encode(projected)])
+        mock_db.companies.find_raw_batches = Mock(return_value=raw_cursor)
+
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin_user
+        try:
+            slow = client.get("/api/companies/?limit=1")
+            monkeypatch.setattr(settings, "RAW_BSON_LISTS", True)
+            raw = client.get("/api/companies/?limit=1")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert raw.status_code == 200
+        assert raw.json() == slow.json()
+        assert raw.headers["X-Next-Cursor"] == encode_cursor(sample_company["_id"])
+        query = mock_db.companies.find_raw_batches.call_args.args[0]
+        assert query == {"admin_id": admin_user.id}
+        assert mock_db.companies.find_raw_batches.call_args.kwargs["projection"]["id"] == {"$toString": "$_id"}
+        assert raw_cursor.limited == 1
+
+    @pytest.mark.asyncio
+    async def test_list_companies_invalid_cursor(self, admin_user, admin_token):
+        """Test that a malformed cursor is rejected."""
+        from app.api.company import get_db, get_current_admin
+        mock_db, _ = self._list_db([])
+
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin_user
+        try:
+            response = client.get("/api/companies/?cursor=not-a-cursor")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid cursor"
+
     @pytest.mark.asyncio
     async def test_get_company_success(self, admin_user, admin_token, sample_company):
         """Test successful company retrieval."""
@@ -213,78 +335,206 @@ class TestCompanyAPI:
     @pytest.mark.asyncio
     async def test_update_company_success(self, admin_user, admin_token, sample_company):
         """Test successful company update."""
+        from app.api.company import get_db, get_current_admin
+        
         mock_db = AsyncMock()
-        mock_db.companies.find_one.return_value = sample_company
         updated_company = sample_company.copy()
         updated_company["name"] = "Updated Cafe"
-        mock_db.companies.find_one.side_effect = [sample_company, updated_company]
+        mock_db.companies.find_one_and_update.return_value = updated_company
 
-        with patch("app.api.company.get_db", return_value=mock_db), \
-             patch("app.api.company.get_current_admin", return_value=admin_user):
-            
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin_user
+        
+        try:
             response = client.put(
                 f"/api/companies/{sample_company['_id']}",
                 json={
                     "name": "Updated Cafe",
                     "description": "Updated description"
-                },
-                headers={"Authorization": f"Bearer {admin_token}"}
+                }
             )
+        finally:
+            app.dependency_overrides.clear()
 
         assert response.status_code == 200
         data = response.json()
         assert data["name"] == "Updated Cafe"
+        # Ownership is enforced by the update filter itself
+        filter_, update = mock_db.companies.find_one_and_update.call_args.args
+        assert filter_ == {"_id": sample_company["_id"], "admin_id": admin_user.id}
+        assert update == {"$set": {"name": "Updated Cafe", "description": "Updated description"}}
+        mock_db.companies.find_one.assert_not_called()
 
     @pytest.mark.asyncio
     async def test_update_company_not_found(self, admin_user, admin_token):
         """Test company update with non-existent ID."""
+        from app.api.company import get_db, get_current_admin
+        
         mock_db = AsyncMock()
-        mock_db.companies.find_one.return_value = None
+        mock_db.companies.find_one_and_update.return_value = None
 
-        with patch("app.api.company.get_db", return_value=mock_db), \
-             patch("app.api.company.get_current_admin", return_value=admin_user):
-            
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin_user
+        
+        try:
             response = client.put(
                 "/api/companies/507f1f77bcf86cd799439999",
                 json={
                     "name": "Updated Cafe"
-                },
-                headers={"Authorization": f"Bearer {admin_token}"}
+                }
             )
+        finally:
+            app.dependency_overrides.clear()
 
         assert response.status_code == 404
         assert "Company not found" in response.json()["detail"]
 
+    @pytest.mark.asyncio
+    async def test_issue_barcodes(self, admin_user, admin_token, sample_company):
+        """Test that a block of sequence numbers is reserved and encoded."""
+        from app.api.company import get_db, get_current_admin
+        from app.utils.barcode import decode_barcode
+        
+        mock_db = AsyncMock()
+        mock_db.companies.find_one_and_update.return_value = {"_id": sample_company["_id"], "barcode_seq": 12}
+
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin_user
+        
+        try:
+            response = client.post(f"/api/companies/{sample_company['_id']}/barcodes?count=3")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 201
+        assert [decode_barcode(barcode) for barcode in response.json()] == [
+            (str(sample_company["_id"]), sequence) for sequence in (10, 11, 12)
+        ]
+        filter_, update = mock_db.companies.find_one_and_update.call_args.args
+        assert filter_["admin_id"] == admin_user.id
+        assert update == {"$inc": {"barcode_seq": 3}}
+
+    @pytest.mark.asyncio
+    async def test_issue_barcodes_not_found(self, admin_user, admin_token):
+        """Test issuing barcodes for a company the admin does not own."""
+        from app.api.company import get_db, get_current_admin
+        
+        mock_db = AsyncMock()
+        mock_db.companies.find_one_and_update.return_value = None
+
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin_user
+        
+        try:
+            response = client.post("/api/companies/507f1f77bcf86cd799439999/barcodes")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 404
+
+    def _coupons_db(self, sample_company, coupons):
+        mock_db = AsyncMock()
+        mock_db.companies.find_one.return_value = {"_id": sample_company["_id"]}
+        mock_cursor = Mock()
+        mock_cursor.to_list = AsyncMock(return_value=coupons)
+        mock_db.coupons.find = Mock(return_value=mock_cursor)
+        return mock_db
+
+    def _coupon(self, sample_company, i):
+        now = datetime.utcnow()
+        return {
+            "_id": ObjectId(), "company_id": str(sample_company["_id"]), "barcode": f"B{i}",
+            "client_id": "507f1f77bcf86cd799439012", "count": i, "created_at": now, "updated_at": now,
+            "ops": [{"key": "k", "count": i, "at": now}],
+        }
+
+    @pytest.mark.asyncio
+    async def test_list_company_coupons(self, admin_user, admin_token, sample_company, monkeypatch):
+        """Test listing a company's coupons, decoded and as raw BSON."""
+        from app.api.company import get_db, get_current_admin
+        from app.config import settings
+        coupons = [self._coupon(sample_company, i) for i in range(3)]
+        expected = [
+            {"company_id": c["company_id"], "barcode": c["barcode"], "id": str(c["_id"]),
+             "client_id": c["client_id"], "count": c["count"]}
+            for c in coupons
+        ]
+        mock_db = self._coupons_db(sample_company, [dict(c) for c in coupons])
+        mock_db.coupons.find_raw_batches = Mock(
+            # Two raw batches, the first holding two documents
+            return_value=RawCursor([bson.encode(expected[0]) + bson.encode(expected[1]), bson.encode(expected[2])])
+        )
+
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin_user
+        try:
+            decoded = client.get(f"/api/companies/{sample_company['_id']}/coupons")
+            monkeypatch.setattr(settings, "RAW_BSON_LISTS", True)
+            raw = client.get(f"/api/companies/{sample_company['_id']}/coupons")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert decoded.status_code == 200
+        assert decoded.json() == expected
+        assert raw.status_code == 200
+        assert raw.json() == expected
+        assert mock_db.coupons.find_raw_batches.call_args.args[0] == {"company_id": str(sample_company["_id"])}
+        assert "ops" not in mock_db.coupons.find_raw_batches.call_args.kwargs["projection"]
+
+    @pytest.mark.asyncio
+    async def test_list_company_coupons_not_found(self, admin_user, admin_token):
+        """Test listing coupons of a company the admin does not own."""
+        from app.api.company import get_db, get_current_admin
+        mock_db = AsyncMock()
+        mock_db.companies.find_one.return_value = None
+
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin_user
+        try:
+            response = client.get("/api/companies/507f1f77bcf86cd799439999/coupons")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 404
+
     @pytest.mark.asyncio
     async def test_delete_company_success(self, admin_user, admin_token, sample_company):
         """Test successful company deletion."""
+        from app.api.company import get_db, get_current_admin
+        
         mock_db = AsyncMock()
-        mock_db.companies.find_one.return_value = sample_company
+        mock_db.companies.find_one_and_delete.return_value = {"_id": sample_company["_id"]}
 
-        with patch("app.api.company.get_db", return_value=mock_db), \
-             patch("app.api.company.get_current_admin", return_value=admin_user):
-            
-            response = client.delete(
-                f"/api/companies/{sample_company['_id']}",
-                headers={"Authorization": f"Bearer {admin_token}"}
-            )
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin_user
+        
+        try:
+            response = client.delete(f"/api/companies/{sample_company['_id']}")
+        finally:
+            app.dependency_overrides.clear()
 
         assert response.status_code == 204
-        mock_db.companies.delete_one.assert_called_once()
+        mock_db.companies.find_one_and_delete.assert_called_once()
+        assert mock_db.companies.find_one_and_delete.call_args.args[0] == {
+            "_id": sample_company["_id"],
+            "admin_id": admin_user.id
+        }
 
     @pytest.mark.asyncio
     async def test_delete_company_not_found(self, admin_user, admin_token):
         """Test company deletion with non-existent ID."""
+        from app.api.company import get_db, get_current_admin
+        
         mock_db = AsyncMock()
-        mock_db.companies.find_one.return_value = None
+        mock_db.companies.find_one_and_delete.return_value = None
 
-        with patch("app.api.company.get_db", return_value=mock_db), \
-             patch("app.api.company.get_current_admin", return_value=admin_user):
-            
-            response = client.delete(
-                "/api/companies/507f1f77bcf86cd799439999",
-                headers={"Authorization": f"Bearer {admin_token}"}
-            )
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin_user
+        
+        try:
+            response = client.delete("/api/companies/507f1f77bcf86cd799439999")
+        finally:
+            app.dependency_overrides.clear()
 
         assert response.status_code == 404
         assert "Company not found" in response.json()["detail"]
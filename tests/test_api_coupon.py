@@ -0,0 +1,839 @@
+import pytest
+from unittest.mock import ANY, AsyncMock, Mock
+from fastapi.testclient import TestClient
+from app.main import app
+from app.models.user import User
+from app.core.barcode_images import barcode_images
+from app.core.companies import company_owners, company_rules
+from app.core.wallets import wallets
+from app.core.idempotency import IdempotentRequest, recent_responses
+from app.ledger import coupon_events
+from app.models.coupon import StampBatchRequest
+from app.api.coupon import get_db, get_current_admin, get_current_user
+from app.utils.pagination import decode_cursor
+from app.utils.barcode import encode_barcode
+from app.config import settings
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+client = TestClient(app)
+
+# Helper function to override dependencies
+def override_dependencies(mock_db, user):
+    app.dependency_overrides[get_db] = lambda: mock_db
+    app.dependency_overrides[get_current_admin] = lambda: user
+
+class TestCouponAPI:
+
+    @pytest.fixture(autouse=True)
+    def clear_company_cache(self):
+        company_owners.clear()
+        company_rules.clear()
+        recent_responses.clear()
+        barcode_images.clear()
+        coupon_events._buffer.clear()
+        yield
+        company_owners.clear()
+        company_rules.clear()
+        recent_responses.clear()
+
+    @pytest.fixture
+    def admin_user(self):
+        return User(
+            id="507f1f77bcf86cd799439011",
+            email="admin@example.com",
+            name="Admin User",
+            role="admin"
+        )
+
+    @pytest.fixture
+    def sample_company(self, admin_user):
+        return {
+            "_id": ObjectId("507f1f77bcf86cd799439013"),
+            "admin_id": str(admin_user.id)
+        }
+
+    @pytest.fixture
+    def stamp_request(self, sample_company):
+        return {
+            "company_id": str(sample_company["_id"]),
+            "barcode": "123456789012",
+            "client_id": "507f1f77bcf86cd799439021"
+        }
+
+    def _stamp_db(self, sample_company, stamp_request, count, rules=()):
+        mock_db = AsyncMock()
+        mock_db.companies.find_one.return_value = sample_company
+        mock_db.coupons.find_one_and_update.return_value = {
+            "_id": ObjectId("507f1f77bcf86cd799439031"),
+            **stamp_request,
+            "count": count,
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
+        }
+        rules_cursor = Mock()
+        rules_cursor.to_list = AsyncMock(return_value=list(rules))
+        mock_db.coupon_rules.find = Mock(return_value=rules_cursor)
+        return mock_db
+
+    def _batch_db(self, sample_company, coupons=()):
+        mock_db = AsyncMock()
+        mock_db.companies.find_one.return_value = sample_company
+        coupons_cursor = Mock()
+        coupons_cursor.to_list = AsyncMock(return_value=list(coupons))
+        mock_db.coupons.find = Mock(return_value=coupons_cursor)
+        return mock_db
+
+    def test_stamp_success(self, admin_user, sample_company, stamp_request):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=3)
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamp", json=stamp_request)
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["id"] == "507f1f77bcf86cd799439031"
+        assert data["count"] == 3
+        assert data["unlocked_rewards"] == []
+        query, update = mock_db.coupons.find_one_and_update.call_args.args
+        assert query == stamp_request
+        assert update["$inc"] == {"count": 1}
+        assert mock_db.coupons.find_one_and_update.call_args.kwargs["upsert"] is True
+
+    def test_stamp_invalidates_wallet(self, admin_user, sample_company, stamp_request):
+        wallets.set(stamp_request["client_id"], [])
+        mock_db = self._stamp_db(sample_company, stamp_request, count=1)
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            client.post("/api/coupons/stamp", json=stamp_request)
+        finally:
+            app.dependency_overrides.clear()
+
+        assert wallets.get(stamp_request["client_id"]) is None
+
+    def test_stamp_unlocks_reward(self, admin_user, sample_company, stamp_request):
+        rules = [
+            {"_id": ObjectId("507f1f77bcf86cd799439041"), "required_coupons": 10, "reward": "Free coffee"},
+            {"_id": ObjectId("507f1f77bcf86cd799439042"), "required_coupons": 20, "reward": "Free cake"},
+        ]
+        mock_db = self._stamp_db(sample_company, stamp_request, count=10, rules=rules)
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamp", json=stamp_request)
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert response.json()["unlocked_rewards"] == [
+            {"rule_id": "507f1f77bcf86cd799439041", "required_coupons": 10, "reward": "Free coffee"}
+        ]
+
+    def test_stamp_caches_company_lookups(self, admin_user, sample_company, stamp_request):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=1)
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            for _ in range(3):
+                response = client.post("/api/coupons/stamp", json=stamp_request)
+                assert response.status_code == 200
+        finally:
+            app.dependency_overrides.clear()
+
+        assert mock_db.companies.find_one.await_count == 1
+        assert mock_db.coupon_rules.find.call_count == 1
+        assert mock_db.coupons.find_one_and_update.await_count == 3
+
+    def test_stamp_other_admins_company(self, admin_user, stamp_request):
+        mock_db = AsyncMock()
+        mock_db.companies.find_one.return_value = {
+            "_id": ObjectId(stamp_request["company_id"]),
+            "admin_id": "507f1f77bcf86cd799439099"
+        }
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamp", json=stamp_request)
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 404
+        mock_db.coupons.find_one_and_update.assert_not_called()
+
+    def test_stamp_barcode_of_other_company(self, admin_user, sample_company, stamp_request):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=1)
+        mock_db.coupons.find_one_and_update.side_effect = DuplicateKeyError("E11000")
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamp", json=stamp_request)
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 409
+        # The retry covers a lost insert race before giving up
+        assert mock_db.coupons.find_one_and_update.await_count == 2
+
+    @pytest.fixture
+    def rules(self):
+        return [
+            {"_id": ObjectId("507f1f77bcf86cd799439041"), "required_coupons": 10, "reward": "Free coffee"},
+            {"_id": ObjectId("507f1f77bcf86cd799439042"), "required_coupons": 20, "reward": "Free cake"},
+        ]
+
+    def test_redeem_cheapest_rule_by_default(self, admin_user, sample_company, stamp_request, rules):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=2, rules=reversed(rules))
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/redeem", json=stamp_request)
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["count"] == 2
+        assert data["redeemed_reward"]["reward"] == "Free coffee"
+        query, update = mock_db.coupons.find_one_and_update.call_args.args
+        assert query == {**stamp_request, "count": {"$gte": 10}}
+        assert update["$inc"] == {"count": -10}
+
+    def test_redeem_specific_rule(self, admin_user, sample_company, stamp_request, rules):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=1, rules=rules)
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post(
+                "/api/coupons/redeem",
+                json={**stamp_request, "rule_id": "507f1f77bcf86cd799439042"}
+            )
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert response.json()["redeemed_reward"]["required_coupons"] == 20
+        query, update = mock_db.coupons.find_one_and_update.call_args.args
+        assert update["$inc"] == {"count": -20}
+
+    def test_redeem_unknown_rule(self, admin_user, sample_company, stamp_request, rules):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=30, rules=rules)
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post(
+                "/api/coupons/redeem",
+                json={**stamp_request, "rule_id": "507f1f77bcf86cd799439099"}
+            )
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 404
+        mock_db.coupons.find_one_and_update.assert_not_called()
+
+    def test_redeem_not_enough_coupons(self, admin_user, sample_company, stamp_request, rules):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=0, rules=rules)
+        mock_db.coupons.find_one_and_update.return_value = None
+        mock_db.coupons.find_one.return_value = {
+            "_id": ObjectId("507f1f77bcf86cd799439031"),
+            **stamp_request,
+            "count": 7,
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
+        }
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/redeem", json=stamp_request)
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 409
+        assert response.json()["detail"] == "Not enough coupons: 7 of 10 required"
+
+    def test_redeem_missing_coupon(self, admin_user, sample_company, stamp_request, rules):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=0, rules=rules)
+        mock_db.coupons.find_one_and_update.return_value = None
+        mock_db.coupons.find_one.return_value = None
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/redeem", json=stamp_request)
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 404
+        assert response.json()["detail"] == "Coupon not found"
+
+    def test_stamp_batch_aggregates_duplicates(self, admin_user, sample_company):
+        mock_db = self._batch_db(sample_company)
+        company_id = str(sample_company["_id"])
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamps:batch", json={
+                "company_id": company_id,
+                "stamps": [
+                    {"barcode": "A", "client_id": "c1"},
+                    {"barcode": "A", "client_id": "c2", "n": 3},
+                    {"barcode": "A", "client_id": "c1", "n": 2},
+                ]
+            })
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert response.json() == {"stamped": 6, "results": [200, 200, 200]}
+        mock_db.coupons.bulk_write.assert_awaited_once()
+        operations = mock_db.coupons.bulk_write.call_args.args[0]
+        assert mock_db.coupons.bulk_write.call_args.kwargs["ordered"] is False
+        assert [(op._filter["client_id"], op._doc["$inc"]["count"]) for op in operations] == [("c1", 3), ("c2", 3)]
+        assert all(op._upsert for op in operations)
+
+    def test_stamp_batch_reports_conflicts(self, admin_user, sample_company):
+        mock_db = self._batch_db(sample_company)
+        # The second operation keeps hitting the unique index: another company's barcode
+        mock_db.coupons.bulk_write.side_effect = [
+            BulkWriteError({"writeErrors": [{"index": 1, "code": 11000}]}),
+            BulkWriteError({"writeErrors": [{"index": 0, "code": 11000}]}),
+        ]
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamps:batch", json={
+                "company_id": str(sample_company["_id"]),
+                "stamps": [
+                    {"barcode": "A", "client_id": "c1"},
+                    {"barcode": "B", "client_id": "c1", "n": 4},
+                    {"barcode": "B", "client_id": "c1"},
+                ]
+            })
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert response.json() == {"stamped": 1, "results": [200, 409, 409]}
+        retried = mock_db.coupons.bulk_write.call_args_list[1].args[0]
+        assert [op._filter["barcode"] for op in retried] == ["B"]
+
+    def test_strict_stamp_rejects_invalid_barcode(self, admin_user, sample_company, stamp_request, monkeypatch):
+        monkeypatch.setattr(settings, "BARCODE_STRICT", True)
+        mock_db = AsyncMock()
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            foreign = encode_barcode("507f1f77bcf86cd799439099", 1)
+            responses = [
+                client.post("/api/coupons/stamp", json={**stamp_request, "barcode": barcode})
+                for barcode in ("123456789012", foreign)
+            ]
+        finally:
+            app.dependency_overrides.clear()
+
+        assert [response.status_code for response in responses] == [422, 422]
+        assert responses[0].json()["detail"] == "Invalid barcode"
+        # Rejected before any database work, including the ownership lookup
+        assert mock_db.mock_calls == []
+
+    def test_strict_stamp_accepts_issued_barcode(self, admin_user, sample_company, stamp_request, monkeypatch):
+        monkeypatch.setattr(settings, "BARCODE_STRICT", True)
+        stamp_request["barcode"] = encode_barcode(stamp_request["company_id"], 1)
+        mock_db = self._stamp_db(sample_company, stamp_request, count=1)
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamp", json=stamp_request)
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+
+    def test_strict_stamp_batch_flags_invalid_items(self, admin_user, sample_company, monkeypatch):
+        monkeypatch.setattr(settings, "BARCODE_STRICT", True)
+        company_id = str(sample_company["_id"])
+        barcode = encode_barcode(company_id, 1)
+        mistyped = barcode[:-1] + ("1" if barcode[-1] == "0" else "0")
+        mock_db = self._batch_db(sample_company)
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamps:batch", json={
+                "company_id": company_id,
+                "stamps": [
+                    {"barcode": barcode, "client_id": "c1"},
+                    {"barcode": mistyped, "client_id": "c1"},
+                ]
+            })
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert response.json() == {"stamped": 1, "results": [200, 422]}
+        operations = mock_db.coupons.bulk_write.call_args.args[0]
+        assert [op._filter["barcode"] for op in operations] == [barcode]
+
+    def test_stamp_batch_rejects_empty(self, admin_user, sample_company):
+        mock_db = AsyncMock()
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamps:batch", json={
+                "company_id": str(sample_company["_id"]),
+                "stamps": []
+            })
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 422
+
+    def test_stamp_batch_rejects_oversized_n(self, admin_user, sample_company):
+        mock_db = AsyncMock()
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamps:batch", json={
+                "company_id": str(sample_company["_id"]),
+                "stamps": [{"barcode": "A", "client_id": "c1", "n": 2**63}]
+            }, headers={"Idempotency-Key": "k6"})
+        finally:
+            app.dependency_overrides.clear()
+
+        # Rejected before the key is claimed or anything is written
+        assert response.status_code == 422
+        mock_db.idempotency_keys.insert_one.assert_not_called()
+        mock_db.coupons.bulk_write.assert_not_called()
+
+    def test_stamp_idempotency_key_records_op(self, admin_user, sample_company, stamp_request):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=1)
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            first = client.post("/api/coupons/stamp", json=stamp_request, headers={"Idempotency-Key": "k1"})
+            retry = client.post("/api/coupons/stamp", json=stamp_request, headers={"Idempotency-Key": "k1"})
+        finally:
+            app.dependency_overrides.clear()
+
+        assert first.status_code == retry.status_code == 200
+        assert retry.json() == first.json()
+        # The retry is answered from the front cache without a second write
+        mock_db.coupons.find_one_and_update.assert_awaited_once()
+        query, update = mock_db.coupons.find_one_and_update.call_args.args
+        assert query["ops.key"] == {"$ne": f"{admin_user.id}:stamp:k1"}
+        assert isinstance(update, list)
+
+    def test_stamp_idempotency_key_replays_from_coupon(self, admin_user, sample_company, stamp_request):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=0)
+        # The coupon already carries the key, so the upsert collides with it
+        mock_db.coupons.find_one_and_update.side_effect = DuplicateKeyError("E11000")
+        mock_db.coupons.find_one.return_value = {
+            "_id": ObjectId("507f1f77bcf86cd799439031"),
+            **stamp_request,
+            "count": 12,
+            "ops": [{"key": f"{admin_user.id}:stamp:k1", "count": 10}],
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
+        }
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamp", json=stamp_request, headers={"Idempotency-Key": "k1"})
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert response.json()["count"] == 10
+        mock_db.coupons.find_one_and_update.assert_awaited_once()
+
+    def test_idempotency_key_reused_for_other_request(self, admin_user, sample_company, stamp_request):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=1)
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            client.post("/api/coupons/stamp", json=stamp_request, headers={"Idempotency-Key": "k1"})
+            response = client.post(
+                "/api/coupons/stamp",
+                json={**stamp_request, "client_id": "507f1f77bcf86cd799439022"},
+                headers={"Idempotency-Key": "k1"}
+            )
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 422
+
+    def test_redeem_idempotency_key_replays_from_coupon(self, admin_user, sample_company, stamp_request, rules):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=0, rules=rules)
+        mock_db.coupons.find_one_and_update.return_value = None
+        mock_db.coupons.find_one.return_value = {
+            "_id": ObjectId("507f1f77bcf86cd799439031"),
+            **stamp_request,
+            "count": 0,
+            "ops": [{"key": f"{admin_user.id}:redeem:k2", "count": 3}],
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
+        }
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/redeem", json=stamp_request, headers={"Idempotency-Key": "k2"})
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert response.json()["count"] == 3
+        assert response.json()["redeemed_reward"]["reward"] == "Free coffee"
+
+    def test_stamp_batch_idempotency_key_replays_record(self, admin_user, sample_company):
+        mock_db = self._batch_db(sample_company)
+        batch = {"company_id": str(sample_company["_id"]), "stamps": [{"barcode": "A", "client_id": "c1"}]}
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            first = client.post("/api/coupons/stamps:batch", json=batch, headers={"Idempotency-Key": "k3"})
+            record = mock_db.idempotency_keys.insert_one.call_args.args[0]
+            mock_db.idempotency_keys.insert_one.side_effect = DuplicateKeyError("E11000")
+            mock_db.idempotency_keys.find_one.return_value = {**record, "response": first.json()}
+            # Another worker: nothing in its front cache
+            recent_responses.clear()
+            retry = client.post("/api/coupons/stamps:batch", json=batch, headers={"Idempotency-Key": "k3"})
+        finally:
+            app.dependency_overrides.clear()
+
+        assert first.status_code == retry.status_code == 200
+        assert retry.json() == first.json() == {"stamped": 1, "results": [200]}
+        mock_db.coupons.bulk_write.assert_awaited_once()
+        mock_db.idempotency_keys.update_one.assert_awaited_once()
+
+    def test_stamp_batch_idempotency_key_in_progress(self, admin_user, sample_company):
+        mock_db = self._batch_db(sample_company)
+        batch = {"company_id": str(sample_company["_id"]), "stamps": [{"barcode": "A", "client_id": "c1"}]}
+        mock_db.idempotency_keys.insert_one.side_effect = DuplicateKeyError("E11000")
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            pending = IdempotentRequest("k4", str(admin_user.id), "stamps:batch", StampBatchRequest(**batch))
+            mock_db.idempotency_keys.find_one.return_value = {
+                "_id": pending.record_id, "fingerprint": pending.fingerprint, "response": None
+            }
+            # The holder's lease has not run out
+            mock_db.idempotency_keys.update_one.return_value = Mock(modified_count=0)
+            response = client.post("/api/coupons/stamps:batch", json=batch, headers={"Idempotency-Key": "k4"})
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 409
+        mock_db.coupons.bulk_write.assert_not_called()
+
+    def test_stamp_batch_takes_over_expired_claim(self, admin_user, sample_company):
+        mock_db = self._batch_db(sample_company)
+        batch = {"company_id": str(sample_company["_id"]), "stamps": [{"barcode": "A", "client_id": "c1"}]}
+        mock_db.idempotency_keys.insert_one.side_effect = DuplicateKeyError("E11000")
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            # Claimed by a worker that crashed before storing its response
+            pending = IdempotentRequest("k7", str(admin_user.id), "stamps:batch", StampBatchRequest(**batch))
+            mock_db.idempotency_keys.find_one.return_value = {
+                "_id": pending.record_id, "fingerprint": pending.fingerprint, "response": None
+            }
+            response = client.post("/api/coupons/stamps:batch", json=batch, headers={"Idempotency-Key": "k7"})
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        mock_db.coupons.bulk_write.assert_awaited_once()
+        takeover, stored = mock_db.idempotency_keys.update_one.call_args_list
+        assert takeover.args[0] == {
+            "_id": pending.record_id, "response": None, "locked_until": {"$not": {"$gte": ANY}}
+        }
+        assert stored.args[1] == {"$set": {"response": response.json()}}
+
+    def test_redeem_idempotency_key_reused_for_another_rule(self, admin_user, sample_company, stamp_request, rules):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=0, rules=rules)
+        mock_db.coupons.find_one_and_update.return_value = None
+        mock_db.coupons.find_one.return_value = {
+            "_id": ObjectId("507f1f77bcf86cd799439031"),
+            **stamp_request,
+            "count": 0,
+            "ops": [{"key": f"{admin_user.id}:redeem:k8", "count": 0, "fp": "another request"}],
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
+        }
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            # Not in this worker's cache, so only the fingerprint stored with the key can tell
+            response = client.post("/api/coupons/redeem", json=stamp_request, headers={"Idempotency-Key": "k8"})
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 422
+        assert response.json()["detail"] == "Idempotency-Key was already used for a different request"
+
+    def test_stamp_records_ledger_event(self, admin_user, sample_company, stamp_request):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=3)
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamp", json=stamp_request, headers={"X-POS-ID": "till-2"})
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        [event] = coupon_events._buffer
+        assert event["coupon_id"] == "507f1f77bcf86cd799439031"
+        assert (event["type"], event["delta"], event["actor_id"], event["pos_id"]) == (
+            "stamp", 1, admin_user.id, "till-2"
+        )
+
+    def test_replayed_stamp_records_no_event(self, admin_user, sample_company, stamp_request):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=0)
+        mock_db.coupons.find_one_and_update.side_effect = DuplicateKeyError("E11000")
+        mock_db.coupons.find_one.return_value = {
+            "_id": ObjectId("507f1f77bcf86cd799439031"),
+            **stamp_request,
+            "count": 1,
+            "ops": [{"key": f"{admin_user.id}:stamp:k1", "count": 1}],
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
+        }
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamp", json=stamp_request, headers={"Idempotency-Key": "k1"})
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert coupon_events._buffer == []
+
+    def test_redeem_records_ledger_event(self, admin_user, sample_company, stamp_request, rules):
+        mock_db = self._stamp_db(sample_company, stamp_request, count=2, rules=rules)
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/redeem", json=stamp_request)
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        [event] = coupon_events._buffer
+        assert (event["type"], event["delta"], event["rule_id"]) == ("redeem", -10, "507f1f77bcf86cd799439041")
+
+    def test_stamp_batch_records_ledger_events(self, admin_user, sample_company):
+        mock_db = self._batch_db(sample_company, coupons=[
+            {"_id": ObjectId("507f1f77bcf86cd799439031"), "barcode": "A", "client_id": "c1"},
+            {"_id": ObjectId("507f1f77bcf86cd799439032"), "barcode": "A", "client_id": "c2"},
+        ])
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamps:batch", json={
+                "company_id": str(sample_company["_id"]),
+                "stamps": [
+                    {"barcode": "A", "client_id": "c1", "n": 2},
+                    {"barcode": "A", "client_id": "c2"},
+                ]
+            })
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert [(event["coupon_id"], event["delta"]) for event in coupon_events._buffer] == [
+            ("507f1f77bcf86cd799439031", 2), ("507f1f77bcf86cd799439032", 1)
+        ]
+
+    def test_stamp_batch_keeps_key_when_ledger_read_fails(self, admin_user, sample_company):
+        mock_db = self._batch_db(sample_company)
+        mock_db.coupons.find.return_value.to_list.side_effect = Exception("connection reset")
+        batch = {"company_id": str(sample_company["_id"]), "stamps": [{"barcode": "A", "client_id": "c1"}]}
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.post("/api/coupons/stamps:batch", json=batch, headers={"Idempotency-Key": "k5"})
+        finally:
+            app.dependency_overrides.clear()
+
+        # The stamps were written, so the key must stand or a retry would apply them twice
+        assert response.status_code == 200
+        assert response.json() == {"stamped": 1, "results": [200]}
+        mock_db.idempotency_keys.delete_one.assert_not_called()
+        mock_db.idempotency_keys.update_one.assert_awaited_once()
+        assert list(coupon_events._buffer) == []
+
+    def test_stamp_batch_retry_after_partial_write_skips_stamped_coupons(self, admin_user, sample_company):
+        mock_db = self._batch_db(sample_company)
+        batch = {"company_id": str(sample_company["_id"]), "stamps": [
+            {"barcode": "A", "client_id": "c1"}, {"barcode": "B", "client_id": "c1", "n": 2}
+        ]}
+        # A1 is written, B1 fails on something other than a duplicate key
+        mock_db.coupons.bulk_write.side_effect = BulkWriteError({"writeErrors": [{"index": 1, "code": 112}]})
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            with pytest.raises(BulkWriteError):
+                client.post("/api/coupons/stamps:batch", json=batch, headers={"Idempotency-Key": "k6"})
+            mock_db.idempotency_keys.delete_one.assert_awaited_once()
+            first = mock_db.coupons.bulk_write.call_args.args[0]
+            record_id = f"{admin_user.id}:stamps:batch:k6"
+            assert [op._filter["ops.key"] for op in first] == [{"$ne": record_id}] * 2
+            event_id = first[0]._doc[1]["$set"]["ops"]["$slice"][0]["$concatArrays"][1][0]["event"]
+            # The retry's A1 no longer matches its filter and collides on insert
+            mock_db.coupons.bulk_write.side_effect = BulkWriteError({"writeErrors": [{"index": 0, "code": 11000}]})
+            mock_db.coupons.find.return_value.to_list.return_value = [{
+                "_id": ObjectId("507f1f77bcf86cd799439031"), "barcode": "A", "client_id": "c1",
+                "ops": [{"key": record_id, "count": 1, "event": event_id}],
+            }]
+            response = client.post("/api/coupons/stamps:batch", json=batch, headers={"Idempotency-Key": "k6"})
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert response.json() == {"stamped": 3, "results": [200, 200]}
+        assert mock_db.coupons.bulk_write.await_count == 2
+        # A1's event is recorded again under the id of the first attempt, so it is stored once
+        assert [(event["_id"], event["coupon_id"]) for event in coupon_events._buffer] == [
+            (event_id, "507f1f77bcf86cd799439031")
+        ]
+
+    def _events_db(self, sample_company, coupon, events):
+        mock_db = AsyncMock()
+        mock_db.companies.find_one.return_value = sample_company
+        mock_db.coupons.find_one.return_value = coupon
+        events_cursor = Mock()
+        events_cursor.sort.return_value = events_cursor
+        events_cursor.limit.return_value = events_cursor
+        events_cursor.to_list = AsyncMock(return_value=events)
+        mock_db.coupon_events.find = Mock(return_value=events_cursor)
+        return mock_db
+
+    @pytest.fixture
+    def ledger(self, sample_company, stamp_request):
+        coupon = {
+            "_id": ObjectId("507f1f77bcf86cd799439031"),
+            "company_id": stamp_request["company_id"],
+            "client_id": stamp_request["client_id"],
+        }
+        events = [
+            {
+                "_id": ObjectId(), "coupon_id": str(coupon["_id"]), "company_id": coupon["company_id"],
+                "type": "stamp", "delta": 1, "actor_id": "507f1f77bcf86cd799439011", "pos_id": None,
+                "rule_id": None, "created_at": datetime.now(timezone.utc)
+            }
+            for _ in range(2)
+        ]
+        return coupon, events
+
+    def test_list_coupon_events_for_admin(self, admin_user, sample_company, ledger):
+        coupon, events = ledger
+        mock_db = self._events_db(sample_company, coupon, events)
+        override_dependencies(mock_db, admin_user)
+        app.dependency_overrides[get_current_user] = lambda: admin_user
+
+        try:
+            response = client.get(f"/api/coupons/{coupon['_id']}/events?limit=2")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert [event["id"] for event in response.json()] == [str(event["_id"]) for event in events]
+        assert decode_cursor(response.headers["X-Next-Cursor"]) == events[-1]["_id"]
+        mock_db.coupon_events.find.assert_called_once_with({"coupon_id": str(coupon["_id"])})
+        mock_db.coupon_events.find.return_value.sort.assert_called_once_with("_id", -1)
+
+    def test_list_coupon_events_for_holding_client(self, sample_company, stamp_request, ledger):
+        coupon, events = ledger
+        holder = User(id=stamp_request["client_id"], email="client@example.com", name="Client", role="client")
+        mock_db = self._events_db(sample_company, coupon, events)
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_user] = lambda: holder
+
+        try:
+            response = client.get(f"/api/coupons/{coupon['_id']}/events")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert len(response.json()) == 2
+        assert "X-Next-Cursor" not in response.headers
+
+    def test_list_coupon_events_for_other_client(self, sample_company, ledger):
+        coupon, events = ledger
+        other = User(id="507f1f77bcf86cd799439099", email="other@example.com", name="Other", role="client")
+        mock_db = self._events_db(sample_company, coupon, events)
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_user] = lambda: other
+
+        try:
+            response = client.get(f"/api/coupons/{coupon['_id']}/events")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 404
+        mock_db.coupon_events.find.assert_not_called()
+
+    def _holder_request(self, coupon, path, **kwargs):
+        holder = User(id=coupon["client_id"], email="client@example.com", name="Client", role="client")
+        mock_db = AsyncMock()
+        mock_db.coupons.find_one.return_value = coupon
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_user] = lambda: holder
+
+        try:
+            return client.get(f"/api/coupons/{coupon['_id']}/{path}", **kwargs), mock_db
+        finally:
+            app.dependency_overrides.clear()
+
+    def test_barcode_svg(self, ledger):
+        coupon, _ = ledger
+        coupon = {**coupon, "barcode": "123456789012"}
+
+        response, mock_db = self._holder_request(coupon, "barcode.svg?scale=3")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/svg+xml"
+        assert response.content.startswith(b"<svg")
+        assert "immutable" in response.headers["Cache-Control"]
+        assert mock_db.coupons.find_one.call_args.kwargs["projection"] == {
+            "company_id": 1, "client_id": 1, "barcode": 1
+        }
+
+    def test_barcode_png_is_cached_and_revalidated(self, ledger):
+        coupon, _ = ledger
+        coupon = {**coupon, "barcode": "CAFE-42"}
+
+        first, _ = self._holder_request(coupon, "barcode.png")
+        again, _ = self._holder_request(coupon, "barcode.png", headers={"If-None-Match": first.headers["ETag"]})
+
+        assert first.status_code == 200
+        assert first.headers["content-type"] == "image/png"
+        assert first.content.startswith(b"\x89PNG")
+        assert again.status_code == 304
+        assert again.content == b""
+        assert again.headers["ETag"] == first.headers["ETag"]
+        assert barcode_images.stats()["hits"] == 1
+
+    def test_barcode_image_for_other_client(self, ledger):
+        coupon, _ = ledger
+        other = User(id="507f1f77bcf86cd799439099", email="other@example.com", name="Other", role="client")
+        mock_db = AsyncMock()
+        mock_db.coupons.find_one.return_value = {**coupon, "barcode": "CAFE-42"}
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_user] = lambda: other
+
+        try:
+            response = client.get(f"/api/coupons/{coupon['_id']}/barcode.svg")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 404
+
+    def test_barcode_image_unencodable(self, ledger):
+        coupon, _ = ledger
+
+        response, _ = self._holder_request({**coupon, "barcode": "caf\u00e9"}, "barcode.svg")
+
+        assert response.status_code == 422
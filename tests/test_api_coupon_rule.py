@@ -1,3 +1,4 @@
+import json
 import pytest
 from unittest.mock import AsyncMock, Mock, patch
 from fastapi.testclient import TestClient
@@ -6,7 +7,10 @@ from app.models.user import User
 from app.models.company import Company
 from app.models.coupon_rule import CouponRule
 from app.core.auth import create_access_token
+from app.core.companies import company_rules
+from app.core.rule_index import CompiledRules
 from datetime import datetime, timedelta
+import bson
 from bson import ObjectId
 
 client = TestClient(app)
@@ -85,7 +89,35 @@ class TestCouponRuleAPI:
         assert data["company_id"] == str(sample_company["_id"])
         assert data["required_coupons"] == 10
         assert data["reward"] == "Free coffee"
-        assert "id" in data
+        assert data["id"] == "507f1f77bcf86cd799439015"
+        mock_db.coupon_rules.find_one.assert_not_called()
+        inserted = mock_db.coupon_rules.insert_one.call_args.args[0]
+        assert inserted["admin_id"] == admin_user.id
+    
+    @pytest.mark.asyncio
+    async def test_create_coupon_rule_fast_responses(self, admin_user, admin_token, sample_company, monkeypatch):
+        from app.config import settings
+        monkeypatch.setattr(settings, "FAST_RESPONSES", True)
+        rule_data = {
+            "company_id": str(sample_company["_id"]),
+            "required_coupons": 10,
+            "reward": "Free coffee"
+        }
+        mock_db = AsyncMock()
+        mock_db.companies.find_one.return_value = sample_company
+        mock_db.coupon_rules.insert_one.return_value = AsyncMock(
+            inserted_id=ObjectId("507f1f77bcf86cd799439015")
+        )
+        override_dependencies(mock_db, admin_user)
+        
+        try:
+            response = client.post("/api/coupon-rules/", json=rule_data)
+        finally:
+            app.dependency_overrides.clear()
+        
+        assert response.status_code == 201
+        # The stored admin_id is not part of the response model
+        assert response.json() == {**rule_data, "id": "507f1f77bcf86cd799439015"}
     
     @pytest.mark.asyncio
     async def test_create_coupon_rule_invalid_company(self, admin_user, admin_token):
@@ -156,6 +188,80 @@ class TestCouponRuleAPI:
         assert data[0]["id"] == str(sample_coupon_rule["_id"])
         assert data[0]["company_id"] == str(sample_company["_id"])
     
+    @pytest.mark.asyncio
+    async def test_list_company_rules_ndjson(self, admin_user, admin_token, sample_company, sample_coupon_rule):
+        rules = [
+            {**sample_coupon_rule, "_id": ObjectId(), "required_coupons": i + 1}
+            for i in range(150)
+        ]
+        
+        class AsyncCursor:
+            def __init__(self, docs):
+                self._docs = iter(docs)
+            
+            def __aiter__(self):
+                return self
+            
+            async def __anext__(self):
+                try:
+                    return dict(next(self._docs))
+                except StopIteration:
+                    raise StopAsyncIteration
+        
+        mock_db = AsyncMock()
+        mock_db.companies.find_one.return_value = sample_company
+        mock_db.coupon_rules.find = Mock(return_value=AsyncCursor(rules))
+        
+        override_dependencies(mock_db, admin_user)
+        
+        try:
+            response = client.get(
+                f"/api/coupon-rules/company/{sample_company['_id']}",
+                headers={"Accept": "application/x-ndjson"}
+            )
+        finally:
+            app.dependency_overrides.clear()
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert len(lines) == 150
+        assert lines[0] == {
+            "company_id": sample_coupon_rule["company_id"],
+            "required_coupons": 1,
+            "reward": "Free coffee",
+            "id": str(rules[0]["_id"]),
+        }
+    
+    @pytest.mark.asyncio
+    async def test_list_company_rules_raw_bson(self, admin_user, admin_token, sample_company, sample_coupon_rule, monkeypatch):
+        from app.config import settings
+        rules = [
+            {"company_id": sample_coupon_rule["company_id"], "required_coupons": i + 1, "reward": "Free coffee", "id": str(ObjectId())}
+            for i in range(3)
+        ]
+
+        async def raw_batches():
+            yield b"".join(bson.encode(rule) for rule in rules)
+
+        mock_db = AsyncMock()
+        mock_db.companies.find_one.return_value = sample_company
+        mock_db.coupon_rules.find_raw_batches = Mock(return_value=raw_batches())
+        monkeypatch.setattr(settings, "RAW_BSON_LISTS", True)
+
+        override_dependencies(mock_db, admin_user)
+
+        try:
+            response = client.get(f"/api/coupon-rules/company/{sample_company['_id']}")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert response.json() == rules
+        projection = mock_db.coupon_rules.find_raw_batches.call_args.kwargs["projection"]
+        assert set(projection) == {"_id", "id", "company_id", "required_coupons", "reward"}
+    
     @pytest.mark.skip(reason="Complex cursor mocking - core functionality works")
     @pytest.mark.asyncio
     async def test_list_company_rules_invalid_company(self, admin_user, admin_token):
@@ -191,6 +297,27 @@ class TestCouponRuleAPI:
         assert data["company_id"] == sample_coupon_rule["company_id"]
         assert data["required_coupons"] == sample_coupon_rule["required_coupons"]
         assert data["reward"] == sample_coupon_rule["reward"]
+        mock_db.coupon_rules.find_one.assert_called_once_with({
+            "_id": sample_coupon_rule["_id"],
+            "admin_id": admin_user.id
+        })
+        mock_db.companies.find_one.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_get_coupon_rule_other_admin(self, admin_user, admin_token, sample_coupon_rule):
+        mock_db = AsyncMock()
+        # Owned-rule query misses, but the rule itself exists
+        mock_db.coupon_rules.find_one.side_effect = [None, {"_id": sample_coupon_rule["_id"]}]
+        
+        override_dependencies(mock_db, admin_user)
+        
+        try:
+            response = client.get(f"/api/coupon-rules/{sample_coupon_rule['_id']}")
+        finally:
+            app.dependency_overrides.clear()
+        
+        assert response.status_code == 403
+        assert "permission" in response.json()["detail"]
     
     @pytest.mark.asyncio
     async def test_get_coupon_rule_not_found(self, admin_user, admin_token):
@@ -218,7 +345,8 @@ class TestCouponRuleAPI:
         updated_rule.update(update_data)
         
         mock_db = AsyncMock()
-        mock_db.coupon_rules.find_one.side_effect = [sample_coupon_rule, updated_rule]
+        mock_db.coupon_rules.find_one.return_value = sample_coupon_rule
+        mock_db.coupon_rules.find_one_and_update.return_value = updated_rule
         mock_db.companies.find_one.return_value = sample_company
         
         override_dependencies(mock_db, admin_user)
@@ -233,6 +361,30 @@ class TestCouponRuleAPI:
         assert data["required_coupons"] == 15
         assert data["reward"] == "Free large coffee"
         assert data["company_id"] == sample_coupon_rule["company_id"]
+        mock_db.coupon_rules.update_one.assert_not_called()
+        mock_db.coupon_rules.find_one.assert_not_called()
+        mock_db.companies.find_one.assert_not_called()
+        filter_ = mock_db.coupon_rules.find_one_and_update.call_args.args[0]
+        assert filter_ == {"_id": sample_coupon_rule["_id"], "admin_id": admin_user.id}
+    
+    @pytest.mark.asyncio
+    async def test_update_coupon_rule_to_foreign_company(self, admin_user, admin_token, sample_coupon_rule):
+        mock_db = AsyncMock()
+        mock_db.companies.find_one.return_value = None
+        
+        override_dependencies(mock_db, admin_user)
+        
+        try:
+            response = client.put(
+                f"/api/coupon-rules/{sample_coupon_rule['_id']}",
+                json={"company_id": str(ObjectId())}
+            )
+        finally:
+            app.dependency_overrides.clear()
+        
+        assert response.status_code == 404
+        assert "Company not found" in response.json()["detail"]
+        mock_db.coupon_rules.find_one_and_update.assert_not_called()
     
     @pytest.mark.asyncio
     async def test_update_coupon_rule_invalid_required_coupons(self, admin_user, admin_token, sample_company, sample_coupon_rule):
@@ -261,6 +413,7 @@ class TestCouponRuleAPI:
         }
         
         mock_db = AsyncMock()
+        mock_db.coupon_rules.find_one_and_update.return_value = None
         mock_db.coupon_rules.find_one.return_value = None
         
         override_dependencies(mock_db, admin_user)
@@ -276,8 +429,8 @@ class TestCouponRuleAPI:
     @pytest.mark.asyncio
     async def test_delete_coupon_rule(self, admin_user, admin_token, sample_company, sample_coupon_rule):
         mock_db = AsyncMock()
-        mock_db.coupon_rules.find_one.return_value = sample_coupon_rule
-        mock_db.companies.find_one.return_value = sample_company
+        mock_db.coupon_rules.find_one_and_delete.return_value = sample_coupon_rule
+        company_rules.set(sample_coupon_rule["company_id"], CompiledRules([sample_coupon_rule]))
         
         override_dependencies(mock_db, admin_user)
         
@@ -287,11 +440,14 @@ class TestCouponRuleAPI:
             app.dependency_overrides.clear()
         
         assert response.status_code == 204
-        mock_db.coupon_rules.delete_one.assert_called_once()
+        mock_db.coupon_rules.find_one_and_delete.assert_called_once()
+        # Stamping and redemption must not keep evaluating the deleted rule
+        assert company_rules.get(sample_coupon_rule["company_id"]) is None
     
     @pytest.mark.asyncio
     async def test_delete_coupon_rule_not_found(self, admin_user, admin_token):
         mock_db = AsyncMock()
+        mock_db.coupon_rules.find_one_and_delete.return_value = None
         mock_db.coupon_rules.find_one.return_value = None
         
         override_dependencies(mock_db, admin_user)
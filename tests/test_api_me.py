@@ -0,0 +1,115 @@
+import pytest
+from unittest.mock import AsyncMock, Mock
+from fastapi.testclient import TestClient
+from app.main import app
+from app.models.user import User
+from app.api.me import get_db, get_current_user
+from app.core.wallets import get_wallet, wallets
+from datetime import datetime, timezone
+from bson import ObjectId
+
+client = TestClient(app)
+
+COMPANY_ID = "507f1f77bcf86cd799439013"
+
+
+class TestWalletAPI:
+
+    @pytest.fixture(autouse=True)
+    def clear_wallet_cache(self):
+        wallets.clear()
+        yield
+        wallets.clear()
+
+    @pytest.fixture
+    def holder(self):
+        return User(id="507f1f77bcf86cd799439021", email="client@example.com", name="Client", role="client")
+
+    @pytest.fixture
+    def wallet_docs(self):
+        return [
+            {
+                "_id": ObjectId("507f1f77bcf86cd799439031"),
+                "company_id": COMPANY_ID,
+                "barcode": "123456789012",
+                "count": 12,
+                "company": [{"name": "Test Cafe"}],
+                "rules": [
+                    {"_id": ObjectId("507f1f77bcf86cd799439042"), "required_coupons": 20, "reward": "Free cake"},
+                    {"_id": ObjectId("507f1f77bcf86cd799439041"), "required_coupons": 10, "reward": "Free coffee"},
+                ],
+            },
+            {
+                "_id": ObjectId("507f1f77bcf86cd799439032"),
+                "company_id": "507f1f77bcf86cd799439014",
+                "barcode": "CAFE-2",
+                "count": 1,
+                "company": [],
+                "rules": [],
+            },
+        ]
+
+    def _wallet_db(self, wallet_docs):
+        mock_db = AsyncMock()
+        cursor = Mock()
+        cursor.to_list = AsyncMock(return_value=wallet_docs)
+        mock_db.coupons.aggregate = Mock(return_value=cursor)
+        return mock_db
+
+    def test_wallet_in_one_aggregation(self, holder, wallet_docs):
+        mock_db = self._wallet_db(wallet_docs)
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_user] = lambda: holder
+
+        try:
+            response = client.get("/api/me/wallet")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        cafe, unknown = response.json()
+        assert cafe["company_name"] == "Test Cafe"
+        assert [reward["reward"] for reward in cafe["redeemable_rewards"]] == ["Free coffee"]
+        assert cafe["next_reward"]["reward"] == "Free cake"
+        assert cafe["stamps_to_next_reward"] == 8
+        assert unknown["company_name"] is None
+        assert unknown["next_reward"] is None
+        mock_db.coupons.aggregate.assert_called_once()
+        pipeline = mock_db.coupons.aggregate.call_args.args[0]
+        assert pipeline[0] == {"$match": {"client_id": holder.id}}
+        assert [stage["$lookup"]["from"] for stage in pipeline if "$lookup" in stage] == ["companies", "coupon_rules"]
+        mock_db.companies.find_one.assert_not_called()
+        mock_db.coupon_rules.find.assert_not_called()
+
+    def test_wallet_is_cached_per_client(self, holder, wallet_docs):
+        mock_db = self._wallet_db(wallet_docs)
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_user] = lambda: holder
+
+        try:
+            first = client.get("/api/me/wallet")
+            second = client.get("/api/me/wallet")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert first.json() == second.json()
+        mock_db.coupons.aggregate.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_wallet_pipeline_against_mongo(self, test_db, holder):
+        """Run the real aggregation: joins, projections and ordering."""
+        company = await test_db.companies.insert_one({"name": "Test Cafe", "admin_id": "a1"})
+        company_id = str(company.inserted_id)
+        await test_db.coupon_rules.insert_one({"company_id": company_id, "required_coupons": 5, "reward": "Free coffee"})
+        now = datetime.now(timezone.utc)
+        await test_db.coupons.insert_many([
+            {"company_id": company_id, "barcode": "A", "client_id": holder.id, "count": 6, "updated_at": now,
+             "ops": [{"key": "k", "count": 6}]},
+            {"company_id": "not-an-id", "barcode": "B", "client_id": holder.id, "count": 1, "updated_at": now},
+            {"company_id": company_id, "barcode": "A", "client_id": "someone-else", "count": 3, "updated_at": now},
+        ])
+
+        wallet = await get_wallet(test_db, holder.id)
+
+        assert [(coupon["barcode"], coupon["company_name"]) for coupon in wallet] == [("A", "Test Cafe"), ("B", None)]
+        assert wallet[0]["redeemable_rewards"][0]["reward"] == "Free coffee"
@@ -1,8 +1,11 @@
 import pytest
-from unittest.mock import AsyncMock
+from unittest.mock import ANY, AsyncMock, Mock
 from fastapi.testclient import TestClient
 from app.main import app
-from app.core.auth import verify_password, get_password_hash, create_access_token
+from app.core.auth import (
+    verify_password, get_password_hash, create_access_token,
+    verify_password_async, get_password_hash_async
+)
 from app.models.user import UserRole
 from datetime import datetime, timedelta
 
@@ -21,61 +24,227 @@ def test_create_access_token():
     assert len(token) > 0
 
 @pytest.mark.asyncio
-async def test_register_user_success(monkeypatch):
+async def test_register_user_success():
+    from app.api.auth import get_db
     mock_db = AsyncMock()
-    mock_db.users.find_one.return_value = None
     mock_db.users.insert_one.return_value = AsyncMock(inserted_id="507f1f77bcf86cd799439011")
-    mock_db.users.find_one.return_value = {
-        "_id": "507f1f77bcf86cd799439011",
-        "email": "test@example.com",
-        "name": "Test User",
-        "role": "client",
-        "hashed_password": "hashedpassword"
-    }
     
-    async def mock_get_db():
-        return mock_db
-    
-    from app.api.auth import get_db
-    monkeypatch.setattr("app.api.auth.get_db", lambda: mock_get_db())
-    
-    response = client.post(
-        "/api/auth/register",
-        json={
-            "email": "test@example.com",
-            "name": "Test User",
-            "role": "client",
-            "password": "testpassword123"
-        }
-    )
+    app.dependency_overrides[get_db] = lambda: mock_db
+    try:
+        response = client.post(
+            "/api/auth/register",
+            json={
+                "email": "test@example.com",
+                "name": "Test User",
+                "role": "client",
+                "password": "testpassword123"
+            }
+        )
+    finally:
+        app.dependency_overrides.clear()
     
     assert response.status_code == 200
     data = response.json()
+    assert data["id"] == "507f1f77bcf86cd799439011"
     assert data["email"] == "test@example.com"
     assert data["name"] == "Test User"
     assert data["role"] == "client"
     assert "password" not in data
     assert "hashed_password" not in data
+    mock_db.users.find_one.assert_not_called()
 
 @pytest.mark.asyncio
-async def test_register_user_email_exists(monkeypatch):
+async def test_register_user_email_exists():
+    from pymongo.errors import DuplicateKeyError
+    from app.api.auth import get_db
     mock_db = AsyncMock()
-    mock_db.users.find_one.return_value = {"email": "existing@example.com"}
-    
-    async def mock_get_db():
-        return mock_db
+    mock_db.users.insert_one.side_effect = DuplicateKeyError("E11000 duplicate key error")
     
-    monkeypatch.setattr("app.api.auth.get_db", lambda: mock_get_db())
-    
-    response = client.post(
-        "/api/auth/register",
-        json={
-            "email": "existing@example.com",
-            "name": "Test User",
-            "role": "client",
-            "password": "testpassword123"
-        }
-    )
+    app.dependency_overrides[get_db] = lambda: mock_db
+    try:
+        response = client.post(
+            "/api/auth/register",
+            json={
+                "email": "existing@example.com",
+                "name": "Test User",
+                "role": "client",
+                "password": "testpassword123"
+            }
+        )
+    finally:
+        app.dependency_overrides.clear()
     
     assert response.status_code == 400
-    assert "Email already registered" in response.json()["detail"]
\ No newline at end of file
+    assert "Email already registered" in response.json()["detail"]
+@pytest.mark.asyncio
+async def test_password_hashing_async():
+    password = "testpassword123"
+    hashed = await get_password_hash_async(password)
+    assert await verify_password_async(password, hashed) is True
+    assert await verify_password_async("wrongpassword", hashed) is False
+
+def _claims_token(ver=0):
+    return create_access_token(
+        {"sub": "admin@example.com", "role": "admin", "uid": "507f1f77bcf86cd799439011",
+         "name": "Admin User", "ver": ver},
+        expires_delta=timedelta(minutes=30)
+    )
+
+@pytest.mark.asyncio
+async def test_verified_claims_skip_user_lookup(monkeypatch):
+    from app.core import auth
+    monkeypatch.setattr(auth.settings, "AUTH_VERIFIED_CLAIMS", True)
+    monkeypatch.setattr(auth.token_versions, "_versions", {})
+    monkeypatch.setattr(auth.token_versions, "_loaded_at", float("inf"))
+    mock_db = AsyncMock()
+
+    user = await auth.get_current_user(_claims_token(), mock_db)
+
+    assert user.id == "507f1f77bcf86cd799439011"
+    assert user.role == UserRole.ADMIN
+    mock_db.users.find_one.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_verified_claims_reject_revoked_token(monkeypatch):
+    from fastapi import HTTPException
+    from app.core import auth
+    monkeypatch.setattr(auth.settings, "AUTH_VERIFIED_CLAIMS", True)
+    monkeypatch.setattr(auth.token_versions, "_versions", {"507f1f77bcf86cd799439011": 1})
+    monkeypatch.setattr(auth.token_versions, "_loaded_at", float("inf"))
+
+    with pytest.raises(HTTPException) as exc_info:
+        await auth.get_current_user(_claims_token(ver=0), AsyncMock())
+    assert exc_info.value.status_code == 401
+
+    user = await auth.get_current_user(_claims_token(ver=1), AsyncMock())
+    assert user.email == "admin@example.com"
+
+@pytest.mark.asyncio
+async def test_verified_claims_reject_token_of_demoted_user(monkeypatch):
+    from bson import ObjectId
+    from fastapi import HTTPException
+    from app.core import auth
+    from app.schemas.user import update_user
+    monkeypatch.setattr(auth.settings, "AUTH_VERIFIED_CLAIMS", True)
+    monkeypatch.setattr(auth.token_versions, "_versions", {})
+    monkeypatch.setattr(auth.token_versions, "_loaded_at", float("inf"))
+    old_token = _claims_token(ver=0)
+    mock_db = AsyncMock()
+    mock_db.users.find_one_and_update.return_value = {"_id": ObjectId("507f1f77bcf86cd799439011"), "token_version": 1}
+
+    assert await update_user(mock_db, "507f1f77bcf86cd799439011", {"role": UserRole.CLIENT}) is True
+
+    query, update = mock_db.users.find_one_and_update.call_args.args
+    assert query["$or"] == [{"role": {"$ne": UserRole.CLIENT}}]
+    assert update == {
+        "$inc": {"token_version": 1},
+        "$set": {"role": UserRole.CLIENT, "token_version_changed_at": ANY},
+    }
+    with pytest.raises(HTTPException) as exc_info:
+        await auth.get_current_user(old_token, AsyncMock())
+    assert exc_info.value.status_code == 401
+
+@pytest.mark.asyncio
+async def test_unchanged_claim_keeps_tokens(monkeypatch):
+    from app.core import auth
+    from app.schemas.user import update_user
+    monkeypatch.setattr(auth.token_versions, "_versions", {})
+    mock_db = AsyncMock()
+    # The role already is CLIENT, so the conditional revocation matches nothing
+    mock_db.users.find_one_and_update.return_value = None
+    mock_db.users.update_one.return_value = Mock(modified_count=0)
+
+    assert await update_user(mock_db, "507f1f77bcf86cd799439011", {"role": UserRole.CLIENT}) is False
+
+    mock_db.users.update_one.assert_awaited_once()
+    assert auth.token_versions._versions == {}
+
+@pytest.mark.asyncio
+async def test_revocation_refresh_loads_recent_changes_only(monkeypatch):
+    from app.core.revocation import TokenVersionRegistry, settings
+
+    class Cursor:
+        def __init__(self, docs):
+            self.docs = docs
+
+        async def __aiter__(self):
+            for doc in self.docs:
+                yield doc
+
+    registry = TokenVersionRegistry(refresh_seconds=30)
+    mock_db = Mock()
+    mock_db.users.find.return_value = Cursor([{"_id": "507f1f77bcf86cd799439011", "token_version": 2}])
+    mock_db.deleted_users.find.return_value = Cursor([])
+
+    assert await registry.current_version(mock_db, "507f1f77bcf86cd799439011") == 2
+
+    query = mock_db.users.find.call_args.args[0]
+    revoked_since = query["token_version_changed_at"]["$gt"]
+    expected = datetime.utcnow() - timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    assert abs((revoked_since - expected).total_seconds()) < 5
+
+@pytest.mark.asyncio
+async def test_verified_claims_reject_token_of_deleted_user(monkeypatch):
+    from bson import ObjectId
+    from fastapi import HTTPException
+    from app.core import auth
+    from app.schemas.user import delete_user
+    monkeypatch.setattr(auth.settings, "AUTH_VERIFIED_CLAIMS", True)
+    monkeypatch.setattr(auth.token_versions, "_versions", {})
+    monkeypatch.setattr(auth.token_versions, "_loaded_at", float("inf"))
+    mock_db = AsyncMock()
+    mock_db.users.find_one_and_delete.return_value = {"_id": ObjectId("507f1f77bcf86cd799439011")}
+
+    assert await delete_user(mock_db, "507f1f77bcf86cd799439011") is True
+
+    marker = mock_db.deleted_users.update_one.call_args.args[1]["$set"]
+    assert marker["token_version"] == 1
+    with pytest.raises(HTTPException) as exc_info:
+        await auth.get_current_user(_claims_token(ver=0), AsyncMock())
+    assert exc_info.value.status_code == 401
+
+@pytest.mark.asyncio
+async def test_legacy_token_falls_back_to_user_lookup(monkeypatch):
+    from app.core import auth
+    monkeypatch.setattr(auth.settings, "AUTH_VERIFIED_CLAIMS", True)
+    mock_db = AsyncMock()
+    mock_db.users.find_one.return_value = {
+        "_id": "507f1f77bcf86cd799439011",
+        "email": "admin@example.com",
+        "name": "Admin User",
+        "role": "admin",
+        "hashed_password": "hashedpassword"
+    }
+    auth.principal_cache.clear()
+    token = create_access_token({"sub": "admin@example.com", "role": "admin"})
+
+    user = await auth.get_current_user(token, mock_db)
+
+    assert user.id == "507f1f77bcf86cd799439011"
+    mock_db.users.find_one.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_principal_cache_coalesces_lookups():
+    import asyncio
+    from app.core import auth
+    auth.principal_cache.clear()
+    mock_db = AsyncMock()
+    mock_db.users.find_one.return_value = {
+        "_id": "507f1f77bcf86cd799439011",
+        "email": "admin@example.com",
+        "name": "Admin User",
+        "role": "admin",
+        "hashed_password": "hashedpassword"
+    }
+    token = create_access_token({"sub": "admin@example.com", "role": "admin"})
+
+    users = await asyncio.gather(*[auth.get_current_user(token, mock_db) for _ in range(100)])
+
+    assert all(user.id == "507f1f77bcf86cd799439011" for user in users)
+    mock_db.users.find_one.assert_called_once()
+
+    from app.core.principals import invalidate_principal
+    invalidate_principal("507f1f77bcf86cd799439011")
+    await auth.get_current_user(token, mock_db)
+    assert mock_db.users.find_one.call_count == 2
+    auth.principal_cache.clear()
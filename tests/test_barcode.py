@@ -0,0 +1,59 @@
+import pytest
+from app.utils.barcode import (
+    ALPHABET, BARCODE_LENGTH, MAX_SEQUENCE, encode_barcode, decode_barcode, barcode_company, validate_barcodes
+)
+
+COMPANY_ID = "507f1f77bcf86cd799439013"
+OTHER_COMPANY_ID = "507f1f77bcf86cd799439014"
+
+
+class TestBarcodeCodec:
+    """Test the Base32 barcode codec and its Luhn mod 32 check character."""
+
+    def test_round_trip(self):
+        """Test that company id and sequence are recovered from the code."""
+        for sequence in (0, 1, 42, MAX_SEQUENCE):
+            barcode = encode_barcode(COMPANY_ID, sequence)
+            assert len(barcode) == BARCODE_LENGTH
+            assert set(barcode) <= set(ALPHABET)
+            assert decode_barcode(barcode) == (COMPANY_ID, sequence)
+        assert decode_barcode(encode_barcode("f" * 24, MAX_SEQUENCE)) == ("f" * 24, MAX_SEQUENCE)
+
+    def test_sequence_out_of_range(self):
+        """Test that sequences beyond 32 bits are refused."""
+        with pytest.raises(ValueError):
+            encode_barcode(COMPANY_ID, MAX_SEQUENCE + 1)
+        with pytest.raises(ValueError):
+            encode_barcode(COMPANY_ID, -1)
+
+    def test_detects_every_single_character_error(self):
+        """Test that any one mistyped character is caught by the check character."""
+        barcode = encode_barcode(COMPANY_ID, 1234)
+        for position in range(BARCODE_LENGTH):
+            for char in ALPHABET.replace(barcode[position], ""):
+                assert barcode_company(barcode[:position] + char + barcode[position + 1:]) is None
+
+    def test_detects_adjacent_transpositions(self):
+        """Test that swapping two neighbouring characters is caught."""
+        barcode = encode_barcode(COMPANY_ID, 98765)
+        for position in range(BARCODE_LENGTH - 1):
+            swapped = barcode[:position] + barcode[position + 1] + barcode[position] + barcode[position + 2:]
+            if swapped != barcode:
+                assert barcode_company(swapped) is None
+
+    def test_rejects_malformed_codes(self):
+        """Test that wrong lengths, foreign characters and lowercase are invalid."""
+        barcode = encode_barcode(COMPANY_ID, 7)
+        for malformed in ("", "123456789012", barcode[:-1], barcode + "0", barcode.lower(),
+                          barcode[:-1] + "U", "٠" * BARCODE_LENGTH):
+            assert barcode_company(malformed) is None
+        with pytest.raises(ValueError):
+            decode_barcode(barcode[:-1])
+
+    def test_validate_barcodes(self):
+        """Test batch validation, including codes that contain the batch separator."""
+        good = encode_barcode(COMPANY_ID, 1)
+        other = encode_barcode(OTHER_COMPANY_ID, 1)
+        assert validate_barcodes([]) == []
+        assert validate_barcodes([good, "nope", other]) == [COMPANY_ID, None, OTHER_COMPANY_ID]
+        assert validate_barcodes([good, good[:10] + "\n" + good[10:], other]) == [COMPANY_ID, None, OTHER_COMPANY_ID]
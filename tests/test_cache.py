@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+from app.utils.cache import AsyncTTLCache
+
+
+@pytest.mark.asyncio
+class TestAsyncTTLCache:
+    """Test the TTL + LRU cache with single-flight loading."""
+
+    async def test_get_set_and_counters(self):
+        """Test basic hits and misses are counted."""
+        cache = AsyncTTLCache(maxsize=10, ttl=60)
+        assert cache.get("a") is None
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_ratio"] == 0.5
+
+    async def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted first."""
+        cache = AsyncTTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert cache.evictions == 1
+
+    async def test_ttl_expiry(self):
+        """Test that expired entries are treated as misses."""
+        cache = AsyncTTLCache(maxsize=10, ttl=0)
+        cache.set("a", 1)
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    async def test_single_flight_load(self):
+        """Test that concurrent loads of one key run the loader once."""
+        cache = AsyncTTLCache(maxsize=10, ttl=60)
+        calls = 0
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "value"
+
+        results = await asyncio.gather(*[cache.get_or_load("k", loader) for _ in range(50)])
+
+        assert results == ["value"] * 50
+        assert calls == 1
+        assert cache.loads == 1
+        assert await cache.get_or_load("k", loader) == "value"
+        assert calls == 1
+
+    async def test_none_is_not_cached(self):
+        """Test that a loader returning None is retried next time."""
+        cache = AsyncTTLCache(maxsize=10, ttl=60)
+
+        async def loader():
+            return None
+
+        assert await cache.get_or_load("k", loader) is None
+        assert await cache.get_or_load("k", loader) is None
+        assert cache.loads == 2
+
+    async def test_invalidate_during_load_discards_result(self):
+        """Test that an invalidation racing a load prevents stale repopulation."""
+        cache = AsyncTTLCache(maxsize=10, ttl=60)
+        release = asyncio.Event()
+
+        async def loader():
+            await release.wait()
+            return "stale"
+
+        pending = asyncio.ensure_future(cache.get_or_load("k", loader))
+        await asyncio.sleep(0)
+        cache.invalidate("k")
+        release.set()
+
+        assert await pending == "stale"
+        assert cache.get("k") is None
+
+    async def test_invalidate_where(self):
+        """Test predicate-based invalidation."""
+        cache = AsyncTTLCache(maxsize=10, ttl=60)
+        cache.set("a", {"id": 1})
+        cache.set("b", {"id": 2})
+
+        cache.invalidate_where(lambda value: value["id"] == 1)
+
+        assert cache.get("a") is None
+        assert cache.get("b") == {"id": 2}
@@ -0,0 +1,65 @@
+import struct
+import zlib
+import pytest
+from app.utils.code128 import _PATTERNS, QUIET_ZONE, BAR_HEIGHT, symbols, modules, render_png, render_svg
+
+
+def decode(widths):
+    """Read symbol values back from bar/space widths."""
+    lookup = {pattern: value for value, pattern in enumerate(_PATTERNS)}
+    digits = "".join(map(str, widths))
+    return [lookup[digits[i:i + 6]] for i in range(0, len(digits) - 7, 6)]
+
+
+class TestCode128:
+    """Test the Code 128 encoder and renderers."""
+
+    def test_pattern_table(self):
+        """Test the symbol table's widths and parity rules."""
+        assert len(set(_PATTERNS)) == 107
+        for value, pattern in enumerate(_PATTERNS):
+            widths = [int(width) for width in pattern]
+            assert sum(widths) == (13 if value == 106 else 11)
+            # Bars always add up to an even number of modules
+            assert sum(widths[0:6:2]) % 2 == 0
+
+    def test_code_set_b_with_check_symbol(self):
+        """Test text in code set B, ending in the mod 103 check symbol."""
+        assert symbols("PJJ123C") == [104, 48, 42, 42, 17, 18, 19, 35, 55]
+
+    def test_even_digit_runs_use_code_set_c(self):
+        """Test that all-digit barcodes pack two digits per symbol."""
+        assert symbols("123456") == [105, 12, 34, 56, 44]
+        assert symbols("12345")[0] == 104
+
+    def test_modules_round_trip(self):
+        """Test that the bar widths decode to the same symbols."""
+        assert decode(modules("2GFWFQFF7RDKBSJGWG2800001A9")) == symbols("2GFWFQFF7RDKBSJGWG2800001A9")
+
+    def test_rejects_unencodable(self):
+        """Test that empty and non-ASCII input is refused."""
+        for data in ("", "café", "tab\there"):
+            with pytest.raises(ValueError):
+                symbols(data)
+
+    def test_svg_bars(self):
+        """Test that the SVG draws one rect per bar at the requested scale."""
+        svg = render_svg("CAFE-42", scale=3).decode("ascii")
+        bars = len(modules("CAFE-42")) // 2 + 1
+        assert svg.count("<rect x=") == bars
+        assert f'height="{BAR_HEIGHT * 3}"' in svg
+
+    def test_png_pixels(self):
+        """Test the PNG header and that its first row matches the bar pattern."""
+        png = render_png("CAFE-42", scale=2)
+        assert png[:8] == b"\x89PNG\r\n\x1a\n"
+        width, height = struct.unpack(">II", png[16:24])
+        total_modules = sum(modules("CAFE-42")) + 2 * QUIET_ZONE
+        assert (width, height) == (total_modules * 2, BAR_HEIGHT * 2)
+        idat_length = struct.unpack(">I", png[33:37])[0]
+        raw = zlib.decompress(png[41:41 + idat_length])
+        row = raw[:1 + (width + 7) // 8]
+        bits = bin(int.from_bytes(row[1:], "big"))[2:].zfill(len(row[1:]) * 8)[:width]
+        # Quiet zone is white, then the start code's first bar (2 modules) is black
+        assert bits[:QUIET_ZONE * 2] == "1" * QUIET_ZONE * 2
+        assert bits[QUIET_ZONE * 2:QUIET_ZONE * 2 + 4] == "0000"
@@ -0,0 +1,202 @@
+import asyncio
+import contextvars
+import json
+import logging
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.main import app
+from app.core.metrics import DbTimingMiddleware
+from app.db import (
+    CommandStatsListener, PoolStatsListener, RequestDbTime, client_options, current_db_time, get_reporting_db, redact,
+)
+from app.config import settings
+
+client = TestClient(app)
+
+
+def test_client_options_drop_unset_values(monkeypatch):
+    monkeypatch.setattr(settings, "MONGODB_MAX_POOL_SIZE", 20)
+    monkeypatch.setattr(settings, "MONGODB_MIN_POOL_SIZE", 5)
+    monkeypatch.setattr(settings, "MONGODB_MAX_IDLE_TIME_MS", None)
+    monkeypatch.setattr(settings, "MONGODB_WAIT_QUEUE_TIMEOUT_MS", 2000)
+    monkeypatch.setattr(settings, "MONGODB_COMPRESSORS", "")
+
+    options = client_options()
+
+    assert options["maxPoolSize"] == 20
+    assert options["minPoolSize"] == 5
+    assert options["waitQueueTimeoutMS"] == 2000
+    assert "maxIdleTimeMS" not in options
+    assert "compressors" not in options
+
+
+def test_client_options_are_accepted_by_driver(monkeypatch):
+    monkeypatch.setattr(settings, "MONGODB_COMPRESSORS", "zlib")
+    monkeypatch.setattr(settings, "MONGODB_READ_PREFERENCE", "secondaryPreferred")
+
+    mongo_client = AsyncIOMotorClient("mongodb://localhost:27017", connect=False, **client_options())
+    try:
+        assert mongo_client.options.pool_options.max_pool_size == settings.MONGODB_MAX_POOL_SIZE
+        assert mongo_client.read_preference.mongos_mode == "secondaryPreferred"
+    finally:
+        mongo_client.close()
+
+
+def test_pool_stats_listener_tracks_checkouts():
+    listener = PoolStatsListener()
+    listener.connection_created(None)
+    listener.connection_check_out_started(None)
+    listener.connection_check_out_started(None)
+    listener.connection_checked_out(None)
+    listener.connection_check_out_failed(None)
+
+    stats = listener.stats()
+    assert stats["open_connections"] == 1
+    assert stats["checked_out"] == 1
+    assert stats["wait_queue"] == 0
+    assert stats["checkout_failures"] == 1
+
+    listener.connection_checked_in(None)
+    assert listener.stats()["checked_out"] == 0
+
+
+def test_db_pool_endpoint():
+    response = client.get("/health/db-pool")
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["max_pool_size"] == settings.MONGODB_MAX_POOL_SIZE
+    assert "checked_out" in data
+    assert "wait_queue" in data
+
+
+@pytest.mark.asyncio
+async def test_reporting_db_keeps_overridden_database():
+    mock_db = AsyncMock()
+    assert await get_reporting_db(mock_db) is mock_db
+
+
+def test_list_endpoints_read_from_reporting_db(monkeypatch):
+    from app.core.auth import get_current_admin
+    from app.db import db
+    from app.models.user import User
+    admin = User(id="507f1f77bcf86cd799439011", email="admin@example.com", name="Admin", role="admin")
+    primary, reporting = AsyncMock(), AsyncMock()
+    reporting.companies.find_one.return_value = None
+    monkeypatch.setattr(db, "database", primary)
+    monkeypatch.setattr(db, "reporting_database", reporting)
+    app.dependency_overrides[get_current_admin] = lambda: admin
+    try:
+        for path in ("/api/companies/507f1f77bcf86cd799439012/coupons",
+                     "/api/coupon-rules/company/507f1f77bcf86cd799439012"):
+            assert client.get(path).status_code == 404
+    finally:
+        app.dependency_overrides.clear()
+
+    assert reporting.companies.find_one.await_count == 2
+    primary.companies.find_one.assert_not_called()
+
+
+def command_events(request_id, name, command, micros, database="coupon_api"):
+    started = SimpleNamespace(
+        command=command, command_name=name, connection_id=("localhost", 27017), request_id=request_id,
+        database_name=database,
+    )
+    finished = SimpleNamespace(
+        command_name=name, connection_id=("localhost", 27017), request_id=request_id, database_name=database,
+        duration_micros=micros,
+    )
+    return started, finished
+
+
+def test_redact_keeps_filter_shape():
+    shape = redact({"company_id": "c1", "count": {"$gte": 5}, "barcode": {"$in": ["a", "b", "c"]},
+                    "$or": [{"a": 1}, {"a": 2}, {"b": 3}]})
+
+    assert shape == {"company_id": "?", "count": {"$gte": "?"}, "barcode": {"$in": ["?"]},
+                     "$or": [{"a": "?"}, {"b": "?"}]}
+
+
+def test_command_listener_charges_the_current_request(monkeypatch):
+    monkeypatch.setattr(settings, "MONGODB_SLOW_COMMAND_MS", 100)
+    listener = CommandStatsListener()
+    db_time = RequestDbTime({"method": "GET", "path": "/api/coupons"})
+    token = current_db_time.set(db_time)
+    try:
+        for request_id, micros in ((1, 1500), (2, 2500)):
+            started, finished = command_events(request_id, "find", {"find": "coupons", "filter": {}}, micros)
+            listener.started(started)
+            listener.succeeded(finished)
+    finally:
+        current_db_time.reset(token)
+    # Outside a request the command is still counted, just not charged to anyone
+    started, finished = command_events(3, "insert", {"insert": "coupons"}, 1000)
+    listener.started(started)
+    listener.failed(finished)
+
+    assert db_time.count == 2
+    assert db_time.seconds == pytest.approx(0.004)
+    assert listener.stats()["commands"] == {"find": (2, pytest.approx(0.004)), "insert": (1, pytest.approx(0.001))}
+    assert listener._pending == {}
+
+
+def test_slow_commands_are_logged_redacted(monkeypatch, caplog):
+    monkeypatch.setattr(settings, "MONGODB_SLOW_COMMAND_MS", 100)
+    listener = CommandStatsListener()
+    token = current_db_time.set(RequestDbTime({"method": "PATCH", "path": "/api/coupons/CAFE-1"}))
+    try:
+        fast = command_events(1, "find", {"find": "coupons", "filter": {"barcode": "CAFE-1"}}, 99000)
+        slow = command_events(2, "update", {"update": "coupons", "updates": [{"q": {"barcode": "CAFE-1"}, "u": {}}]},
+                              250000)
+        with caplog.at_level(logging.WARNING, logger="app.db"):
+            for started, finished in (fast, slow):
+                listener.started(started)
+                listener.succeeded(finished)
+    finally:
+        current_db_time.reset(token)
+
+    assert len(caplog.records) == 1
+    assert json.loads(caplog.records[0].getMessage()) == {
+        "event": "slow_mongo_command",
+        "command": "update",
+        "database": "coupon_api",
+        "collection": "coupons",
+        "duration_ms": 250.0,
+        "request": "PATCH /api/coupons/CAFE-1",
+        "filter": [{"barcode": "?"}],
+    }
+    assert listener.stats()["slow_commands"] == 1
+
+
+def test_server_timing_header():
+    listener = CommandStatsListener()
+    timed_app = FastAPI()
+
+    def driver_call(request_id):
+        started, finished = command_events(request_id, "find", {"find": "coupons", "filter": {}}, 2000)
+        listener.started(started)
+        listener.succeeded(finished)
+
+    @timed_app.get("/timed")
+    async def timed():
+        # The way Motor runs driver calls: on a thread, in a copy of the caller's context
+        loop = asyncio.get_running_loop()
+        for request_id in (1, 2, 3):
+            await loop.run_in_executor(None, contextvars.copy_context().run, driver_call, request_id)
+        return {}
+
+    timed_app.add_middleware(DbTimingMiddleware)
+
+    response = TestClient(timed_app).get("/timed")
+
+    assert response.headers["server-timing"] == "db;dur=6.0;count=3"
+
+
+def test_server_timing_header_without_queries():
+    response = client.get("/health")
+
+    assert response.headers["server-timing"] == "db;dur=0.0;count=0"
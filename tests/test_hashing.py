@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import pytest
+from fastapi import HTTPException
+from app.core.hashing import HashingPool, HashingPoolFull
+
+
+@pytest.mark.asyncio
+class TestHashingPool:
+    """Test the bounded password hashing pool."""
+
+    async def test_run_returns_result_and_records_timings(self):
+        """Test that jobs run on the pool and their timings are recorded."""
+        pool = HashingPool(max_workers=2, max_queue=2)
+        try:
+            result = await pool.run(lambda a, b: a + b, 2, 3)
+            await asyncio.sleep(0)
+        finally:
+            pool.shutdown()
+
+        assert result == 5
+        stats = pool.stats()
+        assert stats["completed"] == 1
+        assert stats["rejected"] == 0
+        assert stats["in_flight"] == 0
+        assert stats["hash_seconds_total"] >= 0
+
+    async def test_rejects_when_queue_is_full(self):
+        """Test that jobs beyond workers + queue are rejected."""
+        pool = HashingPool(max_workers=1, max_queue=1)
+        gate = threading.Event()
+        try:
+            first = asyncio.ensure_future(pool.run(gate.wait))
+            second = asyncio.ensure_future(pool.run(gate.wait))
+            await asyncio.sleep(0)
+
+            with pytest.raises(HashingPoolFull):
+                await pool.run(gate.wait)
+            assert pool.stats()["queued"] == 1
+            assert pool.stats()["rejected"] == 1
+
+            gate.set()
+            await asyncio.gather(first, second)
+        finally:
+            gate.set()
+            pool.shutdown()
+
+    async def test_job_exception_propagates(self):
+        """Test that errors raised by the job reach the caller."""
+        pool = HashingPool(max_workers=1, max_queue=0)
+
+        def boom():
+            raise ValueError("bad hash")
+
+        try:
+            with pytest.raises(ValueError):
+                await pool.run(boom)
+        finally:
+            pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_async_helpers_map_full_pool_to_503(monkeypatch):
+    from app.core import auth
+
+    async def full(*args):
+        raise HashingPoolFull()
+
+    monkeypatch.setattr(auth.hashing_pool, "run", full)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await auth.get_password_hash_async("password123")
+
+    assert exc_info.value.status_code == 503
+    assert exc_info.value.headers["Retry-After"] == "1"
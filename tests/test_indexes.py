@@ -0,0 +1,66 @@
+import pytest
+from unittest.mock import AsyncMock
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from app.indexes import INDEXES, diff_indexes, ensure_indexes
+
+
+@pytest.mark.asyncio
+class TestIndexes:
+    """Test the index registry against a live database."""
+
+    async def test_ensure_indexes_is_idempotent(self, test_db):
+        """Test that applying the registry twice leaves nothing missing."""
+        await ensure_indexes(test_db)
+        await ensure_indexes(test_db)
+
+        report = await diff_indexes(test_db)
+        for collection in INDEXES:
+            assert report[collection]["missing"] == []
+            assert report[collection]["extra"] == []
+
+    async def test_unique_user_email(self, test_db):
+        """Test that the users.email index rejects duplicates."""
+        await ensure_indexes(test_db)
+        await test_db.users.insert_one({"email": "test@example.com"})
+
+        with pytest.raises(DuplicateKeyError):
+            await test_db.users.insert_one({"email": "test@example.com"})
+
+    async def test_diff_reports_missing_and_extra(self):
+        """Test the dry-run report without a database."""
+        mock_db = AsyncMock()
+        mock_db.__getitem__.return_value.index_information = AsyncMock(
+            side_effect=lambda: {
+                "_id_": {"key": [("_id", 1)]},
+                "legacy_name": {"key": [("name", 1)]},
+            }
+        )
+
+        report = await diff_indexes(mock_db)
+
+        assert report["users"]["missing"] == ["email_unique", "token_version_changed_at"]
+        assert report["users"]["extra"] == ["legacy_name"]
+
+    async def test_missing_unique_index_stops_startup(self):
+        """Test that a unique index that fails to build is fatal, not just logged."""
+        mock_db = AsyncMock()
+        collection = mock_db.__getitem__.return_value
+        collection.create_indexes = AsyncMock(side_effect=OperationFailure("E11000 duplicate key error"))
+        collection.index_information = AsyncMock(return_value={"_id_": {"key": [("_id", 1)]}})
+
+        with pytest.raises(RuntimeError, match="email_unique"):
+            await ensure_indexes(mock_db)
+
+    async def test_failed_secondary_index_is_logged(self, caplog):
+        """Test that startup continues when only non-unique indexes are missing."""
+        mock_db = AsyncMock()
+        collection = mock_db.__getitem__.return_value
+        collection.create_indexes = AsyncMock(side_effect=OperationFailure("Index build failed"))
+        collection.index_information = AsyncMock(return_value={
+            model.document["name"]: model.document
+            for models in INDEXES.values() for model in models if model.document.get("unique")
+        })
+
+        await ensure_indexes(mock_db)
+
+        assert "Could not create indexes on users" in caplog.text
@@ -0,0 +1,234 @@
+import asyncio
+import os
+import pytest
+from unittest.mock import AsyncMock
+from bson import ObjectId
+from datetime import datetime, timezone
+from app.config import settings
+from app.ledger import (
+    EventWriter, _event_upsert, coupon_event, compact_coupon_events, ledger_count, rebuild_counts
+)
+from app.models.coupon_event import CouponEventType
+
+COMPANY_ID = "507f1f77bcf86cd799439012"
+ACTOR_ID = "507f1f77bcf86cd799439011"
+
+
+def stamp_event(coupon_id, delta=1):
+    return coupon_event(coupon_id, COMPANY_ID, CouponEventType.STAMP, delta, ACTOR_ID, "till-1")
+
+
+def writer(journal_dir, **kwargs):
+    options = {"batch_size": 10, "flush_interval_ms": 60000}
+    options.update(kwargs)
+    return EventWriter(str(journal_dir), **options)
+
+
+def written_ids(mock_db):
+    return [
+        [op._filter["_id"] for op in call.args[0]]
+        for call in mock_db.coupon_events.bulk_write.call_args_list
+    ]
+
+
+async def store(test_db, *events):
+    await test_db.coupon_events.bulk_write([_event_upsert(event) for event in events])
+
+
+@pytest.mark.asyncio
+class TestEventWriter:
+    """Test journaled, batched ledger writes."""
+
+    async def test_flush_writes_in_batches(self, tmp_path):
+        """Test that buffered events are written with one bulk upsert per batch."""
+        mock_db = AsyncMock()
+        events = writer(tmp_path, batch_size=2)
+        await events.start(mock_db)
+        recorded = [stamp_event("c1") for _ in range(3)]
+        events.record(recorded)
+
+        await events._flush_task
+        await events.flush()
+
+        assert written_ids(mock_db) == [[event["_id"] for event in recorded[:2]], [recorded[2]["_id"]]]
+        assert events.stats()["written"] == 3
+        await events.stop()
+        assert os.listdir(tmp_path / "worker-0") == ["lock"]
+
+    async def test_seq_comes_from_the_server_and_survives_replays(self, tmp_path):
+        """Test that events are upserted with the server's clock as seq, kept on a replay."""
+        mock_db = AsyncMock()
+        events = writer(tmp_path)
+        await events.start(mock_db)
+        events.record([coupon_event("c1", COMPANY_ID, CouponEventType.STAMP, 1, ACTOR_ID, "$till")])
+
+        await events.flush()
+
+        [operation] = mock_db.coupon_events.bulk_write.call_args.args[0]
+        [stage] = operation._doc
+        assert stage["$set"]["seq"] == {"$ifNull": ["$seq", "$$NOW"]}
+        assert stage["$set"]["pos_id"] == {"$literal": "$till"}
+        assert operation._upsert is True
+        await events.stop()
+
+    async def test_failed_batch_is_kept(self, tmp_path):
+        """Test that a failed batch stays journaled for the next flush."""
+        mock_db = AsyncMock()
+        events = writer(tmp_path)
+        await events.start(mock_db)
+        mock_db.coupon_events.bulk_write.side_effect = [Exception("network"), None]
+        recorded = [stamp_event("c1"), stamp_event("c2")]
+        events.record(recorded)
+
+        with pytest.raises(Exception):
+            await events.flush()
+        assert events.stats()["sealed_segments"] == 1
+        await events.flush()
+
+        assert written_ids(mock_db) == [[event["_id"] for event in recorded]] * 2
+        assert events.stats() == {"buffered": 0, "sealed_segments": 0, "written": 2, "batches": 1, "failures": 1}
+        await events.stop()
+
+    async def test_memory_holds_at_most_one_batch(self, tmp_path):
+        """Test that full batches wait on disk while MongoDB is unreachable."""
+        mock_db = AsyncMock()
+        events = writer(tmp_path, batch_size=2)
+        await events.start(mock_db)
+        mock_db.coupon_events.bulk_write.side_effect = Exception("network")
+
+        for _ in range(7):
+            events.record([stamp_event("c1")])
+
+        assert events.stats()["buffered"] == 1
+        assert events.stats()["sealed_segments"] == 3
+        with pytest.raises(Exception):
+            await events._flush_task
+
+    async def test_journal_replayed_after_crash(self, tmp_path):
+        """Test that events journaled by a crashed process are written on startup."""
+        crashed = writer(tmp_path)
+        await crashed.start(AsyncMock())
+        recorded = [stamp_event("c1"), stamp_event("c2")]
+        crashed.record(recorded)
+        # Simulate a torn write from the crash
+        os.write(crashed._fd, b'{"_id": ')
+        os.close(crashed._fd)
+        os.close(crashed._slot_fd)
+
+        mock_db = AsyncMock()
+        restarted = writer(tmp_path)
+        await restarted.start(mock_db)
+
+        assert written_ids(mock_db) == [[event["_id"] for event in recorded]]
+        await restarted.stop()
+        assert os.listdir(tmp_path / "worker-0") == ["lock"]
+
+    async def test_abandoned_slot_is_replayed(self, tmp_path):
+        """Test that a slot no process holds is written by the next process to start."""
+        crashed = [writer(tmp_path), writer(tmp_path)]
+        for events in crashed:
+            await events.start(AsyncMock())
+        recorded = [stamp_event("c1")]
+        crashed[1].record(recorded)
+        for events in crashed:
+            os.close(events._fd)
+            os.close(events._slot_fd)
+
+        mock_db = AsyncMock()
+        restarted = writer(tmp_path)
+        await restarted.start(mock_db)
+
+        assert restarted.journal_dir == str(tmp_path / "worker-0")
+        assert written_ids(mock_db) == [[recorded[0]["_id"]]]
+        await restarted.stop()
+
+    async def test_rebuild_refuses_with_unwritten_journal(self, tmp_path, monkeypatch):
+        """Test that counts are not rebuilt while journaled events are missing from the ledger."""
+        crashed = writer(tmp_path)
+        await crashed.start(AsyncMock())
+        crashed.record([stamp_event("c1")])
+        monkeypatch.setattr(settings, "LEDGER_JOURNAL_DIR", str(tmp_path))
+        mock_db = AsyncMock()
+
+        with pytest.raises(RuntimeError):
+            await rebuild_counts(mock_db)
+
+        mock_db.coupons.update_one.assert_not_called()
+        await crashed.stop()
+
+
+@pytest.mark.asyncio
+class TestLedgerCompaction:
+    """Test snapshot compaction and count rebuilds against a live database."""
+
+    async def _coupon(self, test_db, count=0, **extra):
+        result = await test_db.coupons.insert_one({
+            "company_id": COMPANY_ID,
+            "barcode": "123456789012",
+            "client_id": str(ObjectId()),
+            "count": count,
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc),
+            **extra,
+        })
+        return str(result.inserted_id)
+
+    async def test_compaction_is_idempotent(self, test_db):
+        """Test that events are folded into snapshots exactly once."""
+        coupon_id = await self._coupon(test_db, count=4)
+        await store(test_db, stamp_event(coupon_id, 3), stamp_event(coupon_id))
+
+        assert await compact_coupon_events(test_db, lag_seconds=-1) == 1
+        await compact_coupon_events(test_db, lag_seconds=-1)
+
+        coupon = await test_db.coupons.find_one({"_id": ObjectId(coupon_id)})
+        assert coupon["snapshot"]["count"] == 4
+        assert await ledger_count(test_db, coupon_id) == 4
+
+    async def test_interrupted_window_is_replayed_once(self, test_db):
+        """Test that a claimed but unfinished window is completed without double counting."""
+        coupon_id = await self._coupon(test_db)
+        await store(test_db, stamp_event(coupon_id, 2))
+        await compact_coupon_events(test_db, lag_seconds=-1)
+        # Crash after applying the window but before advancing the checkpoint
+        state = await test_db.ledger_state.find_one({"_id": "compactor"})
+        snapshot_upto = (await test_db.coupons.find_one({"_id": ObjectId(coupon_id)}))["snapshot"]["upto"]
+        await test_db.ledger_state.update_one(
+            {"_id": "compactor"},
+            {"$set": {"upto": datetime(1970, 1, 1, tzinfo=timezone.utc), "pending_to": state["upto"]}}
+        )
+        assert snapshot_upto == state["upto"]
+
+        await compact_coupon_events(test_db, lag_seconds=-1)
+
+        assert await ledger_count(test_db, coupon_id) == 2
+
+    async def test_rebuild_counts(self, test_db):
+        """Test that a corrupted count is rebuilt from snapshot plus later events."""
+        upto = datetime.now(timezone.utc)
+        coupon_id = await self._coupon(test_db, count=99, snapshot={"count": 10, "upto": upto})
+        # Already folded into the snapshot
+        await test_db.coupon_events.insert_one({**stamp_event(coupon_id, 10), "seq": datetime(2020, 1, 1)})
+        await store(
+            test_db,
+            coupon_event(coupon_id, COMPANY_ID, CouponEventType.REDEEM, -10, ACTOR_ID),
+            stamp_event(coupon_id),
+        )
+
+        await rebuild_counts(test_db)
+
+        assert (await test_db.coupons.find_one({"_id": ObjectId(coupon_id)}))["count"] == 1
+
+    async def test_event_retried_after_its_window_is_folded(self, test_db):
+        """Test that an event recorded before a window but written after it is still counted."""
+        coupon_id = await self._coupon(test_db)
+        late = stamp_event(coupon_id, 2)
+        await store(test_db, stamp_event(coupon_id))
+        await compact_coupon_events(test_db, lag_seconds=0)
+
+        await store(test_db, late)
+
+        assert await ledger_count(test_db, coupon_id) == 3
+        await asyncio.sleep(0.01)
+        await compact_coupon_events(test_db, lag_seconds=0)
+        assert (await test_db.coupons.find_one({"_id": ObjectId(coupon_id)}))["snapshot"]["count"] == 3
@@ -0,0 +1,147 @@
+import os
+import time
+import pytest
+from unittest.mock import AsyncMock
+from fastapi.testclient import TestClient
+from app.main import app
+from app.core import metrics as metrics_module
+from app.core.metrics import MetricsRegistry, RequestMetrics, _dump, render, request_metrics
+from app.core.auth import get_current_admin
+from app.db import get_db
+from app.models.user import User
+
+client = TestClient(app)
+
+
+def sample(families, name, **labels):
+    for _, _, samples in families.values():
+        if (name, tuple(labels.items())) in samples:
+            return samples[name, tuple(labels.items())]
+    return None
+
+
+class TestRequestMetrics:
+    """Test request counting and latency histograms."""
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test that each bucket counts every request at or below its bound."""
+        requests = RequestMetrics(buckets=(0.1, 1.0))
+        for seconds in (0.05, 0.1, 0.5, 3.0):
+            requests.observe("GET", "/api/things/{id}", 200, seconds)
+        requests.observe("GET", "/api/things/{id}", 404, 0.01)
+
+        families = requests.families()
+        labels = {"method": "GET", "route": "/api/things/{id}"}
+
+        bucket = "coupon_api_request_duration_seconds_bucket"
+        assert sample(families, bucket, **labels, le="0.1") == 3
+        assert sample(families, bucket, **labels, le="1.0") == 4
+        assert sample(families, bucket, **labels, le="+Inf") == 5
+        assert sample(families, "coupon_api_request_duration_seconds_count", **labels) == 5
+        assert sample(families, "coupon_api_request_duration_seconds_sum", **labels) == pytest.approx(3.66)
+        assert sample(families, "coupon_api_requests_total", **labels, status="200") == 4
+        assert sample(families, "coupon_api_requests_total", **labels, status="404") == 1
+
+    def test_render(self):
+        """Test the text exposition format, including label escaping."""
+        requests = RequestMetrics(buckets=(1.0,))
+        requests.observe("GET", 'odd "route"\n', 200, 0.5)
+
+        text = render(requests.families())
+
+        assert "# TYPE coupon_api_requests_total counter\n" in text
+        assert '# TYPE coupon_api_request_duration_seconds histogram\n' in text
+        assert 'coupon_api_requests_total{method="GET",route="odd \\"route\\"\\n",status="200"} 1\n' in text
+        assert 'coupon_api_request_duration_seconds_sum{method="GET",route="odd \\"route\\"\\n"} 0.5\n' in text
+        assert "coupon_api_requests_in_flight 0\n" in text
+
+
+class TestMetricsEndpoint:
+    """Test the middleware and the /metrics endpoint."""
+
+    def test_requests_are_labelled_by_route_template(self):
+        """Test that two rule ids land in one series and unknown paths in another."""
+        admin = User(id="507f1f77bcf86cd799439011", email="admin@example.com", name="Admin", role="admin")
+        mock_db = AsyncMock()
+        mock_db.coupon_rules.find_one.return_value = None
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin
+        key = ("GET", "/api/coupon-rules/{rule_id}", "404")
+        before = request_metrics.requests.get(key, 0)
+        unmatched_before = request_metrics.requests.get(("GET", "unmatched", "404"), 0)
+        try:
+            client.get("/api/coupon-rules/507f1f77bcf86cd799439021")
+            client.get("/api/coupon-rules/507f1f77bcf86cd799439022")
+            client.get("/no/such/path")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert request_metrics.requests[key] == before + 2
+        assert request_metrics.requests[("GET", "unmatched", "404")] == unmatched_before + 1
+
+    def test_metrics_endpoint(self):
+        """Test that /metrics serves request, pool and cache metrics."""
+        client.get("/health")
+
+        response = client.get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert 'coupon_api_requests_total{method="GET",route="/health",status="200"}' in response.text
+        assert "coupon_api_hashing_pool_queued " in response.text
+        assert "coupon_api_mongo_pool_checked_out " in response.text
+        assert 'coupon_api_cache_hit_ratio{cache="wallets"}' in response.text
+
+
+class TestMultiprocessMetrics:
+    """Test adding up the snapshots of several workers."""
+
+    def _worker_file(self, directory, name, requests):
+        path = os.path.join(directory, name)
+        with open(path, "w") as snapshot:
+            snapshot.write(_dump(requests.families()))
+        return path
+
+    def test_collect_sums_workers(self, tmp_path, monkeypatch):
+        """Test that counters add up and a stale worker's gauges are dropped."""
+        monkeypatch.setattr(metrics_module, "runtime_families", lambda: {})
+        local = RequestMetrics()
+        local.observe("GET", "/health", 200, 0.01)
+        local.in_flight = 1
+        other = RequestMetrics()
+        other.observe("GET", "/health", 200, 0.02)
+        other.in_flight = 4
+        gone = RequestMetrics()
+        gone.observe("GET", "/health", 200, 0.03)
+        gone.in_flight = 9
+        self._worker_file(tmp_path, "1001.json", other)
+        stale = self._worker_file(tmp_path, "1002.json", gone)
+        os.utime(stale, (time.time() - 60, time.time() - 60))
+        registry = MetricsRegistry(local, directory=str(tmp_path), flush_seconds=5)
+
+        families = registry.collect()
+
+        assert os.path.exists(tmp_path / f"{os.getpid()}.json")
+        labels = {"method": "GET", "route": "/health"}
+        assert sample(families, "coupon_api_requests_total", **labels, status="200") == 3
+        assert sample(families, "coupon_api_request_duration_seconds_sum", **labels) == pytest.approx(0.06)
+        assert sample(families, "coupon_api_requests_in_flight") == 5
+
+    def test_hit_ratio_from_summed_counts(self, tmp_path):
+        """Test that the hit ratio is computed from the totals, not averaged."""
+        registry = MetricsRegistry(RequestMetrics(), directory=str(tmp_path))
+        families = {
+            "coupon_api_cache_hits_total": ("counter", "", {("coupon_api_cache_hits_total", (("cache", "c"),)): 9}),
+            "coupon_api_cache_misses_total": ("counter", "", {("coupon_api_cache_misses_total", (("cache", "c"),)): 1}),
+        }
+        other = tmp_path / "1001.json"
+        other.write_text(_dump(families))
+        mine = {
+            "coupon_api_cache_hits_total": ("counter", "", {("coupon_api_cache_hits_total", (("cache", "c"),)): 0}),
+            "coupon_api_cache_misses_total": ("counter", "", {("coupon_api_cache_misses_total", (("cache", "c"),)): 10}),
+        }
+        registry.local_families = lambda: mine
+
+        families = registry.collect()
+
+        assert sample(families, "coupon_api_cache_hit_ratio", cache="c") == pytest.approx(0.45)
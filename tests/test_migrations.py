@@ -0,0 +1,63 @@
+import pytest
+from bson import ObjectId
+from datetime import datetime, timezone
+from app.migrations import backfill_coupon_rule_admin_ids, order_coupon_events_by_seq, seed_coupon_snapshots
+
+
+@pytest.mark.asyncio
+class TestMigrations:
+    """Test data migrations against a live database."""
+
+    async def test_backfill_coupon_rule_admin_ids(self, test_db):
+        """Test that legacy rules get their company's admin_id."""
+        company_id = ObjectId()
+        await test_db.companies.insert_one({"_id": company_id, "name": "Test Cafe", "admin_id": "admin-1"})
+        legacy = await test_db.coupon_rules.insert_one(
+            {"company_id": str(company_id), "required_coupons": 10, "reward": "Free coffee"}
+        )
+        stamped = await test_db.coupon_rules.insert_one(
+            {"company_id": str(company_id), "required_coupons": 5, "reward": "Cake", "admin_id": "admin-1"}
+        )
+        orphan = await test_db.coupon_rules.insert_one(
+            {"company_id": "not-an-object-id", "required_coupons": 5, "reward": "Cake"}
+        )
+
+        await backfill_coupon_rule_admin_ids(test_db)
+        await backfill_coupon_rule_admin_ids(test_db)
+
+        assert (await test_db.coupon_rules.find_one({"_id": legacy.inserted_id}))["admin_id"] == "admin-1"
+        assert (await test_db.coupon_rules.find_one({"_id": stamped.inserted_id}))["admin_id"] == "admin-1"
+        assert "admin_id" not in await test_db.coupon_rules.find_one({"_id": orphan.inserted_id})
+        assert await test_db.coupon_rules.count_documents({}) == 3
+
+    async def test_seed_coupon_snapshots_runs_once(self, test_db):
+        """Test that counts predating the ledger are snapshotted a single time."""
+        legacy = await test_db.coupons.insert_one({"barcode": "A", "client_id": "c1", "count": 7})
+
+        await seed_coupon_snapshots(test_db)
+        later = await test_db.coupons.insert_one({"barcode": "A", "client_id": "c2", "count": 3})
+        await seed_coupon_snapshots(test_db)
+
+        state = await test_db.ledger_state.find_one({"_id": "compactor"})
+        snapshot = (await test_db.coupons.find_one({"_id": legacy.inserted_id}))["snapshot"]
+        assert snapshot == {"count": 7, "upto": state["upto"]}
+        assert "snapshot" not in await test_db.coupons.find_one({"_id": later.inserted_id})
+
+    async def test_order_coupon_events_by_seq(self, test_db):
+        """Test that legacy events and windows ordered by _id move to seq dates."""
+        upto = ObjectId.from_datetime(datetime(2025, 1, 1, tzinfo=timezone.utc))
+        event = await test_db.coupon_events.insert_one({"coupon_id": "c1", "delta": 1})
+        coupon = await test_db.coupons.insert_one(
+            {"barcode": "A", "client_id": "c1", "snapshot": {"count": 0, "upto": upto}}
+        )
+        await test_db.ledger_state.insert_one({"_id": "compactor", "upto": upto})
+
+        await order_coupon_events_by_seq(test_db)
+        await order_coupon_events_by_seq(test_db)
+
+        # Dates come back naive, in UTC
+        expected = datetime(2025, 1, 1)
+        seq = (await test_db.coupon_events.find_one({"_id": event.inserted_id}))["seq"]
+        assert seq == event.inserted_id.generation_time.replace(tzinfo=None)
+        assert (await test_db.coupons.find_one({"_id": coupon.inserted_id}))["snapshot"]["upto"] == expected
+        assert (await test_db.ledger_state.find_one({"_id": "compactor"}))["upto"] == expected
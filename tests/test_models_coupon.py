@@ -1,7 +1,7 @@
 import pytest
 from datetime import datetime
 from pydantic import ValidationError
-from app.models.coupon import CouponBase, CouponCreate, CouponInDB, Coupon
+from app.models.coupon import CouponBase, CouponCreate, CouponInDB, Coupon, StampBatchItem, MAX_BATCH_SIZE
 
 
 class TestCouponModels:
@@ -225,4 +225,14 @@ class TestCouponModels:
         coupon = Coupon(**coupon_data)
         coupon_json = coupon.json()
         assert '"barcode":"444555666777"' in coupon_json
-        assert '"count":7' in coupon_json
\ No newline at end of file
+        assert '"count":7' in coupon_json
+
+class TestStampBatchModels:
+    """Test bounds on batch stamp requests."""
+
+    def test_stamp_batch_item_n_bounds(self):
+        """Test that n is between 1 and the batch size limit."""
+        assert StampBatchItem(barcode="A", client_id="c1", n=MAX_BATCH_SIZE).n == MAX_BATCH_SIZE
+        for n in (0, MAX_BATCH_SIZE + 1):
+            with pytest.raises(ValidationError):
+                StampBatchItem(barcode="A", client_id="c1", n=n)
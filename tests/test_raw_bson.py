@@ -0,0 +1,66 @@
+import json
+import bson
+import pytest
+from bson import ObjectId
+from app.models.company import Company
+from app.utils import responses
+from app.utils.raw_bson import raw_list_response, read_batches, response_projection
+
+
+def projected_batch(count: int) -> bytes:
+    return b"".join(
+        bson.encode({"name": f"Cafe {i}", "description": None, "id": str(ObjectId()), "admin_id": "a", "n": 2**40 + i})
+        for i in range(count)
+    )
+
+
+async def batches(*items):
+    for item in items:
+        yield item
+
+
+class TestRawBSON:
+    """Test the raw BSON list pass-through with and without orjson."""
+
+    @pytest.fixture(params=["orjson", "pydantic-core"])
+    def encoder(self, request, monkeypatch):
+        if request.param == "orjson":
+            pytest.importorskip("orjson")
+        else:
+            monkeypatch.setattr(responses, "orjson", None)
+        return request.param
+
+    def test_response_projection(self):
+        """Test that the server is asked for exactly the response fields."""
+        assert response_projection(Company) == {
+            "_id": 0,
+            "name": "$name",
+            "description": {"$ifNull": ["$description", {"$literal": None}]},
+            "id": {"$toString": "$_id"},
+            "admin_id": "$admin_id",
+        }
+
+    @pytest.mark.asyncio
+    async def test_read_batches(self):
+        """Test that a small result is read back as one batch."""
+        first, second = projected_batch(2), projected_batch(1)
+
+        assert await read_batches(batches(first, second)) == first + second
+
+    @pytest.mark.asyncio
+    async def test_raw_list_response_streams_one_array(self, encoder):
+        """Test that several batches, empty ones included, stream as a single array."""
+        first, second = projected_batch(2), projected_batch(3)
+
+        response = raw_list_response(batches(first, b"", second))
+        body = b"".join([chunk async for chunk in response.body_iterator])
+
+        assert response.media_type == "application/json"
+        assert json.loads(body) == bson.decode_all(first + second)
+
+    @pytest.mark.asyncio
+    async def test_raw_list_response_empty(self, encoder):
+        """Test that no documents still make a valid array."""
+        response = raw_list_response(batches())
+
+        assert b"".join([chunk async for chunk in response.body_iterator]) == b"[]"
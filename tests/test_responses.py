@@ -0,0 +1,44 @@
+import json
+import pytest
+from datetime import datetime, timezone
+from typing import Optional
+from pydantic import BaseModel
+from app.utils import responses
+from app.utils.responses import model_response
+
+
+class Row(BaseModel):
+    id: str
+    name: str
+    description: Optional[str] = None
+    created_at: datetime
+
+
+class TestModelResponse:
+    """Test the fast response path with and without orjson."""
+
+    @pytest.fixture(params=["orjson", "pydantic-core"])
+    def encoder(self, request, monkeypatch):
+        if request.param == "orjson":
+            pytest.importorskip("orjson")
+        else:
+            monkeypatch.setattr(responses, "orjson", None)
+        return request.param
+
+    def test_matches_validated_output(self, encoder):
+        """Test that the body equals FastAPI's usual validate-then-encode output."""
+        docs = [
+            {"_id": "x", "id": str(i), "name": f"Cafe {i}", "created_at": datetime(2025, 1, 2, 3, 4, 5, 6000, tzinfo=timezone.utc)}
+            for i in range(3)
+        ]
+
+        response = model_response(Row, docs, status_code=201, headers={"X-Next-Cursor": "abc"})
+
+        assert response.status_code == 201
+        assert response.headers["X-Next-Cursor"] == "abc"
+        assert json.loads(response.body) == [Row.model_validate(doc).model_dump(mode="json") for doc in docs]
+
+    def test_single_document(self, encoder):
+        """Test that one document is rendered as an object without extra keys."""
+        response = model_response(Row, {"_id": "x", "id": "1", "name": "Cafe", "created_at": datetime(2025, 1, 1)})
+        assert json.loads(response.body) == {"id": "1", "name": "Cafe", "description": None, "created_at": "2025-01-01T00:00:00"}
@@ -0,0 +1,68 @@
+from bson import ObjectId
+from app.core.rule_index import CompiledRules, RuleEntry
+
+COFFEE = ObjectId("507f1f77bcf86cd799439041")
+CAKE = ObjectId("507f1f77bcf86cd799439042")
+LUNCH = ObjectId("507f1f77bcf86cd799439043")
+
+
+class TestCompiledRules:
+    """Test the bisect-based rule index."""
+
+    def rules(self):
+        # Deliberately out of order; compilation sorts by threshold
+        return CompiledRules([
+            {"_id": CAKE, "required_coupons": 20, "reward": "Free cake"},
+            {"_id": COFFEE, "required_coupons": 10, "reward": "Free coffee"},
+            {"_id": LUNCH, "required_coupons": 50, "reward": "Free lunch"},
+        ])
+
+    def test_sorted_by_threshold(self):
+        """Test that rules are ordered by required coupons."""
+        rules = self.rules()
+        assert list(rules.thresholds) == [10, 20, 50]
+        assert rules.cheapest() == RuleEntry(str(COFFEE), 10, "Free coffee")
+
+    def test_best_reachable(self):
+        """Test the highest reward a balance can pay for."""
+        rules = self.rules()
+        assert rules.best_reachable(9) is None
+        assert rules.best_reachable(10).reward == "Free coffee"
+        assert rules.best_reachable(49).reward == "Free cake"
+        assert rules.best_reachable(500).reward == "Free lunch"
+
+    def test_reachable(self):
+        """Test every reward a balance can pay for, cheapest first."""
+        rules = self.rules()
+        assert rules.reachable(9) == []
+        assert [rule.reward for rule in rules.reachable(20)] == ["Free coffee", "Free cake"]
+
+    def test_next_reward(self):
+        """Test the cheapest reward still out of reach."""
+        rules = self.rules()
+        assert rules.next_reward(0).reward == "Free coffee"
+        assert rules.next_reward(10).reward == "Free cake"
+        assert rules.stamps_to_next_reward(13) == 7
+        assert rules.next_reward(50) is None
+        assert rules.stamps_to_next_reward(50) is None
+
+    def test_unlocked(self):
+        """Test rules crossed by a count change."""
+        rules = self.rules()
+        assert rules.unlocked(9, 10) == [RuleEntry(str(COFFEE), 10, "Free coffee")]
+        assert rules.unlocked(10, 11) == []
+        assert [rule.reward for rule in rules.unlocked(0, 20)] == ["Free coffee", "Free cake"]
+
+    def test_get(self):
+        """Test looking a rule up by id."""
+        rules = self.rules()
+        assert rules.get(str(CAKE)).required_coupons == 20
+        assert rules.get(str(ObjectId())) is None
+
+    def test_empty(self):
+        """Test a company without rules."""
+        rules = CompiledRules([])
+        assert len(rules) == 0
+        assert rules.cheapest() is None
+        assert rules.best_reachable(100) is None
+        assert rules.unlocked(0, 100) == []
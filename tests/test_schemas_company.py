@@ -3,7 +3,7 @@ from bson import ObjectId
 from datetime import datetime, timezone
 from app.schemas.company import (
     create_company, get_company_by_id, get_companies_by_admin, 
-    get_all_companies, update_company, delete_company
+    get_all_companies, iter_companies_by_admin, update_company, delete_company
 )
 from app.models.company import CompanyCreate
 
@@ -201,4 +201,18 @@ class TestCompanySchemas:
         
         assert company.name == "Simple Cafe"
         assert company.description is None
-        assert company.admin_id == "507f1f77bcf86cd799439011"
\ No newline at end of file
+        assert company.admin_id == "507f1f77bcf86cd799439011"
+
+    async def test_iter_companies_by_admin(self, test_db):
+        """Test streaming the companies of one admin."""
+        admin_id = "507f1f77bcf86cd799439011"
+        await test_db.companies.insert_many([
+            {"name": f"Cafe {i}", "admin_id": admin_id, "created_at": datetime.now(timezone.utc)}
+            for i in range(3)
+        ] + [
+            {"name": "Other", "admin_id": "507f1f77bcf86cd799439022", "created_at": datetime.now(timezone.utc)}
+        ])
+        
+        names = [company.name async for company in iter_companies_by_admin(test_db, admin_id)]
+        
+        assert sorted(names) == ["Cafe 0", "Cafe 1", "Cafe 2"]
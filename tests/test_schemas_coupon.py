@@ -1,12 +1,15 @@
+import asyncio
 import pytest
 from bson import ObjectId
 from datetime import datetime, timezone
 from app.schemas.coupon import (
     create_coupon, get_coupon_by_id, get_coupon_by_barcode_and_client,
     get_coupons_by_client, get_coupons_by_company, update_coupon_count,
-    increment_coupon_count, delete_coupon
+    increment_coupon_count, delete_coupon, stamp_coupon, stamp_coupons_batch, redeem_coupon
 )
 from app.models.coupon import CouponCreate
+from app.indexes import ensure_indexes
+from pymongo.errors import DuplicateKeyError
 
 
 @pytest.mark.asyncio
@@ -292,4 +295,136 @@ class TestCouponSchemas:
         assert result is True
         
         coupon = await get_coupon_by_id(test_db, coupon_id)
-        assert coupon.count == 999999
\ No newline at end of file
+        assert coupon.count == 999999
+
+    async def test_stamp_coupon_creates_then_increments(self, test_db, sample_coupon_data):
+        """Test that the first stamp creates the coupon and later stamps add to it."""
+        client_id = "507f1f77bcf86cd799439011"
+        
+        first = await stamp_coupon(test_db, sample_coupon_data["company_id"], sample_coupon_data["barcode"], client_id)
+        second = await stamp_coupon(test_db, sample_coupon_data["company_id"], sample_coupon_data["barcode"], client_id)
+        
+        assert first.count == 1
+        assert second.count == 2
+        assert second.id == first.id
+        assert second.created_at == first.created_at
+
+    async def test_stamp_coupon_concurrent_first_stamps(self, test_db, sample_coupon_data):
+        """Test that racing first stamps end up on a single coupon."""
+        await ensure_indexes(test_db)
+        client_id = "507f1f77bcf86cd799439011"
+        
+        await asyncio.gather(*[
+            stamp_coupon(test_db, sample_coupon_data["company_id"], sample_coupon_data["barcode"], client_id)
+            for _ in range(50)
+        ])
+        
+        coupons = await get_coupons_by_client(test_db, client_id)
+        assert len(coupons) == 1
+        assert coupons[0].count == 50
+
+    async def test_stamp_coupon_barcode_of_other_company(self, test_db, sample_coupon_data):
+        """Test that a barcode held under another company is not stamped."""
+        await ensure_indexes(test_db)
+        client_id = "507f1f77bcf86cd799439011"
+        await stamp_coupon(test_db, sample_coupon_data["company_id"], sample_coupon_data["barcode"], client_id)
+        
+        with pytest.raises(DuplicateKeyError):
+            await stamp_coupon(test_db, "507f1f77bcf86cd799439099", sample_coupon_data["barcode"], client_id)
+
+    async def test_redeem_coupon(self, test_db, sample_coupon_data):
+        """Test that redemption spends the required stamps."""
+        client_id = "507f1f77bcf86cd799439011"
+        company_id, barcode = sample_coupon_data["company_id"], sample_coupon_data["barcode"]
+        await stamp_coupon(test_db, company_id, barcode, client_id, stamps=12)
+        
+        coupon = await redeem_coupon(test_db, company_id, barcode, client_id, 10)
+        
+        assert coupon.count == 2
+        assert await redeem_coupon(test_db, company_id, barcode, client_id, 10) is None
+        assert (await get_coupon_by_barcode_and_client(test_db, barcode, client_id)).count == 2
+
+    async def test_redeem_coupon_missing(self, test_db, sample_coupon_data):
+        """Test redeeming a coupon that does not exist."""
+        coupon = await redeem_coupon(
+            test_db, sample_coupon_data["company_id"], sample_coupon_data["barcode"], "507f1f77bcf86cd799439011", 1
+        )
+        
+        assert coupon is None
+
+    async def test_redeem_coupon_concurrent_no_double_spend(self, test_db, sample_coupon_data):
+        """Test that thousands of parallel redemptions never spend more than the balance."""
+        client_id = "507f1f77bcf86cd799439011"
+        company_id, barcode = sample_coupon_data["company_id"], sample_coupon_data["barcode"]
+        await stamp_coupon(test_db, company_id, barcode, client_id, stamps=1000)
+        
+        results = await asyncio.gather(*[
+            redeem_coupon(test_db, company_id, barcode, client_id, 10)
+            for _ in range(2000)
+        ])
+        
+        succeeded = [coupon for coupon in results if coupon is not None]
+        assert len(succeeded) == 100
+        # Every success observed a distinct balance on the way down to zero
+        assert sorted(coupon.count for coupon in succeeded) == list(range(0, 1000, 10))
+        assert (await get_coupon_by_barcode_and_client(test_db, barcode, client_id)).count == 0
+
+    async def test_stamp_coupons_batch(self, test_db, sample_coupon_data):
+        """Test that a batch upserts new coupons and increments existing ones."""
+        await ensure_indexes(test_db)
+        company_id, barcode = sample_coupon_data["company_id"], sample_coupon_data["barcode"]
+        await stamp_coupon(test_db, company_id, barcode, "client-1")
+        await stamp_coupon(test_db, "507f1f77bcf86cd799439099", barcode, "client-3")
+        
+        failed = await stamp_coupons_batch(test_db, company_id, {
+            (barcode, "client-1"): 4,
+            (barcode, "client-2"): 2,
+            (barcode, "client-3"): 1,
+        })
+        
+        assert failed == {(barcode, "client-3")}
+        assert (await get_coupon_by_barcode_and_client(test_db, barcode, "client-1")).count == 5
+        assert (await get_coupon_by_barcode_and_client(test_db, barcode, "client-2")).count == 2
+        assert (await get_coupon_by_barcode_and_client(test_db, barcode, "client-3")).count == 1
+
+    async def test_stamp_coupons_batch_idempotency_key(self, test_db, sample_coupon_data):
+        """Test that a retried batch skips the coupons its first attempt stamped."""
+        await ensure_indexes(test_db)
+        company_id, barcode = sample_coupon_data["company_id"], sample_coupon_data["barcode"]
+        await stamp_coupons_batch(test_db, company_id, {(barcode, "client-1"): 4}, idempotency_key="k3")
+
+        failed = await stamp_coupons_batch(test_db, company_id, {
+            (barcode, "client-1"): 4,
+            (barcode, "client-2"): 2,
+        }, idempotency_key="k3")
+
+        assert failed == set()
+        assert (await get_coupon_by_barcode_and_client(test_db, barcode, "client-1")).count == 4
+        assert (await get_coupon_by_barcode_and_client(test_db, barcode, "client-2")).count == 2
+
+    async def test_stamp_coupon_idempotency_key(self, test_db, sample_coupon_data):
+        """Test that a retried stamp replays the first result instead of stamping again."""
+        await ensure_indexes(test_db)
+        client_id = "507f1f77bcf86cd799439011"
+        company_id, barcode = sample_coupon_data["company_id"], sample_coupon_data["barcode"]
+        
+        first = await stamp_coupon(test_db, company_id, barcode, client_id, idempotency_key="k1")
+        await stamp_coupon(test_db, company_id, barcode, client_id)
+        retry = await stamp_coupon(test_db, company_id, barcode, client_id, idempotency_key="k1")
+        
+        assert first.count == retry.count == 1
+        assert (await get_coupon_by_barcode_and_client(test_db, barcode, client_id)).count == 2
+
+    async def test_redeem_coupon_idempotency_key(self, test_db, sample_coupon_data):
+        """Test that a retried redemption spends stamps only once."""
+        client_id = "507f1f77bcf86cd799439011"
+        company_id, barcode = sample_coupon_data["company_id"], sample_coupon_data["barcode"]
+        await stamp_coupon(test_db, company_id, barcode, client_id, stamps=25)
+        
+        results = await asyncio.gather(*[
+            redeem_coupon(test_db, company_id, barcode, client_id, 10, idempotency_key="k2")
+            for _ in range(20)
+        ])
+        
+        assert {coupon.count for coupon in results} == {15}
+        assert (await get_coupon_by_barcode_and_client(test_db, barcode, client_id)).count == 15
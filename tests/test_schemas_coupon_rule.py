@@ -2,7 +2,7 @@ import pytest
 from bson import ObjectId
 from app.schemas.coupon_rule import (
     create_coupon_rule, get_coupon_rule_by_id, get_coupon_rules_by_company,
-    update_coupon_rule, delete_coupon_rule
+    iter_coupon_rules_by_company, update_coupon_rule, delete_coupon_rule
 )
 from app.models.coupon_rule import CouponRuleCreate
 
@@ -205,4 +205,19 @@ class TestCouponRuleSchemas:
         rule_high = await get_coupon_rule_by_id(test_db, rule_id_high)
         
         assert rule_high.required_coupons == 1000
-        assert rule_high.reward == "Mega reward"
\ No newline at end of file
+        assert rule_high.reward == "Mega reward"
+
+    async def test_iter_coupon_rules_by_company_is_unbounded(self, test_db):
+        """Test that streaming returns every rule, well past the old 100 row cap."""
+        company_id = "507f1f77bcf86cd799439012"
+        await test_db.coupon_rules.insert_many([
+            {"company_id": company_id, "required_coupons": i + 1, "reward": f"Reward {i}"}
+            for i in range(250)
+        ])
+        
+        stream = iter_coupon_rules_by_company(test_db, company_id)
+        first = await anext(stream)
+        rest = [rule async for rule in stream]
+        
+        assert first.company_id == company_id
+        assert len(rest) == 249
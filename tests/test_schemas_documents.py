@@ -0,0 +1,97 @@
+import pytest
+from bson import ObjectId
+from datetime import datetime, timezone
+from pydantic import ValidationError
+from app.models.coupon import CouponInDB
+from app.models.coupon_rule import CouponRuleInDB
+from app.schemas import documents
+from app.schemas.documents import iter_models, to_model, to_models, with_id
+
+
+def coupon_doc(i: int = 0) -> dict:
+    now = datetime.now(timezone.utc)
+    return {
+        "_id": ObjectId(), "company_id": "507f1f77bcf86cd799439012", "barcode": f"B{i}",
+        "client_id": "507f1f77bcf86cd799439011", "count": i, "created_at": now, "updated_at": now,
+        "ops": [{"key": "k", "count": i, "at": now}],
+    }
+
+
+class AsyncCursor:
+    def __init__(self, docs):
+        self._docs = iter(docs)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class TestDocumentConversion:
+    """Test converting raw MongoDB documents into models."""
+
+    def test_to_models_matches_per_row_validation(self):
+        """Test that a batch converts exactly like Model(**doc) with a stringified _id."""
+        docs = [coupon_doc(i) for i in range(3)]
+        expected = [CouponInDB(**{**doc, "_id": str(doc["_id"])}) for doc in docs]
+
+        coupons = to_models(CouponInDB, docs)
+
+        assert coupons == expected
+        assert coupons[0].id == docs[0]["_id"]
+        assert not hasattr(coupons[0], "ops")
+
+    def test_to_models_reports_invalid_documents(self):
+        """Test that a document missing a required field still fails validation."""
+        docs = [coupon_doc(0), {k: v for k, v in coupon_doc(1).items() if k != "created_at"}]
+
+        with pytest.raises(ValidationError):
+            to_models(CouponInDB, docs)
+
+    def test_to_models_caches_adapter_per_model(self):
+        """Test that each model builds its list adapter once."""
+        to_models(CouponRuleInDB, [])
+        adapter = documents._list_adapter(CouponRuleInDB)
+
+        to_models(CouponRuleInDB, [{"_id": ObjectId(), "company_id": "c", "required_coupons": 5, "reward": "r"}])
+
+        assert documents._list_adapter(CouponRuleInDB) is adapter
+
+    def test_to_model(self):
+        """Test the single-document form, including a missing document."""
+        doc = coupon_doc(7)
+
+        assert to_model(CouponInDB, doc).count == 7
+        assert to_model(CouponInDB, None) is None
+
+    def test_with_id(self):
+        """Test the response dict carries the id as a string and leaves the document alone."""
+        doc = coupon_doc()
+
+        result = with_id(doc)
+
+        assert result["id"] == str(doc["_id"])
+        assert isinstance(doc["_id"], ObjectId)
+        assert "id" not in doc
+
+    @pytest.mark.asyncio
+    async def test_iter_models_converts_in_pages(self, monkeypatch):
+        """Test that streaming converts one page per call and yields every document."""
+        calls = []
+        original = documents.to_models
+
+        def counting_to_models(model, docs):
+            calls.append(len(docs))
+            return original(model, docs)
+
+        monkeypatch.setattr(documents, "to_models", counting_to_models)
+        docs = [coupon_doc(i) for i in range(documents.PAGE_SIZE * 2 + 5)]
+
+        coupons = [coupon async for coupon in iter_models(CouponInDB, AsyncCursor(docs))]
+
+        assert [coupon.barcode for coupon in coupons] == [doc["barcode"] for doc in docs]
+        assert calls == [documents.PAGE_SIZE, documents.PAGE_SIZE, 5]
@@ -152,4 +152,32 @@ class TestUserSchemas:
         # Check that the original password is not in the database document
         user_doc = await test_db.users.find_one({"_id": ObjectId(user_id)})
         assert "password" not in user_doc
-        assert user_doc["hashed_password"] == hashed_password
\ No newline at end of file
+        assert user_doc["hashed_password"] == hashed_password
+
+    async def test_update_user_invalidates_principal_cache(self, test_db, sample_user_data):
+        """Test that updating a user drops its cached principal."""
+        from app.core.principals import principal_cache
+        from app.models.user import User
+        user_create = UserCreate(**sample_user_data)
+        user_id = await create_user(test_db, user_create, "hashed_password_123")
+        cached = User(id=user_id, email=sample_user_data["email"],
+                      name=sample_user_data["name"], role=sample_user_data["role"])
+        principal_cache.set(sample_user_data["email"], (cached, 0))
+
+        await update_user(test_db, user_id, {"role": UserRole.CLIENT})
+
+        assert principal_cache.get(sample_user_data["email"]) is None
+
+    async def test_delete_user_invalidates_principal_cache(self, test_db, sample_user_data):
+        """Test that deleting a user drops its cached principal."""
+        from app.core.principals import principal_cache
+        from app.models.user import User
+        user_create = UserCreate(**sample_user_data)
+        user_id = await create_user(test_db, user_create, "hashed_password_123")
+        cached = User(id=user_id, email=sample_user_data["email"],
+                      name=sample_user_data["name"], role=sample_user_data["role"])
+        principal_cache.set(sample_user_data["email"], (cached, 0))
+
+        await delete_user(test_db, user_id)
+
+        assert principal_cache.get(sample_user_data["email"]) is None
@@ -0,0 +1,358 @@
+import os
+import httpx
+import pytest
+import pytest_asyncio
+from unittest.mock import AsyncMock, Mock
+from bson import ObjectId
+from datetime import datetime, timezone
+from app.main import app
+from app.api.coupon import get_current_admin, get_db
+from app.core.companies import company_owners, company_rules
+from app.core.idempotency import recent_responses
+from app.core.write_behind import CounterAggregator
+from app.models.user import User
+from app.schemas import coupon as coupon_schemas
+
+HOT = "507f1f77bcf86cd799439031"
+COLD = "507f1f77bcf86cd799439032"
+
+
+def aggregator(journal_dir, **kwargs):
+    options = {"flush_interval_ms": 60000, "flush_max_ops": 1000, "node_id": "node.1"}
+    options.update(kwargs)
+    return CounterAggregator(str(journal_dir), **options)
+
+
+def mongo(last_seq=None):
+    """A mock database whose write_behind_slots holds ``last_seq`` for every node."""
+    mock_db = AsyncMock()
+    mock_db.write_behind_slots.find_one.return_value = None if last_seq is None else {"seq": last_seq}
+    return mock_db
+
+
+def coupon_doc(coupon_id, count, barcode="123456789012", client_id="507f1f77bcf86cd799439011"):
+    return {
+        "_id": ObjectId(coupon_id),
+        "company_id": "507f1f77bcf86cd799439012",
+        "barcode": barcode,
+        "client_id": client_id,
+        "count": count,
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc),
+    }
+
+
+@pytest_asyncio.fixture
+async def buffered(tmp_path, monkeypatch):
+    """A started aggregator standing in for the global one."""
+    counters = aggregator(tmp_path)
+    monkeypatch.setattr(coupon_schemas, "coupon_counters", counters)
+    mock_db = mongo()
+    await counters.start(mock_db)
+    yield counters, mock_db
+    await counters.stop()
+
+
+def segments(journal_dir):
+    return sorted(
+        os.path.join(slot, name)
+        for slot in os.listdir(journal_dir)
+        for name in os.listdir(os.path.join(journal_dir, slot))
+        if name.startswith("segment-")
+    )
+
+
+@pytest.mark.asyncio
+class TestCounterAggregator:
+    """Test write-behind aggregation, journaling and replay."""
+
+    async def test_flush_aggregates_into_one_bulk_write(self, tmp_path):
+        """Test that buffered increments reach MongoDB as one bulk write per flush."""
+        mock_db = mongo()
+        counters = aggregator(tmp_path)
+        await counters.start(mock_db)
+        for _ in range(5):
+            counters.increment(HOT)
+        counters.increment(COLD, 2)
+
+        assert counters.pending_delta(HOT) == 5
+        await counters.flush()
+
+        mock_db.coupons.bulk_write.assert_awaited_once()
+        operations = mock_db.coupons.bulk_write.call_args.args[0]
+        assert [(op._filter["_id"], op._doc["$inc"]["count"]) for op in operations] == [
+            (ObjectId(HOT), 5), (ObjectId(COLD), 2)
+        ]
+        # Dots would turn the node id into a nested path
+        assert "write_behind_seq.node_1-0" in operations[0]._filter
+        assert counters.pending_delta(HOT) == 0
+        assert counters.stats()["flushes"] == 1
+        await counters.stop()
+        assert segments(tmp_path) == []
+
+    async def test_flush_after_max_ops(self, tmp_path):
+        """Test that reaching the op threshold schedules a flush."""
+        mock_db = mongo()
+        counters = aggregator(tmp_path, flush_max_ops=3)
+        await counters.start(mock_db)
+        for _ in range(3):
+            counters.increment(HOT)
+
+        await counters._flush_task
+
+        mock_db.coupons.bulk_write.assert_awaited_once()
+        await counters.stop()
+
+    async def test_failed_flush_is_retried_with_same_sequence(self, tmp_path):
+        """Test that a failed segment stays pending and is replayed idempotently."""
+        mock_db = mongo()
+        mock_db.coupons.bulk_write.side_effect = [Exception("primary stepped down"), None]
+        counters = aggregator(tmp_path)
+        await counters.start(mock_db)
+        counters.increment(HOT)
+
+        with pytest.raises(Exception):
+            await counters.flush()
+        assert counters.pending_delta(HOT) == 1
+        assert len(segments(tmp_path)) == 2
+
+        await counters.flush()
+
+        first, second = [call.args[0][0]._filter for call in mock_db.coupons.bulk_write.call_args_list]
+        assert first == second
+        assert counters.stats()["flush_failures"] == 1
+        assert counters.pending_delta(HOT) == 0
+        await counters.stop()
+
+    async def test_journal_replayed_after_crash(self, tmp_path):
+        """Test that increments journaled by a crashed process are flushed on startup."""
+        crashed = aggregator(tmp_path)
+        await crashed.start(mongo())
+        crashed.increment(HOT)
+        crashed.increment(HOT)
+        # Simulate a torn write from the crash
+        os.write(crashed._fd, f"{COLD} 1".encode("ascii"))
+        os.close(crashed._fd)
+        os.close(crashed._slot_fd)
+
+        mock_db = mongo()
+        restarted = aggregator(tmp_path)
+        await restarted.start(mock_db)
+
+        operations = mock_db.coupons.bulk_write.call_args.args[0]
+        assert [(op._filter["_id"], op._doc["$inc"]["count"]) for op in operations] == [(ObjectId(HOT), 2)]
+        await restarted.stop()
+        assert segments(tmp_path) == []
+
+    async def test_workers_sharing_a_directory_get_their_own_slots(self, tmp_path):
+        """Test that a second worker neither touches nor replays a live worker's journal."""
+        first_db, second_db = mongo(), mongo()
+        first = aggregator(tmp_path)
+        await first.start(first_db)
+        first.increment(HOT)
+        second = aggregator(tmp_path)
+        await second.start(second_db)
+        second.increment(HOT)
+
+        assert (first.journal_dir, second.journal_dir) == (
+            str(tmp_path / "worker-0"), str(tmp_path / "worker-1")
+        )
+        second_db.coupons.bulk_write.assert_not_called()
+        await first.flush()
+        await second.flush()
+        first_filter = first_db.coupons.bulk_write.call_args.args[0][0]._filter
+        second_filter = second_db.coupons.bulk_write.call_args.args[0][0]._filter
+        assert "write_behind_seq.node_1-0" in first_filter
+        assert "write_behind_seq.node_1-1" in second_filter
+        await first.stop()
+        await second.stop()
+
+    async def test_abandoned_slot_is_replayed_under_its_own_node_id(self, tmp_path):
+        """Test that segments of a slot no process holds are flushed by the next worker."""
+        crashed = [aggregator(tmp_path), aggregator(tmp_path)]
+        for counters in crashed:
+            await counters.start(mongo())
+        crashed[1].increment(COLD, 3)
+        for counters in crashed:
+            os.close(counters._fd)
+            os.close(counters._slot_fd)
+
+        mock_db = mongo()
+        restarted = aggregator(tmp_path)
+        await restarted.start(mock_db)
+
+        assert restarted.journal_dir == str(tmp_path / "worker-0")
+        operations = mock_db.coupons.bulk_write.call_args.args[0]
+        assert [(op._filter["_id"], op._doc["$inc"]["count"]) for op in operations] == [(ObjectId(COLD), 3)]
+        assert "write_behind_seq.node_1-1" in operations[0]._filter
+        await restarted.stop()
+        assert segments(tmp_path) == []
+
+    async def test_flush_is_idempotent_against_mongo(self, test_db, tmp_path):
+        """Test that replaying an already applied segment does not count twice."""
+        result = await test_db.coupons.insert_one({
+            "company_id": "507f1f77bcf86cd799439012",
+            "barcode": "123456789012",
+            "client_id": "507f1f77bcf86cd799439011",
+            "count": 0,
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc),
+        })
+        counters = aggregator(tmp_path)
+        await counters.start(test_db)
+        counters.increment(str(result.inserted_id), 3)
+
+        await counters._write_segment(42, {str(result.inserted_id): 3})
+        await counters._write_segment(42, {str(result.inserted_id): 3})
+
+        coupon = await test_db.coupons.find_one({"_id": result.inserted_id})
+        assert coupon["count"] == 3
+        await counters.stop()
+
+    async def test_schema_reads_merge_pending_increments(self, tmp_path, monkeypatch):
+        """Test write-behind increment_coupon_count and the merged read path."""
+        counters = aggregator(tmp_path)
+        monkeypatch.setattr(coupon_schemas, "coupon_counters", counters)
+        mock_db = mongo()
+        mock_db.coupons.find_one.return_value = {
+            "_id": ObjectId(HOT),
+            "company_id": "507f1f77bcf86cd799439012",
+            "barcode": "123456789012",
+            "client_id": "507f1f77bcf86cd799439011",
+            "count": 4,
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc),
+        }
+        await counters.start(mock_db)
+
+        assert await coupon_schemas.increment_coupon_count(mock_db, HOT) is True
+        coupon = await coupon_schemas.get_coupon_by_id(mock_db, HOT)
+
+        mock_db.coupons.update_one.assert_not_called()
+        assert coupon.count == 5
+        await counters.stop()
+
+    async def test_stamp_is_buffered(self, buffered):
+        """Test that an unkeyed stamp only ensures the coupon and buffers the increment."""
+        counters, mock_db = buffered
+        mock_db.coupons.find_one_and_update.return_value = coupon_doc(HOT, 4)
+
+        coupon = await coupon_schemas.stamp_coupon(
+            mock_db, "507f1f77bcf86cd799439012", "123456789012", "507f1f77bcf86cd799439011", stamps=2
+        )
+
+        update = mock_db.coupons.find_one_and_update.call_args.args[1]
+        assert list(update) == ["$setOnInsert"]
+        assert counters.pending_delta(HOT) == 2
+        # Write-behind markers pile up on hot coupons and never reach the caller
+        assert mock_db.coupons.find_one_and_update.call_args.kwargs["projection"] == coupon_schemas.COUPON_PROJECTION
+        assert coupon.count == 6
+
+    async def test_stamp_batch_is_buffered(self, buffered):
+        """Test that a batch creates missing coupons and buffers every applied stamp."""
+        counters, mock_db = buffered
+        cursor = Mock()
+        cursor.to_list = AsyncMock(return_value=[coupon_doc(HOT, 0, "A", "c1"), coupon_doc(COLD, 0, "B", "c2")])
+        mock_db.coupons.find = Mock(return_value=cursor)
+
+        failed = await coupon_schemas.stamp_coupons_batch(
+            mock_db, "507f1f77bcf86cd799439012", {("A", "c1"): 3, ("B", "c2"): 1}
+        )
+
+        operations = mock_db.coupons.bulk_write.call_args.args[0]
+        assert failed == set()
+        assert all(list(op._doc) == ["$setOnInsert"] for op in operations)
+        assert (counters.pending_delta(HOT), counters.pending_delta(COLD)) == (3, 1)
+
+    async def test_keyed_stamp_is_written_through(self, buffered):
+        """Test that /stamp with an Idempotency-Key records the key in the coupon update instead of buffering."""
+        counters, mock_db = buffered
+        admin = User(id="507f1f77bcf86cd799439099", email="admin@example.com", name="Admin", role="admin")
+        mock_db.companies.find_one.return_value = {"_id": ObjectId("507f1f77bcf86cd799439012"), "admin_id": admin.id}
+        rules_cursor = Mock()
+        rules_cursor.to_list = AsyncMock(return_value=[])
+        mock_db.coupon_rules.find = Mock(return_value=rules_cursor)
+        mock_db.coupons.find_one_and_update.return_value = coupon_doc(HOT, 4)
+        app.dependency_overrides[get_db] = lambda: mock_db
+        app.dependency_overrides[get_current_admin] = lambda: admin
+        company_owners.clear()
+        company_rules.clear()
+        recent_responses.clear()
+        stamp = {"company_id": "507f1f77bcf86cd799439012", "barcode": "123456789012",
+                 "client_id": "507f1f77bcf86cd799439011"}
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+                response = await client.post("/api/coupons/stamp", json=stamp, headers={"Idempotency-Key": "k1"})
+        finally:
+            app.dependency_overrides.clear()
+            company_owners.clear()
+            company_rules.clear()
+            recent_responses.clear()
+
+        assert response.status_code == 200
+        assert response.json()["count"] == 4
+        mock_db.idempotency_keys.insert_one.assert_not_called()
+        [stage, ops] = mock_db.coupons.find_one_and_update.call_args.args[1]
+        assert stage["$set"]["count"] == {"$add": [{"$ifNull": ["$count", 0]}, 1]}
+        [op] = ops["$set"]["ops"]["$slice"][0]["$concatArrays"][1]
+        assert op["key"] == {"$literal": f"{admin.id}:stamp:k1"}
+        assert counters.pending_delta(HOT) == 0
+
+    async def test_redeem_spends_buffered_stamps(self, buffered):
+        """Test that a redemption short of stored stamps flushes the buffered ones and retries."""
+        counters, mock_db = buffered
+        counters.increment(HOT, 3)
+        mock_db.coupons.find_one_and_update.side_effect = [None, coupon_doc(HOT, 0)]
+
+        coupon = await coupon_schemas.redeem_coupon(
+            mock_db, "507f1f77bcf86cd799439012", "123456789012", "507f1f77bcf86cd799439011", 3
+        )
+
+        mock_db.coupons.bulk_write.assert_awaited_once()
+        first, second = mock_db.coupons.find_one_and_update.call_args_list
+        assert first.args == second.args
+        assert counters.pending_delta(HOT) == 0
+        assert coupon.count == 0
+
+    async def test_redeem_without_buffered_stamps_does_not_flush(self, buffered):
+        """Test that a redemption that can't be covered fails after one update when nothing is buffered."""
+        counters, mock_db = buffered
+        mock_db.coupons.find_one_and_update.return_value = None
+
+        coupon = await coupon_schemas.redeem_coupon(
+            mock_db, "507f1f77bcf86cd799439012", "123456789012", "507f1f77bcf86cd799439011", 3
+        )
+
+        assert coupon is None
+        mock_db.coupons.find_one_and_update.assert_awaited_once()
+        mock_db.coupons.bulk_write.assert_not_called()
+
+    async def test_node_id_is_required(self, tmp_path):
+        """Test that write-behind refuses to start without a stable node id."""
+        counters = aggregator(tmp_path, node_id="")
+
+        with pytest.raises(RuntimeError):
+            await counters.start(mongo())
+
+    async def test_sequence_never_goes_backwards_across_restarts(self, tmp_path, monkeypatch):
+        """Test that a restart with the clock behind the last flushed segment continues after it."""
+        mock_db = mongo()
+        counters = aggregator(tmp_path)
+        await counters.start(mock_db)
+        counters.increment(HOT)
+        await counters.flush()
+        persisted = mock_db.write_behind_slots.update_one.call_args.args
+        assert persisted[0] == {"_id": "node_1-0"}
+        last_seq = persisted[1]["$max"]["seq"]
+        await counters.stop()
+
+        monkeypatch.setattr("app.core.write_behind.time.time_ns", lambda: 1)
+        mock_db = mongo(last_seq)
+        restarted = aggregator(tmp_path)
+        await restarted.start(mock_db)
+        restarted.increment(HOT)
+        await restarted.flush()
+
+        operation = mock_db.coupons.bulk_write.call_args.args[0][0]
+        assert operation._filter["write_behind_seq.node_1-0"] == {"$not": {"$gte": last_seq + 1}}
+        await restarted.stop()